@@ -1,38 +1,341 @@
+"""Batch analysis of the notes (summary_analysis prompt).
+
+Standalone: it talks to the LLM through backends/llm_client and does not
+import the web app (main.py loads the ASR model at import time). Notes are
+analysed by a bounded pool of threads (ANALYZE_WORKERS); every call goes
+through the process-wide rate limiter and circuit breaker of llm_client,
+and a 429 seen by one worker pauses the whole pool.
+
+By default the notes are the transcripts of the artifacts index (what the
+app and the legacy import produced, per user): every transcript whose job
+has no analysis yet gets one, stored as that user's `analysis` artifact of
+the same job. `note_analyses` maps the template cache key of the transcript
+digest (PromptTemplate.cache_key) to the analysis artifact, so the same
+content uploaded by several users or jobs is analysed once and linked.
+
+--folder analyses flat `*.txt` files instead (pre-index installations).
+Results are then streamed: each finished analysis is appended (and fsynced)
+to `summaries/combined_analysis_<ts>.txt.part`. An interrupted run is
+resumed by the next one - it continues the same .part file and skips notes
+already in the manifest; when nothing is left the file is renamed to .txt.
+
+In both modes unchanged notes are not analysed again unless --force is
+given.
+
+Usage:
+  python analyze_notes.py [--user jan] [--workers 3] [--force]
+  python analyze_notes.py --folder notes_data [--workers 3] [--force]
+"""
 import os
+import sys
+import time
+import random
+import hashlib
+import argparse
 import datetime
-from main import analyze_single_summary
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, Optional
 
+from artifacts import BASE_DIR, ArtifactStore
+from backends import BackendError, get_completion_backend
+from llm_client import (CircuitOpenError, Deadline, DeadlineExceeded, chat_completion, classify_error, groq_breaker,
+                        groq_limiter)
+from prompts import PromptTemplate, get_template
+from search_index import SearchIndex
+from storage import Store, get_store
+
+# === KONFIGURACJA ===
 NOTES_FOLDER = "notes_data"
-SUMMARY_FOLDER = "summaries"  # folder na gotowe analizy
-
-def analyze_all_notes():
-    os.makedirs(SUMMARY_FOLDER, exist_ok=True)
-    
-    # lista wszystkich plików .txt w notes_data
-    all_files = sorted([f for f in os.listdir(NOTES_FOLDER) if f.endswith(".txt")])
-    
-    if not all_files:
-        print("Brak plików w notes_data do analizy")
-        return
-    
-    combined_results = []
-    
-    for fname in all_files:
-        file_path = os.path.join(NOTES_FOLDER, fname)
-        print(f"Analizuję: {fname}")
-        try:
-            analysis = analyze_single_summary(file_path)
-            combined_results.append(f"--- {fname} ---\n{analysis}\n")
-        except Exception as e:
-            print(f"[Błąd] Nie udało się przeanalizować {fname}: {e}")
-    
-    # scal wszystkie wyniki w jeden plik
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    output_file = os.path.join(SUMMARY_FOLDER, f"combined_analysis_{timestamp}.txt")
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("\n\n".join(combined_results))
-    
-    print(f"✅ Analiza zakończona. Zapisano w: {output_file}")
+SUMMARY_FOLDER = "summaries"  # folder na gotowe analizy (tryb --folder)
+MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
+ANALYZE_WORKERS = int(os.environ.get("ANALYZE_WORKERS", "3"))
+# budżet czasu całego przebiegu; niedokończone notatki zostają na następny
+ANALYZE_DEADLINE_S = float(os.environ.get("ANALYZE_DEADLINE_S", "3600"))
+ANALYZE_MAX_ATTEMPTS = int(os.environ.get("ANALYZE_MAX_ATTEMPTS", "4"))
+# transkrypcje czytamy z indeksu porcjami - bez ładowania wszystkich wierszy naraz
+ANALYZE_PAGE = 200
+
+ANALYSIS_MANIFEST_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS note_analyses (
+        cache_key TEXT PRIMARY KEY,
+        digest TEXT NOT NULL,
+        template TEXT NOT NULL,
+        name TEXT NOT NULL,
+        artifact_id BIGINT,
+        output_file TEXT,
+        analyzed_at TEXT NOT NULL
+    )""",
+]
+
+
+def open_artifacts(store: Optional[Store] = None) -> ArtifactStore:
+    """The app's artifact index, with new texts fed to the search indexes like in main.py."""
+    notes, summaries = os.path.join(BASE_DIR, "notes_data"), os.path.join(BASE_DIR, "summary_data")
+    artifacts = ArtifactStore({"audio": notes, "wav": notes, "transcript": notes,
+                               "summary": summaries, "analysis": summaries}, store=store)
+    search_index = SearchIndex(artifacts.store)
+    artifacts.on_write(search_index.index_artifact)
+    artifacts.on_delete(search_index.remove_artifact)
+    try:
+        from related_index import get_related_index
+        related = get_related_index()
+        if related is not None:
+            artifacts.on_write(related.index_artifact)
+            artifacts.on_delete(related.remove_artifact)
+    except Exception as e:
+        print(f"Warning: related index unavailable: {e}")
+    return artifacts
+
+
+class NoteAnalyzer:
+    def __init__(self, backend=None, template: Optional[PromptTemplate] = None, model: str = MODEL,
+                 store: Optional[Store] = None, workers: int = ANALYZE_WORKERS):
+        self.backend = backend or get_completion_backend()
+        self.template = template or get_template("summary_analysis")
+        self.model = model
+        self.store = store or get_store()
+        self.store.ensure_schema(ANALYSIS_MANIFEST_SCHEMA)
+        self.workers = max(1, workers)
+        self._write_lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    # === MANIFEST ===
+    def done(self) -> set:
+        """Cache keys of the notes already analysed with this template version."""
+        rows = self.store.execute("SELECT cache_key FROM note_analyses WHERE template = ?", (self.template.key,))
+        return {r["cache_key"] for r in rows}
+
+    def lookup(self, digest: str) -> Optional[Dict[str, Any]]:
+        rows = self.store.execute("SELECT * FROM note_analyses WHERE cache_key = ?",
+                                  (self.template.cache_key(digest),))
+        return rows[0] if rows else None
+
+    def _record(self, digest: str, name: str, output_file: Optional[str] = None,
+                artifact_id: Optional[int] = None) -> None:
+        self.store.execute(
+            "INSERT INTO note_analyses (cache_key, digest, template, name, artifact_id, output_file, analyzed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (cache_key) DO UPDATE SET name = excluded.name, artifact_id = excluded.artifact_id, "
+            "output_file = excluded.output_file, analyzed_at = excluded.analyzed_at",
+            (self.template.cache_key(digest), digest, self.template.key, name, artifact_id, output_file,
+             datetime.datetime.now().isoformat()),
+        )
+
+    # === ANALIZA ===
+    def analyze_text(self, text: str, deadline: Optional[Deadline] = None) -> str:
+        """One analysis with retries; rate-limit errors pause every worker, not just this one."""
+        messages = self.template.render(text=text)
+        for attempt in range(1, ANALYZE_MAX_ATTEMPTS + 1):
+            try:
+                return chat_completion(self.backend, self.model, messages, self.template.temperature,
+                                       self.template.max_tokens, deadline=deadline)
+            except DeadlineExceeded:
+                raise
+            except CircuitOpenError as e:
+                if attempt == ANALYZE_MAX_ATTEMPTS:
+                    raise
+                sleep_time = groq_breaker.snapshot()["retry_in_s"] + random.uniform(0, 1)
+                print(f"[WARN] {e}. Próba {attempt}/{ANALYZE_MAX_ATTEMPTS}. Czekam {int(sleep_time)}s.")
+            except Exception as e:
+                if attempt == ANALYZE_MAX_ATTEMPTS:
+                    raise
+                if classify_error(e) == "rate_limit":
+                    sleep_time = 30 * attempt + random.uniform(0, 5)
+                    groq_limiter.pause(sleep_time)
+                    print(f"[WARN] Wykryto limit (429). Wstrzymuję wywołania na {int(sleep_time)}s.")
+                    # czekanie odbywa się w limiterze przy kolejnym acquire
+                    continue
+                sleep_time = 5 * (2 ** (attempt - 1)) + random.uniform(0, 3)
+                print(f"[WARN] Błąd wywołania LLM (próba {attempt}/{ANALYZE_MAX_ATTEMPTS}): {e}. "
+                      f"Czekam {int(sleep_time)}s.")
+            if deadline is not None and sleep_time >= deadline.remaining():
+                raise DeadlineExceeded("Deadline przebiegu upłynie przed kolejną próbą - przerywam.")
+            time.sleep(sleep_time)
+        raise RuntimeError("Nie udało się wygenerować analizy po kilku próbach.")
+
+    def _drive(self, pending: Iterator[Dict[str, Any]], work: Callable[[Dict[str, Any], Deadline], Any],
+               deliver: Callable[[Dict[str, Any], Any], None]) -> Dict[str, Any]:
+        """Run `work` over `pending` in the pool; `deliver` is called in this thread as results arrive."""
+        deadline = Deadline(ANALYZE_DEADLINE_S)
+        report: Dict[str, Any] = {"analyzed": 0, "failed": 0}
+        in_flight: Dict[Any, Dict[str, Any]] = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def fill():
+                # ograniczone okno zadań - nie czytamy wszystkich notatek do pamięci naraz
+                while len(in_flight) < self.workers * 2 and not deadline.expired():
+                    note = next(pending, None)
+                    if note is None:
+                        return
+                    print(f"Analizuję: {note['name']}")
+                    in_flight[pool.submit(work, note, deadline)] = note
+
+            fill()
+            while in_flight:
+                finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    note = in_flight.pop(future)
+                    try:
+                        deliver(note, future.result())
+                    except Exception as e:
+                        # bez wpisu w manifeście - następny przebieg spróbuje ponownie
+                        print(f"[Błąd] Nie udało się przeanalizować {note['name']}: {e}")
+                        report["failed"] += 1
+                        continue
+                    report["analyzed"] += 1
+                fill()
+
+        report["left"] = next(pending, None) is not None
+        report["complete"] = not (report["failed"] or report["left"])
+        return report
+
+    # === TRANSKRYPCJE Z INDEKSU ARTEFAKTÓW ===
+    def _pending_transcripts(self, artifacts: ArtifactStore, username: Optional[str],
+                             force: bool) -> Iterator[Dict[str, Any]]:
+        """Transcripts of jobs without an analysis artifact, oldest first, read page by page."""
+        sql = "SELECT t.* FROM artifacts t WHERE t.kind = 'transcript' AND t.job_id IS NOT NULL AND t.size > 0"
+        params: list = []
+        if username:
+            sql += " AND t.username = ?"
+            params.append(username.lower())
+        if not force:
+            sql += (" AND NOT EXISTS (SELECT 1 FROM artifacts a WHERE a.username = t.username "
+                    "AND a.job_id = t.job_id AND a.kind = 'analysis')")
+        sql += " AND t.id > ? ORDER BY t.id LIMIT ?"
+        last_id = 0
+        while True:
+            rows = artifacts.store.execute(sql, tuple(params) + (last_id, ANALYZE_PAGE))
+            if not rows:
+                return
+            for row in rows:
+                yield row
+            last_id = rows[-1]["id"]
+
+    def _analyze_transcript(self, artifacts: ArtifactStore, transcript: Dict[str, Any], deadline: Deadline,
+                            force: bool = False) -> Optional[Dict[str, Any]]:
+        text = artifacts.read_text(transcript)
+        if not text.strip():
+            return None
+        digest = transcript["digest"] or hashlib.sha256(text.encode("utf-8")).hexdigest()
+        name = f"analysis_{os.path.splitext(transcript['name'])[0]}.txt"
+        with self._write_lock:
+            key_lock = self._key_locks.setdefault(self.template.cache_key(digest), threading.Lock())
+        # ta sama treść w dwóch zadaniach naraz - drugie czeka na wpis pierwszego w manifeście
+        with key_lock:
+            hit = None if force else self.lookup(digest)
+            if hit and hit["artifact_id"] is not None:
+                rows = artifacts.store.execute("SELECT * FROM artifacts WHERE id = ?", (hit["artifact_id"],))
+                if rows and rows[0]["digest"]:
+                    # ta sama treść i wersja promptu - współdzielimy gotową analizę zamiast pytać LLM
+                    return artifacts.link(rows[0], transcript["username"], transcript["job_id"])
+            analysis = self.analyze_text(text, deadline)
+            artifact = artifacts.write(transcript["username"], "analysis", name, analysis, transcript["job_id"])
+            self._record(digest, transcript["name"], artifact_id=artifact["id"])
+            return artifact
+
+    def run_artifacts(self, artifacts: Optional[ArtifactStore] = None, username: Optional[str] = None,
+                      force: bool = False) -> Dict[str, Any]:
+        """Analyse app transcripts; each result is the user's `analysis` artifact of the transcript's job."""
+        artifacts = artifacts or open_artifacts(self.store)
+        return self._drive(self._pending_transcripts(artifacts, username, force),
+                           lambda t, deadline: self._analyze_transcript(artifacts, t, deadline, force),
+                           lambda t, artifact: None)
+
+    # === TRYB --folder (pliki *.txt) ===
+    def _analyze_file(self, note: Dict[str, str], deadline: Deadline) -> str:
+        with open(note["path"], "r", encoding="utf-8") as f:
+            return self.analyze_text(f.read(), deadline)
+
+    def _pending(self, folder: str, force: bool) -> Iterator[Dict[str, str]]:
+        done = set() if force else self.done()
+        for fname in sorted(f for f in os.listdir(folder) if f.endswith(".txt")):
+            path = os.path.join(folder, fname)
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            key = self.template.cache_key(digest)
+            if key not in done:
+                done.add(key)  # ta sama treść pod dwiema nazwami - jedna analiza
+                yield {"name": fname, "path": path, "digest": digest}
+
+    @staticmethod
+    def _output_file(out_dir: str) -> str:
+        """Unfinished .part file of an interrupted run, or a new one."""
+        parts = sorted(f for f in os.listdir(out_dir) if f.startswith("combined_analysis_") and f.endswith(".txt.part"))
+        if parts:
+            print(f"Wznawiam przerwany przebieg: {parts[-1]}")
+            return os.path.join(out_dir, parts[-1])
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        return os.path.join(out_dir, f"combined_analysis_{timestamp}.txt.part")
+
+    def _append(self, output_file: str, name: str, analysis: str) -> None:
+        with self._write_lock:
+            with open(output_file, "a", encoding="utf-8") as f:
+                f.write(f"--- {name} ---\n{analysis}\n\n\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run(self, folder: str = NOTES_FOLDER, out_dir: str = SUMMARY_FOLDER, force: bool = False) -> Dict[str, Any]:
+        os.makedirs(out_dir, exist_ok=True)
+        output_file = self._output_file(out_dir)
+
+        def deliver(note, analysis):
+            self._append(output_file, note["name"], analysis)
+            self._record(note["digest"], note["name"], output_file=os.path.basename(output_file)[:-len(".part")])
+
+        report = self._drive(self._pending(folder, force), self._analyze_file, deliver)
+        report["output_file"] = None
+        if not report["complete"]:
+            # .part zostaje - następny przebieg dopisze resztę do tego samego pliku
+            report["output_file"] = output_file
+        elif os.path.exists(output_file):
+            final = output_file[:-len(".part")]
+            os.replace(output_file, final)
+            report["output_file"] = final
+        return report
+
+
+def analyze_all_notes(folder: Optional[str] = None, workers: int = ANALYZE_WORKERS, force: bool = False,
+                      username: Optional[str] = None):
+    """Analyse the indexed transcripts (all users or `username`), or the *.txt files of `folder`."""
+    if folder is None:
+        report = NoteAnalyzer(workers=workers).run_artifacts(username=username, force=force)
+        if report["complete"]:
+            print(f"✅ Analiza zakończona ({report['analyzed']} notatek)")
+        else:
+            print(f"⚠️ Przeanalizowano {report['analyzed']} notatek, {report['failed']} błędów - "
+                  f"uruchom ponownie, aby dokończyć")
+        return report
+    if not os.path.isdir(folder) or not any(f.endswith(".txt") for f in os.listdir(folder)):
+        print(f"Brak plików w {folder} do analizy")
+        return None
+    report = NoteAnalyzer(workers=workers).run(folder, force=force)
+    if not report["output_file"]:
+        print("Brak nowych notatek do analizy")
+    elif report["complete"]:
+        print(f"✅ Analiza zakończona ({report['analyzed']} notatek). Zapisano w: {report['output_file']}")
+    else:
+        print(f"⚠️ Przeanalizowano {report['analyzed']} notatek, {report['failed']} błędów - "
+              f"uruchom ponownie, aby dokończyć {report['output_file']}")
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description="Analyse all notes with the summary_analysis prompt")
+    p.add_argument("--user", help="tylko transkrypcje tego użytkownika (domyślnie wszyscy)")
+    p.add_argument("--folder", help="analizuj pliki *.txt z folderu zamiast indeksu artefaktów")
+    p.add_argument("--workers", type=int, default=ANALYZE_WORKERS)
+    p.add_argument("--force", action="store_true", help="analizuj także notatki już przeanalizowane")
+    args = p.parse_args()
+    try:
+        report = analyze_all_notes(args.folder, args.workers, args.force, args.user)
+    except BackendError as e:
+        raise SystemExit(f"{e}. Ustaw: export GROQ_API_KEY=... albo LLM_BACKEND=fake")
+    return 0 if report is None or report["complete"] else 1
+
+
+__all__ = ["NoteAnalyzer", "analyze_all_notes", "open_artifacts"]
+
 
 if __name__ == "__main__":
-    analyze_all_notes()
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Cold tier: compressed per-user archive bundles.
+
+Artifacts aged out of the hot tier (blob store / segments) are copied into
+one zip bundle per user and month, `archive/<key[:2]>/<key>/2025-11.zip`,
+with the blob digest as member name. Text is LZMA-compressed; audio that is
+already Opus/FLAC is stored as-is. Zip keeps a central directory, so a
+single artifact can be read back without unpacking the bundle. Appends take
+an exclusive flock on the bundle and reads a shared one, because zipfile
+rewrites the central directory on every append.
+"""
+import os
+import shutil
+import zipfile
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+
+# rodzaje, które kompresują się słabo albo wcale
+STORED_KINDS = ("audio", "wav")
+
+
+class ArchiveStore:
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def user_dir(self, key: str) -> str:
+        """Bundles of one user; `key` is artifacts.user_key(username)."""
+        return os.path.join(self.root, key[:2], key)
+
+    def bundle_for(self, key: str, created_at: str) -> str:
+        """Bundle path (relative to the archive root) for an artifact created at `created_at`."""
+        return os.path.relpath(os.path.join(self.user_dir(key), f"{created_at[:7]}.zip"), self.root)
+
+    @contextmanager
+    def _locked(self, bundle: str, exclusive: bool):
+        path = os.path.join(self.root, bundle) + ".lock"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock if exclusive else nullcontext():
+            if fcntl is None:
+                yield
+                return
+            with open(path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def add(self, bundle: str, digest: str, kind: str, data: bytes) -> int:
+        """Append `data` to `bundle` under `digest` (no-op if it is already there); returns bytes the bundle grew."""
+        path = os.path.join(self.root, bundle)
+        compression = zipfile.ZIP_STORED if kind in STORED_KINDS else zipfile.ZIP_LZMA
+        with self._locked(bundle, exclusive=True):
+            before = os.path.getsize(path) if os.path.exists(path) else 0
+            with zipfile.ZipFile(path, "a", compression=compression) as zf:
+                if digest in zf.NameToInfo:
+                    return 0
+                zf.writestr(digest, data)
+            return os.path.getsize(path) - before
+
+    def read(self, bundle: str, digest: str) -> bytes:
+        with self._locked(bundle, exclusive=False):
+            with zipfile.ZipFile(os.path.join(self.root, bundle), "r") as zf:
+                return zf.read(digest)
+
+    def usage(self, key: Optional[str] = None) -> int:
+        """Bytes on disk in bundles (of one user, or all)."""
+        top = self.user_dir(key) if key else self.root
+        total = 0
+        for dirpath, _, files in os.walk(top):
+            total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in files if f.endswith(".zip"))
+        return total
+
+    def remove_user(self, key: str) -> None:
+        shutil.rmtree(self.user_dir(key), ignore_errors=True)
+
+
+__all__ = ["ArchiveStore", "ARCHIVE_DIR", "STORED_KINDS"]
@@ -0,0 +1,447 @@
+"""Per-user artifact storage with a metadata index.
+
+Uploads, WAVs, transcripts, summaries and analyses used to land in the shared
+notes_data / summary_data folders, and every listing endpoint scanned (and a
+new user wiped) everyone's files. Now every artifact is recorded in the
+`artifacts` table of the store (user, job, kind, size, timestamp) and
+listings are indexed per-user queries.
+
+Bodies written through `write` go to the content-addressed blob store
+(blob_store.py): the row points at `blobs/ab/cd/<sha256>` and holds a
+reference on it, so identical content is stored once. Transcripts, summaries
+and analyses are small enough to be packed into segment files instead of one
+file each, so their bodies must be read with `read_bytes` / `read_text`, never
+by opening `abspath`. Rows written before the blob store existed have no
+digest; they point at per-user directories under the given roots, sharded by
+a hash of the account name (`notes_data/3f/3fa9c1.../`), and keep working.
+
+Rows aged out by the retention manager (retention.py) are copied to a
+per-user archive bundle (archive_store.py) and give up their blob reference
+(`resident = 0`); `read_bytes` rehydrates them into the blob store on demand.
+"""
+import os
+import hashlib
+import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from storage import Store, get_store
+from blob_store import BlobMissing, BlobStore
+from archive_store import ArchiveStore
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# accessed_at (dla LRU) zapisujemy najwyżej raz na tyle sekund na artefakt
+ACCESS_TOUCH_S = float(os.environ.get("ARTIFACT_ACCESS_TOUCH_S", "3600"))
+
+KINDS = ("audio", "wav", "transcript", "summary", "analysis")
+# małe teksty trafiają do plików segmentów zamiast osobnych plików
+PACKED_KINDS = ("transcript", "summary", "analysis")
+
+ARTIFACT_SCHEMA = {
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS artifacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            job_id TEXT,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )""",
+    ],
+    "postgres": [
+        """CREATE TABLE IF NOT EXISTS artifacts (
+            id BIGSERIAL PRIMARY KEY,
+            username TEXT NOT NULL,
+            job_id TEXT,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size BIGINT NOT NULL,
+            created_at TEXT NOT NULL
+        )""",
+    ],
+}
+ARTIFACT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_artifacts_user_kind ON artifacts (username, kind, id)",
+    # list(): najnowsze wg created_at (import historii ma starsze daty niż id), id rozstrzyga remisy
+    "CREATE INDEX IF NOT EXISTS idx_artifacts_user_kind_created ON artifacts (username, kind, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_artifacts_user_job ON artifacts (username, job_id)",
+    # najnowszy artefakt danego rodzaju per użytkownik - aktualizowany przy zapisie, odczyt po kluczu
+    """CREATE TABLE IF NOT EXISTS artifacts_latest (
+        username TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        artifact_id BIGINT NOT NULL,
+        PRIMARY KEY (username, kind)
+    )""",
+]
+
+
+def user_key(username: str) -> str:
+    # konta są case-insensitive (users.username = lower()), więc katalog też
+    return hashlib.sha256(username.lower().encode("utf-8")).hexdigest()[:16]
+
+
+class ArtifactStore:
+    def __init__(self, roots: Dict[str, str], store: Optional[Store] = None, base_dir: str = BASE_DIR,
+                 blobs: Optional[BlobStore] = None, archive: Optional[ArchiveStore] = None):
+        """`roots` maps each kind to the directory its per-user folders live under."""
+        self.roots = {kind: os.path.abspath(roots[kind]) for kind in KINDS}
+        self.base_dir = os.path.abspath(base_dir)
+        self.store = store or get_store()
+        self.store.ensure_schema(ARTIFACT_SCHEMA[self.store.kind] + ARTIFACT_INDEXES)
+        # sha256 bloba; NULL = plik w katalogu użytkownika (sprzed blob store)
+        self.store.ensure_column("artifacts", "digest", "TEXT")
+        self.store.ensure_schema(["CREATE INDEX IF NOT EXISTS idx_artifacts_digest ON artifacts (digest)"])
+        # retencja: ostatni odczyt, paczka archiwum i czy artefakt trzyma referencję w blob store
+        self.store.ensure_column("artifacts", "accessed_at", "TEXT")
+        self.store.ensure_column("artifacts", "archive", "TEXT")
+        self.store.ensure_column("artifacts", "resident", "INTEGER NOT NULL DEFAULT 1")
+        self.store.ensure_schema(["CREATE INDEX IF NOT EXISTS idx_artifacts_resident ON artifacts (resident, username)"])
+        self.blobs = blobs or BlobStore(store=self.store)
+        self.archive = archive or ArchiveStore()
+        self._write_listeners: List[Callable[[Dict[str, Any], Union[bytes, str]], None]] = []
+        self._delete_listeners: List[Callable[[str], None]] = []
+        self._artifact_delete_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    # === ROZSZERZENIA (indeksy wyszukiwania itp.) ===
+    def on_write(self, callback: Callable[[Dict[str, Any], Union[bytes, str]], None]) -> None:
+        """Call `callback(artifact, data)` after each artifact written through `write`."""
+        self._write_listeners.append(callback)
+
+    def on_delete(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """Call `callback(artifact)` after an artifact is dropped from the index by `delete`."""
+        self._artifact_delete_listeners.append(callback)
+
+    def on_delete_user(self, callback: Callable[[str], None]) -> None:
+        self._delete_listeners.append(callback)
+
+    def _notify(self, listeners, *args) -> None:
+        # indeksy pomocnicze są best-effort: ich błąd nie może zgubić zapisanego pliku
+        for callback in listeners:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Warning: artifact listener {getattr(callback, '__qualname__', callback)} failed: {e}")
+
+    def user_dir(self, username: str, kind: str) -> str:
+        key = user_key(username)
+        path = os.path.join(self.roots[kind], key[:2], key)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def abspath(self, artifact: Dict[str, Any]) -> str:
+        return os.path.join(self.base_dir, artifact["path"])
+
+    def _relpath(self, path: str) -> str:
+        path = os.path.abspath(path)
+        # ścieżki względem katalogu aplikacji - indeks przeżywa przeniesienie instalacji
+        if path.startswith(self.base_dir + os.sep):
+            return os.path.relpath(path, self.base_dir)
+        return path
+
+    def write(self, username: str, kind: str, name: str, data: Union[bytes, str],
+              job_id: Optional[str] = None, created_at: Optional[str] = None) -> Dict[str, Any]:
+        """Store `data` in the blob store and index it under `name` for the user.
+
+        `created_at` (ISO) backdates imported history; default is now.
+        """
+        raw = data.encode("utf-8") if isinstance(data, str) else data
+        for attempt in range(2):
+            digest, path, _ = self.blobs.put(raw, pack=kind in PACKED_KINDS)
+            try:
+                artifact = self.record(username, kind, path, job_id, name=name, digest=digest, size=len(raw),
+                                       created_at=created_at)
+                break
+            except BlobMissing:
+                # gc usunął blob między put a incref - zapisujemy go jeszcze raz
+                if attempt:
+                    raise
+        self._notify(self._write_listeners, artifact, data)
+        return artifact
+
+    def link(self, artifact: Dict[str, Any], username: str, job_id: Optional[str] = None) -> Dict[str, Any]:
+        """Index an existing blob-backed artifact again (new user/job), sharing its content."""
+        if not artifact.get("digest"):
+            raise ValueError("Tylko artefakty z blob store można współdzielić")
+        if not artifact.get("resident", 1):
+            # blob mógł już zniknąć - najpierw przywracamy go z archiwum
+            self.read_bytes(artifact)
+        linked = self.record(username, artifact["kind"], self.abspath(artifact), job_id,
+                             name=artifact["name"], digest=artifact["digest"], size=artifact["size"])
+        if self._write_listeners:
+            data = self.read_bytes(linked)
+            self._notify(self._write_listeners, linked,
+                         data.decode("utf-8", errors="replace") if artifact["kind"] not in ("audio", "wav") else data)
+        return linked
+
+    def record(self, username: str, kind: str, path: str, job_id: Optional[str] = None,
+               name: Optional[str] = None, digest: Optional[str] = None,
+               size: Optional[int] = None, created_at: Optional[str] = None) -> Dict[str, Any]:
+        """Index a file that already exists on disk (`digest` = it is a blob; takes a reference).
+
+        Packed blobs have no file of their own, so their `size` must be passed in.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Nieznany rodzaj artefaktu: {kind}")
+        artifact = {
+            "username": username.lower(),
+            "job_id": job_id,
+            "kind": kind,
+            "name": os.path.basename(name or path),
+            "path": self._relpath(path),
+            "size": os.path.getsize(path) if size is None else size,
+            "created_at": created_at or datetime.datetime.now().isoformat(),
+            "digest": digest,
+        }
+        with self.store.transaction(write=True) as cur:
+            cur.execute(
+                "INSERT INTO artifacts (username, job_id, kind, name, path, size, created_at, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING id",
+                (artifact["username"], job_id, kind, artifact["name"], artifact["path"], artifact["size"],
+                 artifact["created_at"], digest),
+            )
+            artifact["id"] = int(cur.fetchone()["id"])
+            if digest:
+                self.blobs.incref(cur, digest)
+            if created_at:
+                # import historii: starszy artefakt nie może wyprzeć nowszego z artifacts_latest
+                cur.execute(
+                    "INSERT INTO artifacts_latest (username, kind, artifact_id) VALUES (?, ?, ?) "
+                    "ON CONFLICT (username, kind) DO UPDATE SET artifact_id = excluded.artifact_id "
+                    "WHERE (SELECT a.created_at FROM artifacts a WHERE a.id = artifacts_latest.artifact_id) < ?",
+                    (artifact["username"], kind, artifact["id"], created_at),
+                )
+            else:
+                cur.execute(
+                    "INSERT INTO artifacts_latest (username, kind, artifact_id) VALUES (?, ?, ?) "
+                    "ON CONFLICT (username, kind) DO UPDATE SET artifact_id = excluded.artifact_id "
+                    "WHERE excluded.artifact_id > artifacts_latest.artifact_id",
+                    (artifact["username"], kind, artifact["id"]),
+                )
+        return artifact
+
+    def list(self, username: str, kind: Union[str, Iterable[str], None] = None, limit: int = 50,
+             before: Optional[Tuple[str, int]] = None, since: Optional[str] = None,
+             until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Newest first (created_at, then id); pass the last row's `(created_at, id)` as `before`
+        to get the next page.
+
+        `since` / `until` are ISO timestamps (or dates) compared with created_at.
+        """
+        sql = "SELECT * FROM artifacts WHERE username = ?"
+        params: List[Any] = [username.lower()]
+        kinds = [kind] if isinstance(kind, str) else list(kind or ())
+        if kinds:
+            sql += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+        if before:
+            sql += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params.extend([before[0], before[0], int(before[1])])
+        if since:
+            sql += " AND created_at >= ?"
+            params.append(since)
+        if until:
+            sql += " AND created_at < ?"
+            params.append(until)
+        sql += f" ORDER BY created_at DESC, id DESC LIMIT {int(limit)}"
+        return self.store.execute(sql, params)
+
+    def latest(self, username: str, kind: str) -> Optional[Dict[str, Any]]:
+        """Newest artifact of `kind`: a primary-key lookup in artifacts_latest, no sorting."""
+        rows = self.store.execute(
+            "SELECT a.* FROM artifacts_latest l JOIN artifacts a ON a.id = l.artifact_id "
+            "WHERE l.username = ? AND l.kind = ?",
+            (username.lower(), kind),
+        )
+        return rows[0] if rows else None
+
+    def get_many(self, username: str, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Artifacts of `username` by id (ids of other users are silently skipped)."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        rows = self.store.execute(
+            f"SELECT * FROM artifacts WHERE username = ? AND id IN ({', '.join('?' for _ in ids)})",
+            [username.lower()] + ids,
+        )
+        return {int(r["id"]): r for r in rows}
+
+    def for_job(self, username: str, job_id: str) -> List[Dict[str, Any]]:
+        return self.store.execute(
+            "SELECT * FROM artifacts WHERE username = ? AND job_id = ? ORDER BY id", (username.lower(), job_id)
+        )
+
+    def _read_hot(self, artifact: Dict[str, Any]) -> bytes:
+        if artifact.get("digest"):
+            return self.blobs.read(artifact["digest"])
+        with open(self.abspath(artifact), "rb") as f:
+            return f.read()
+
+    def read_bytes(self, artifact: Dict[str, Any]) -> bytes:
+        """Artifact body, rehydrated from its archive bundle if it was aged out."""
+        if artifact.get("archive") and not artifact.get("resident", 1):
+            data = self._rehydrate(artifact)
+        else:
+            data = self._read_hot(artifact)
+        self._touch(artifact)
+        return data
+
+    def _touch(self, artifact: Dict[str, Any]) -> None:
+        now = datetime.datetime.now()
+        last = artifact.get("accessed_at")
+        if last and last > (now - datetime.timedelta(seconds=ACCESS_TOUCH_S)).isoformat():
+            return
+        artifact["accessed_at"] = now.isoformat()
+        try:
+            self.store.execute("UPDATE artifacts SET accessed_at = ? WHERE id = ?", (artifact["accessed_at"], artifact["id"]))
+        except Exception as e:
+            print(f"Warning: could not update accessed_at of {artifact.get('id')}: {e}")
+
+    def _rehydrate(self, artifact: Dict[str, Any]) -> bytes:
+        data = self.archive.read(artifact["archive"], artifact["digest"])
+        for attempt in range(2):
+            self.blobs.put(data, pack=artifact["kind"] in PACKED_KINDS)
+            try:
+                with self.store.transaction(write=True) as cur:
+                    cur.execute("UPDATE artifacts SET resident = 1 WHERE id = ? AND resident = 0", (artifact["id"],))
+                    if cur.rowcount:
+                        self.blobs.incref(cur, artifact["digest"])
+                break
+            except BlobMissing:
+                if attempt:
+                    raise
+        artifact["resident"] = 1
+        return data
+
+    def archive_artifact(self, artifact: Dict[str, Any]) -> int:
+        """Move one artifact to the cold tier: copy it into the user's bundle, drop the hot copy.
+
+        The blob reference is released (the caller may drop the blob right away with
+        `blobs.drop_if_unreferenced`, otherwise it goes with `blob_store.py gc`); an old
+        per-user file is converted to a digest and removed. Returns the bytes the bundle grew.
+        """
+        if not artifact.get("resident", 1):
+            return 0
+        legacy_path = None if artifact.get("digest") else self.abspath(artifact)
+        bundle, digest = artifact.get("archive"), artifact.get("digest")
+        added = 0
+        if not bundle:
+            data = self._read_hot(artifact)
+            digest = digest or hashlib.sha256(data).hexdigest()
+            bundle = self.archive.bundle_for(user_key(artifact["username"]), artifact["created_at"])
+            added = self.archive.add(bundle, digest, artifact["kind"], data)
+        with self.store.transaction(write=True) as cur:
+            cur.execute("UPDATE artifacts SET archive = ?, digest = ?, path = ?, resident = 0 WHERE id = ? AND resident = 1",
+                        (bundle, digest, self._relpath(self.blobs.path_for(digest)), artifact["id"]))
+            if cur.rowcount and not legacy_path:
+                self.blobs.decref(cur, digest)
+        artifact.update(archive=bundle, digest=digest, resident=0)
+        if legacy_path:
+            try:
+                os.remove(legacy_path)
+            except FileNotFoundError:
+                pass
+        return added
+
+    def read_text(self, artifact: Dict[str, Any]) -> str:
+        return self.read_bytes(artifact).decode("utf-8")
+
+    def pack_text_artifacts(self, dry_run: bool = False) -> Dict[str, int]:
+        """Move existing transcript/summary/analysis bodies into segment files.
+
+        Blob files are packed in place; pre-blob per-user files are moved into the
+        blob store (packed) and their rows repointed.
+        """
+        report = {"packed": 0, "files_removed": 0, "bytes_freed": 0}
+        rows = self.store.execute(
+            f"SELECT * FROM artifacts WHERE kind IN ({', '.join('?' for _ in PACKED_KINDS)}) ORDER BY id",
+            PACKED_KINDS,
+        )
+        for artifact in rows:
+            try:
+                if artifact.get("digest"):
+                    path = self.blobs.path_for(artifact["digest"])
+                    if not os.path.exists(path):
+                        continue
+                    size = os.path.getsize(path)
+                    if dry_run or self.blobs.pack(artifact["digest"]):
+                        report["packed"] += 1
+                        report["files_removed"] += 1
+                        report["bytes_freed"] += size
+                    continue
+                path = self.abspath(artifact)
+                if not os.path.exists(path):
+                    continue
+                size = os.path.getsize(path)
+                report["packed"] += 1
+                report["files_removed"] += 1
+                report["bytes_freed"] += size
+                if dry_run:
+                    continue
+                with open(path, "rb") as f:
+                    data = f.read()
+                digest, blob_path, _ = self.blobs.put(data, pack=True)
+                with self.store.transaction(write=True) as cur:
+                    cur.execute("UPDATE artifacts SET digest = ?, path = ?, size = ? WHERE id = ? AND digest IS NULL",
+                                (digest, self._relpath(blob_path), len(data), artifact["id"]))
+                    if cur.rowcount:
+                        self.blobs.incref(cur, digest)
+                os.remove(path)
+            except Exception as e:
+                print(f"Warning: could not pack {artifact['path']}: {e}")
+        return report
+
+    def delete(self, artifact: Dict[str, Any], remove_file: bool = True) -> None:
+        """Drop one artifact from the index; keeps artifacts_latest pointing at a live row.
+
+        Blob-backed artifacts release their reference (the blob is removed by `blob_store.py gc`);
+        old per-user files are deleted when `remove_file` is set.
+        """
+        if remove_file and not artifact.get("digest"):
+            try:
+                os.remove(self.abspath(artifact))
+            except FileNotFoundError:
+                pass
+        with self.store.transaction(write=True) as cur:
+            cur.execute("SELECT resident FROM artifacts WHERE id = ?", (artifact["id"],))
+            row = cur.fetchone()
+            cur.execute("DELETE FROM artifacts WHERE id = ?", (artifact["id"],))
+            # zarchiwizowany artefakt nie trzyma już referencji na blob
+            if cur.rowcount and artifact.get("digest") and row and row["resident"]:
+                self.blobs.decref(cur, artifact["digest"])
+            cur.execute("DELETE FROM artifacts_latest WHERE username = ? AND kind = ? AND artifact_id = ?",
+                        (artifact["username"], artifact["kind"], artifact["id"]))
+            if cur.rowcount:
+                cur.execute(
+                    "INSERT INTO artifacts_latest (username, kind, artifact_id) "
+                    "SELECT username, kind, id FROM artifacts WHERE username = ? AND kind = ? "
+                    "ORDER BY created_at DESC, id DESC LIMIT 1",
+                    (artifact["username"], artifact["kind"]),
+                )
+        self._notify(self._artifact_delete_listeners, artifact)
+
+    def delete_user(self, username: str) -> int:
+        """Remove all files and index rows of one user; returns the number of artifacts removed."""
+        rows = self.store.execute("SELECT * FROM artifacts WHERE username = ?", (username.lower(),))
+        for artifact in rows:
+            if artifact.get("digest"):
+                continue
+            try:
+                os.remove(self.abspath(artifact))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Warning: could not remove {artifact['path']}: {e}")
+        with self.store.transaction(write=True) as cur:
+            for artifact in rows:
+                if artifact.get("digest") and artifact.get("resident", 1):
+                    self.blobs.decref(cur, artifact["digest"])
+            cur.execute("DELETE FROM artifacts WHERE username = ?", (username.lower(),))
+            cur.execute("DELETE FROM artifacts_latest WHERE username = ?", (username.lower(),))
+        self.archive.remove_user(user_key(username))
+        self._notify(self._delete_listeners, username.lower())
+        return len(rows)
+
+
+__all__ = ["ArtifactStore", "KINDS", "PACKED_KINDS", "user_key"]
@@ -0,0 +1,248 @@
+"""Storage policy for recorded audio: one canonical compressed copy per recording.
+
+Uploads used to leave three files behind: the original (.webm), a 16 kHz PCM
+WAV twice its size and the transcript; the legacy data/<date>/<time>/ tree
+does the same. The WAV is only an intermediate for Vosk, so now:
+
+- the WAV is decoded in memory for transcription and not persisted
+  (AUDIO_KEEP_WAV=1 restores the old behaviour),
+- an upload that is already compressed (webm/ogg/opus/mp3/m4a/flac) is kept
+  as-is; an uncompressed one (wav/aiff) is transcoded to AUDIO_STORE_FORMAT
+  (opus = speech-grade lossy, flac = lossless),
+- `decode_for_asr` decodes a stored recording back to 16 kHz mono WAV bytes
+  when a note has to be re-transcribed,
+- `compact` is the background pass for existing trees: a WAV next to its
+  compressed source is deleted, a lone WAV is transcoded (verified by decoding
+  it back) and then deleted, and the bytes reclaimed are reported. Indexed
+  WAVs only release their blob reference; `blob_store.py gc` frees the space.
+  Files indexed as any other kind are never touched by the directory walk.
+
+Usage:
+  python audio_policy.py report [roots...]
+  python audio_policy.py compact [roots...] [--dry-run]
+"""
+import io
+import os
+import sys
+import argparse
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    from pydub import AudioSegment
+except Exception:  # bez pydub/ffmpeg działa tylko usuwanie zbędnych WAV
+    AudioSegment = None
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AUDIO_STORE_FORMAT = os.environ.get("AUDIO_STORE_FORMAT", "opus")  # opus | flac | original
+AUDIO_OPUS_BITRATE = os.environ.get("AUDIO_OPUS_BITRATE", "24k")
+AUDIO_KEEP_WAV = os.environ.get("AUDIO_KEEP_WAV", "0") == "1"
+
+COMPRESSED_EXTS = (".webm", ".ogg", ".opus", ".mp3", ".m4a", ".aac", ".flac")
+UNCOMPRESSED_EXTS = (".wav", ".aiff", ".aif")
+_FORMAT_EXT = {"opus": ".opus", "flac": ".flac"}
+
+
+def is_compressed(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in COMPRESSED_EXTS
+
+
+def transcode(data: bytes, fmt: str = AUDIO_STORE_FORMAT) -> bytes:
+    if AudioSegment is None:
+        raise RuntimeError("pydub/ffmpeg niedostępne")
+    seg = AudioSegment.from_file(io.BytesIO(data)).set_channels(1)
+    out = io.BytesIO()
+    if fmt == "opus":
+        seg.export(out, format="ogg", codec="libopus", bitrate=AUDIO_OPUS_BITRATE)
+    elif fmt == "flac":
+        seg.export(out, format="flac")
+    else:
+        raise ValueError(f"Nieznany format audio: {fmt}")
+    return out.getvalue()
+
+
+def canonical_audio(name: str, data: bytes) -> Tuple[str, bytes]:
+    """Return `(name, bytes)` of the copy to keep for an uploaded recording."""
+    if AUDIO_STORE_FORMAT == "original" or is_compressed(name):
+        return name, data
+    try:
+        return os.path.splitext(name)[0] + _FORMAT_EXT[AUDIO_STORE_FORMAT], transcode(data)
+    except Exception as e:
+        print(f"Warning: could not transcode {name}, keeping original: {e}")
+        return name, data
+
+
+def decode_for_asr(path: str) -> bytes:
+    """Stored recording -> 16 kHz mono 16-bit WAV bytes (re-transcription path)."""
+    if AudioSegment is None:
+        raise RuntimeError("pydub/ffmpeg niedostępne")
+    seg = AudioSegment.from_file(path).set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    out = io.BytesIO()
+    seg.export(out, format="wav")
+    return out.getvalue()
+
+
+def _verified_transcode(data: bytes) -> bytes:
+    """transcode() whose output is decoded back before anyone deletes the source."""
+    encoded = transcode(data)
+    seg = AudioSegment.from_file(io.BytesIO(encoded))
+    if len(seg) == 0 and len(AudioSegment.from_file(io.BytesIO(data))) > 0:
+        raise RuntimeError("transkodowany plik jest pusty")
+    return encoded
+
+
+def _compressed_sibling(wav_path: str) -> Optional[str]:
+    stem = os.path.splitext(wav_path)[0]
+    for ext in COMPRESSED_EXTS:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+def _transcode_file(wav_path: str, dry_run: bool) -> Tuple[Optional[str], int]:
+    """Write the canonical copy next to `wav_path`; returns (new path, new size)."""
+    with open(wav_path, "rb") as f:
+        data = f.read()
+    # weryfikacja: nowa kopia musi się zdekodować, zanim skasujemy WAV
+    encoded = _verified_transcode(data)
+    new_path = os.path.splitext(wav_path)[0] + _FORMAT_EXT[AUDIO_STORE_FORMAT]
+    if dry_run:
+        return new_path, len(encoded)
+    tmp = new_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(encoded)
+    os.replace(tmp, new_path)
+    return new_path, len(encoded)
+
+
+def compact(roots: Iterable[str], artifacts=None, dry_run: bool = False) -> Dict[str, Any]:
+    """Remove or transcode persisted WAVs; returns a report with the bytes reclaimed."""
+    report = {"wav_found": 0, "wav_removed": 0, "transcoded": 0, "failed": 0,
+              "bytes_before": 0, "bytes_after": 0, "dry_run": dry_run}
+
+    def handle(wav_path: str) -> Optional[str]:
+        size = os.path.getsize(wav_path)
+        report["wav_found"] += 1
+        report["bytes_before"] += size
+        if _compressed_sibling(wav_path):
+            new_path = None
+        elif AUDIO_STORE_FORMAT == "original":
+            report["bytes_after"] += size
+            return wav_path
+        else:
+            try:
+                new_path, new_size = _transcode_file(wav_path, dry_run)
+            except Exception as e:
+                print(f"Warning: could not transcode {wav_path}: {e}")
+                report["failed"] += 1
+                report["bytes_after"] += size
+                return wav_path
+            report["transcoded"] += 1
+            report["bytes_after"] += new_size
+        report["wav_removed"] += 1
+        if not dry_run:
+            os.remove(wav_path)
+        return new_path
+
+    seen = set()
+    # 1) WAV-y zaindeksowane w tabeli artifacts - tylko przez API indeksu (bloby bywają współdzielone)
+    if artifacts is not None:
+        # każdy zaindeksowany plik (też audio .wav z nieudanej transkodacji) jest poza zasięgiem kroku 2
+        for row in artifacts.store.execute("SELECT path FROM artifacts"):
+            seen.add(os.path.abspath(artifacts.abspath(row)))
+        for wav in artifacts.store.execute("SELECT * FROM artifacts WHERE kind = 'wav' ORDER BY id"):
+            path = artifacts.abspath(wav)
+            if not os.path.exists(path):
+                if not dry_run:
+                    artifacts.delete(wav, remove_file=False)
+                continue
+            size = os.path.getsize(path)
+            report["wav_found"] += 1
+            report["bytes_before"] += size
+            job = artifacts.for_job(wav["username"], wav["job_id"]) if wav["job_id"] else []
+            if not any(a["kind"] == "audio" for a in job):
+                if AUDIO_STORE_FORMAT == "original":
+                    report["bytes_after"] += size
+                    continue
+                try:
+                    with open(path, "rb") as f:
+                        encoded = _verified_transcode(f.read())
+                except Exception as e:
+                    print(f"Warning: could not transcode {path}: {e}")
+                    report["failed"] += 1
+                    report["bytes_after"] += size
+                    continue
+                report["transcoded"] += 1
+                report["bytes_after"] += len(encoded)
+                if not dry_run:
+                    name = os.path.splitext(wav["name"])[0] + _FORMAT_EXT[AUDIO_STORE_FORMAT]
+                    artifacts.write(wav["username"], "audio", name, encoded, wav["job_id"])
+            report["wav_removed"] += 1
+            if not dry_run:
+                artifacts.delete(wav)
+
+    # 2) pozostałe drzewa (data/<data>/<godzina>/, stare pliki w notes_data)
+    for root in roots:
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                path = os.path.abspath(os.path.join(dirpath, name))
+                if os.path.splitext(name)[1].lower() in UNCOMPRESSED_EXTS and path not in seen:
+                    handle(path)
+
+    report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_after"]
+    return report
+
+
+def usage_report(roots: Iterable[str]) -> Dict[str, Dict[str, int]]:
+    """Files and bytes per audio extension under `roots`."""
+    usage: Dict[str, Dict[str, int]] = {}
+    for root in roots:
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                ext = os.path.splitext(name)[1].lower()
+                if ext in COMPRESSED_EXTS or ext in UNCOMPRESSED_EXTS:
+                    entry = usage.setdefault(ext, {"files": 0, "bytes": 0})
+                    entry["files"] += 1
+                    entry["bytes"] += os.path.getsize(os.path.join(dirpath, name))
+    return usage
+
+
+def _mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.2f} MB"
+
+
+def main():
+    p = argparse.ArgumentParser(description="Audio storage policy")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    for cmd in ("report", "compact"):
+        c = sub.add_parser(cmd)
+        c.add_argument("roots", nargs="*", default=[os.path.join(BASE_DIR, "notes_data"), os.path.join(BASE_DIR, "data")])
+        if cmd == "compact":
+            c.add_argument("--dry-run", action="store_true")
+            c.add_argument("--no-index", action="store_true", help="nie ruszaj tabeli artifacts")
+    args = p.parse_args()
+
+    if args.cmd == "report":
+        for ext, entry in sorted(usage_report(args.roots).items()):
+            print(f"{ext:6} {entry['files']:6} plików  {_mb(entry['bytes'])}")
+        return
+
+    artifacts = None
+    if not args.no_index:
+        from artifacts import ArtifactStore
+        notes, summaries = os.path.join(BASE_DIR, "notes_data"), os.path.join(BASE_DIR, "summary_data")
+        artifacts = ArtifactStore({"audio": notes, "wav": notes, "transcript": notes,
+                                   "summary": summaries, "analysis": summaries})
+    report = compact(args.roots, artifacts, dry_run=args.dry_run)
+    print(f"WAV: {report['wav_found']} znalezionych, {report['wav_removed']} usuniętych, "
+          f"{report['transcoded']} przekodowanych ({AUDIO_STORE_FORMAT}), {report['failed']} błędów")
+    print(f"Przed: {_mb(report['bytes_before'])}, po: {_mb(report['bytes_after'])}, "
+          f"odzyskano: {_mb(report['bytes_reclaimed'])}" + (" (dry-run)" if args.dry_run else ""))
+
+
+__all__ = ["canonical_audio", "compact", "decode_for_asr", "is_compressed", "transcode", "usage_report",
+           "AUDIO_KEEP_WAV"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,70 +1,199 @@
 import os
-import json
+import time
+import secrets
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import Optional, Dict
 from datetime import datetime, timedelta
 
 import jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+from storage import get_store
+from password_hashing import hash_password, hash_password_async, verify_and_update, verify_and_update_async
+
 # JWT / password config
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# ponowne użycie zrotowanego tokenu w tym oknie traktujemy jako wyścig dwóch kart, nie kradzież
+REFRESH_REUSE_GRACE_S = int(os.environ.get("REFRESH_REUSE_GRACE_S", "10"))
+# konta z dostępem do operacji administracyjnych (scheduler itp.), po przecinku
+ADMIN_USERS = {u.strip().lower() for u in os.environ.get("ADMIN_USERS", "").split(",") if u.strip()}
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-USERS_PATH = os.path.join(BASE_DIR, "users.json")
 
+class RefreshTokenRotated(RuntimeError):
+    """The refresh token was rotated a moment ago (another tab won the race); not a theft."""
+
+# cache rekordów użytkowników dla get_current_user
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+# jak często (s) sprawdzamy licznik wersji tabeli users w store (zmiany z innych workerów)
+USER_CACHE_VERSION_CHECK = float(os.environ.get("USER_CACHE_VERSION_CHECK", "2"))
+
+
+class _UserCache:
+    """TTL + LRU cache of user records keyed by lower-cased username.
+
+    Entries are dropped wholesale when the store's `users` version changes
+    (register/delete in any worker), checked at most every
+    USER_CACHE_VERSION_CHECK seconds, and individually on local writes.
+    """
+
+    def __init__(self, ttl: float, maxsize: int, version_check: float):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.version_check = version_check
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check:
+            return
+        try:
+            version = get_store().get_version("users")
+        except Exception:
+            return
+        with self._lock:
+            self._version_checked_at = now
+            if self._version is not None and version != self._version:
+                self._data.clear()
+                self.invalidations += 1
+            self._version = version
+
+    def get(self, username: str) -> Optional[Dict]:
+        self._check_version()
+        key = username.lower()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._data[key]
+            self.misses += 1
+        return None
+
+    def put(self, username: str, user: Dict) -> None:
+        with self._lock:
+            self._data[username.lower()] = (user, time.monotonic())
+            self._data.move_to_end(username.lower())
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        with self._lock:
+            if username is None:
+                self._data.clear()
+            else:
+                self._data.pop(username.lower(), None)
+            self.invalidations += 1
+            # wymuś sprawdzenie wersji przy następnym odczycie
+            self._version_checked_at = 0.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "store_version": self._version,
+            }
 
-def _ensure_users_file():
-    if not os.path.exists(USERS_PATH):
-        with open(USERS_PATH, "w", encoding="utf-8") as f:
-            json.dump({}, f)
+
+_user_cache = _UserCache(USER_CACHE_TTL, USER_CACHE_SIZE, USER_CACHE_VERSION_CHECK)
 
 
 def get_user(username: str) -> Optional[Dict]:
-    _ensure_users_file()
-    try:
-        with open(USERS_PATH, "r", encoding="utf-8") as f:
-            users = json.load(f)
-    except Exception:
-        users = {}
-    return users.get(username.lower())
+    user = get_store().get_user(username)
+    if not user:
+        return None
+    return {"hashed_password": user["hashed_password"]}
+
+
+def get_user_cached(username: str) -> Optional[Dict]:
+    user = _user_cache.get(username)
+    if user is not None:
+        return user
+    user = get_user(username)
+    if user is not None:
+        _user_cache.put(username, user)
+    return user
 
 
 def save_user(username: str, hashed_password: str) -> None:
-    _ensure_users_file()
-    try:
-        with open(USERS_PATH, "r", encoding="utf-8") as f:
-            users = json.load(f)
-    except Exception:
-        users = {}
-    users[username.lower()] = {"hashed_password": hashed_password}
-    with open(USERS_PATH, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    get_store().save_user(username, hashed_password)
+    _user_cache.invalidate(username)
+
+
+def delete_user(username: str) -> None:
+    # usuwa też refresh tokeny użytkownika
+    get_store().delete_user(username)
+    _user_cache.invalidate(username)
+
+
+def user_cache_stats() -> Dict:
+    return _user_cache.stats()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    try:
-        return pwd_context.verify(plain_password, hashed_password)
-    except Exception:
-        return False
+    ok, _ = verify_and_update(plain_password, hashed_password)
+    return ok
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return hash_password(password)
+
+
+def _rehash_if_needed(username: str, new_hash: Optional[str]) -> None:
+    # hash ze starymi parametrami Argon2 - podmieniamy po udanym logowaniu
+    if new_hash:
+        try:
+            save_user(username, new_hash)
+        except Exception as e:
+            print(f"Warning: could not rehash password for {username}: {e}")
 
 
 def authenticate_user(username: str, password: str) -> Optional[Dict]:
     user = get_user(username)
     if not user:
         return None
-    if not verify_password(password, user.get("hashed_password", "")):
+    ok, new_hash = verify_and_update(password, user.get("hashed_password", ""))
+    if not ok:
         return None
+    _rehash_if_needed(username, new_hash)
+    return {"username": username}
+
+
+async def authenticate_user_async(username: str, password: str) -> Optional[Dict]:
+    """Like `authenticate_user`, but Argon2 runs on the bounded hashing pool, off the event loop."""
+    user = get_user(username)
+    if not user:
+        return None
+    ok, new_hash = await verify_and_update_async(password, user.get("hashed_password", ""))
+    if not ok:
+        return None
+    _rehash_if_needed(username, new_hash)
     return {"username": username}
 
 
@@ -84,6 +213,70 @@ def decode_access_token(token: str) -> Optional[Dict]:
         return None
 
 
+def _hash_refresh_token(token: str) -> str:
+    # token ma 256 bitów losowości - szybki sha256 wystarcza, Argon2 nie jest potrzebny
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _refresh_expiry() -> str:
+    return (datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)).isoformat()
+
+
+def create_refresh_token(username: str) -> str:
+    """Issue a refresh token starting a new rotation family (one per device login)."""
+    token = secrets.token_urlsafe(32)
+    get_store().add_refresh_token(_hash_refresh_token(token), username, secrets.token_hex(16), _refresh_expiry())
+    return token
+
+
+def rotate_refresh_token(token: str) -> Optional[Dict]:
+    """Exchange a refresh token for a new one; returns {"username", "refresh_token"} or None.
+
+    Presenting an already rotated token outside the grace window revokes the
+    whole family, so a stolen token stops working for the thief and the owner.
+    Inside the window RefreshTokenRotated is raised: the client should pick up
+    the token the other tab stored instead of logging out. A token revoked by
+    logout or family revocation (no successor) is simply rejected.
+    """
+    store = get_store()
+    old_hash = _hash_refresh_token(token)
+    new_token = secrets.token_urlsafe(32)
+    row = store.rotate_refresh_token(old_hash, _hash_refresh_token(new_token), _refresh_expiry())
+    if row is None:
+        existing = store.get_refresh_token(old_hash)
+        # tylko token wymieniony przy rotacji; wylogowanie / unieważniona rodzina -> 401
+        if existing and existing.get("revoked_at") and existing.get("replaced_by"):
+            revoked_at = datetime.fromisoformat(existing["revoked_at"])
+            if (datetime.now() - revoked_at).total_seconds() > REFRESH_REUSE_GRACE_S:
+                revoked = store.revoke_refresh_family(existing["family_id"])
+                print(f"Warning: refresh token reuse for {existing['username']}, revoked {revoked} token(s)")
+            else:
+                successor = store.get_refresh_token(existing["replaced_by"])
+                # następca unieważniony bez rotacji (wylogowanie w drugiej karcie) - nie ma czego przejąć
+                if successor and (not successor.get("revoked_at") or successor.get("replaced_by")):
+                    raise RefreshTokenRotated("Token odświeżania został już wymieniony")
+        return None
+    if not get_user_cached(row["username"]):
+        return None
+    return {"username": row["username"], "refresh_token": new_token}
+
+
+def revoke_refresh_token(token: str) -> None:
+    existing = get_store().get_refresh_token(_hash_refresh_token(token))
+    if existing:
+        get_store().revoke_refresh_family(existing["family_id"])
+
+
+def issue_tokens(username: str, refresh_token: Optional[str] = None) -> Dict:
+    """Token response for login/register/refresh."""
+    return {
+        "access_token": create_access_token({"sub": username}),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": refresh_token or create_refresh_token(username),
+    }
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     payload = decode_access_token(token)
     if not payload:
@@ -91,24 +284,52 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     username = payload.get("sub") or payload.get("username")
     if not username:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
-    user = get_user(username)
+    user = get_user_cached(username)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return {"username": username}
 
 
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    """Like get_current_user, but only for accounts listed in ADMIN_USERS (403 otherwise)."""
+    if current_user["username"].lower() not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Wymagane uprawnienia administratora")
+    return current_user
+
+
 def register_user(username: str, password: str) -> bool:
     username = username.lower()
     if get_user(username):
         return False
     hashed = get_password_hash(password)
-    save_user(username, hashed)
-    return True
+    # INSERT ... ON CONFLICT DO NOTHING - równoległa rejestracja tej samej nazwy nie nadpisze hasła
+    created = get_store().create_user(username, hashed)
+    _user_cache.invalidate(username)
+    return created
+
+
+async def register_user_async(username: str, password: str) -> bool:
+    username = username.lower()
+    if get_user(username):
+        return False
+    hashed = await hash_password_async(password)
+    created = get_store().create_user(username, hashed)
+    _user_cache.invalidate(username)
+    return created
 
 
 __all__ = [
+    "RefreshTokenRotated",
     "authenticate_user",
+    "authenticate_user_async",
     "create_access_token",
+    "delete_user",
     "get_current_user",
+    "issue_tokens",
     "register_user",
+    "register_user_async",
+    "require_admin",
+    "revoke_refresh_token",
+    "rotate_refresh_token",
+    "user_cache_stats",
 ]
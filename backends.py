@@ -0,0 +1,240 @@
+"""ASR and LLM backends selected by configuration.
+
+ASR_BACKEND=vosk|fake and LLM_BACKEND=groq|fake pick the implementation. The
+fake backends are deterministic (output derived from the input hash) with a
+configurable latency distribution and error rate, so the web, queue and
+storage layers can be load-tested offline without a Groq key or a Vosk model.
+Pointing GROQ_BASE_URL at scripts/fake_llm_server.py exercises the real Groq
+SDK path against a local stand-in instead.
+
+Latency specs: "0", "fixed:0.2", "uniform:0.1,0.8", "lognormal:-1.0,0.5"
+(seconds; lognormal takes mu, sigma of the underlying normal).
+"""
+import os
+import io
+import json
+import time
+import wave
+import random
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Protocol
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ASR_BACKEND = os.environ.get("ASR_BACKEND", "vosk")
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "groq")
+FAKE_ASR_LATENCY = os.environ.get("FAKE_ASR_LATENCY", "0")
+FAKE_ASR_ERROR_RATE = float(os.environ.get("FAKE_ASR_ERROR_RATE", "0"))
+FAKE_LLM_LATENCY = os.environ.get("FAKE_LLM_LATENCY", "0")
+FAKE_LLM_ERROR_RATE = float(os.environ.get("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_SEED = int(os.environ.get("FAKE_SEED", "0"))
+
+
+class BackendError(RuntimeError):
+    """Injected failure of a fake backend (or a misconfigured real one).
+
+    `status_code` is the HTTP status the failure stands for (503 for injected
+    outages), so llm_client classifies it like a real provider error.
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TranscriptionBackend(Protocol):
+    name: str
+
+    def transcribe(self, wav_bytes: bytes) -> str:
+        """Transcribe 16-bit mono WAV bytes to text."""
+        ...
+
+
+class CompletionBackend(Protocol):
+    name: str
+
+    def complete(self, model: str, messages: List[Dict[str, str]], temperature: float,
+                 max_tokens: int, timeout: Optional[float] = None) -> str:
+        """Return the assistant message for a chat-completion request."""
+        ...
+
+
+# === PRAWDZIWE BACKENDY ===
+class VoskTranscriber:
+    name = "vosk"
+
+    def __init__(self, model_path: str):
+        import vosk
+        if not os.path.exists(model_path):
+            raise BackendError(f"Nie znaleziono modelu Vosk w {model_path}")
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def transcribe(self, wav_bytes: bytes) -> str:
+        wf = wave.open(io.BytesIO(wav_bytes), "rb")
+        rec = self._vosk.KaldiRecognizer(self.model, wf.getframerate())
+        rec.SetWords(False)
+        text = []
+        while True:
+            data = wf.readframes(4000)
+            if not data: break
+            if rec.AcceptWaveform(data):
+                try: text.append(json.loads(rec.Result()).get("text", ""))
+                except: pass
+        try: text.append(json.loads(rec.FinalResult()).get("text", ""))
+        except: pass
+        wf.close()
+        return " ".join(t for t in text if t).strip()
+
+
+class GroqCompletion:
+    name = "groq"
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        from groq import Groq
+        api_key = api_key or os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            raise BackendError("Brak GROQ_API_KEY w środowisku")
+        base_url = base_url or os.environ.get("GROQ_BASE_URL")
+        kwargs = {"api_key": api_key}
+        if base_url:
+            kwargs["base_url"] = base_url
+        # wewnętrzne retry SDK wydłużyłyby wywołanie ponad deadline - retry robimy sami
+        self.client = Groq(max_retries=0, **kwargs)
+
+    def complete(self, model, messages, temperature, max_tokens, timeout=None):
+        from llm_client import extract_choice_text
+        resp = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+        )
+        return extract_choice_text(resp)
+
+
+# === FAKE BACKENDY ===
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Turn a latency spec ("fixed:0.2", "uniform:a,b", "lognormal:mu,sigma") into a sampler."""
+    spec = (spec or "0").strip()
+    kind, _, args = spec.partition(":")
+    if not args:
+        value = float(kind)
+        return lambda rng: value
+    params = [float(p) for p in args.split(",")]
+    if kind == "fixed":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(params[0], params[1])
+    raise ValueError(f"Nieznany rozkład opóźnienia: {spec}")
+
+
+class _FakeBase:
+    def __init__(self, latency: str = "0", error_rate: float = 0.0, seed: int = FAKE_SEED):
+        self.latency_spec = latency
+        self._sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def _simulate(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self._sample_latency(self._rng))
+            fail = self._rng.random() < self.error_rate
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            with self._lock:
+                self.errors += 1
+            raise TimeoutError(f"{self.name}: symulowany timeout po {timeout:.1f}s")
+        time.sleep(delay)
+        if fail:
+            with self._lock:
+                self.errors += 1
+            raise BackendError(f"{self.name}: symulowany błąd backendu", status_code=503)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": self.name, "calls": self.calls, "errors": self.errors,
+                    "latency": self.latency_spec, "error_rate": self.error_rate}
+
+
+_FAKE_WORDS = (
+    "dzisiaj", "czuję", "się", "trochę", "lepiej", "myślę", "o", "pracy", "i", "rodzinie",
+    "nie", "mogłem", "spać", "mam", "nadzieję", "że", "jutro", "będzie", "spokojniej", "znowu",
+)
+
+
+class FakeTranscriber(_FakeBase):
+    """Deterministic transcript derived from the audio hash; length scales with duration."""
+    name = "fake-asr"
+
+    def transcribe(self, wav_bytes: bytes) -> str:
+        self._simulate()
+        digest = hashlib.sha256(wav_bytes).digest()
+        try:
+            with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+                seconds = wf.getnframes() / float(wf.getframerate() or 16000)
+        except Exception:
+            seconds = len(wav_bytes) / 32000.0
+        n_words = max(1, int(seconds * 2))
+        return " ".join(_FAKE_WORDS[digest[i % len(digest)] % len(_FAKE_WORDS)] for i in range(n_words))
+
+
+class FakeCompletion(_FakeBase):
+    """Deterministic chat completion: the reply depends only on model + messages."""
+    name = "fake-llm"
+
+    def complete(self, model, messages, temperature, max_tokens, timeout=None):
+        self._simulate(timeout)
+        payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(payload).hexdigest()
+        prompt_chars = sum(len(m.get("content", "")) for m in messages)
+        body = (
+            f"[fake:{model}] Odpowiedź testowa {digest[:12]}.\n"
+            f"- Długość promptu: {prompt_chars} znaków\n"
+            f"- Punkt 1: {digest[12:20]}\n"
+            f"- Punkt 2: {digest[20:28]}"
+        )
+        # z grubsza szanujemy max_tokens (~4 znaki/token)
+        return body[:max(16, max_tokens * 4)]
+
+
+# === WYBÓR BACKENDU ===
+def get_transcriber(model_path: Optional[str] = None, backend: Optional[str] = None) -> TranscriptionBackend:
+    backend = backend or ASR_BACKEND
+    if backend == "fake":
+        return FakeTranscriber(FAKE_ASR_LATENCY, FAKE_ASR_ERROR_RATE)
+    if backend == "vosk":
+        path = model_path or os.environ.get("VOSK_MODEL_PATH", os.path.join(BASE_DIR, "vosk-model-small-pl-0.22"))
+        return VoskTranscriber(path)
+    raise BackendError(f"Nieznany ASR_BACKEND: {backend}")
+
+
+def get_completion_backend(backend: Optional[str] = None) -> CompletionBackend:
+    backend = backend or LLM_BACKEND
+    if backend == "fake":
+        return FakeCompletion(FAKE_LLM_LATENCY, FAKE_LLM_ERROR_RATE)
+    if backend == "groq":
+        return GroqCompletion()
+    raise BackendError(f"Nieznany LLM_BACKEND: {backend}")
+
+
+__all__ = [
+    "BackendError",
+    "CompletionBackend",
+    "FakeCompletion",
+    "FakeTranscriber",
+    "GroqCompletion",
+    "TranscriptionBackend",
+    "VoskTranscriber",
+    "get_completion_backend",
+    "get_transcriber",
+    "parse_latency",
+]
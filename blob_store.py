@@ -0,0 +1,241 @@
+"""Content-addressed blob store for audio and derived artifacts.
+
+Every artifact body is stored once under its SHA-256, in fan-out directories
+(`blobs/ab/cd/abcd...`), and written via a temp file + os.replace so readers
+never see half a blob. Identical uploads (and identical transcripts or
+summaries) share one file. The `blobs` table keeps a reference count that the
+artifacts index maintains in the same transaction as its own rows; a blob
+whose count dropped to zero is removed by `gc` after a grace period, so a
+concurrent upload of the same content can still claim it.
+
+Removal deletes the row and moves the bytes out of the blob's path (file
+renamed to a tombstone, segment record dropped) in one transaction, so a
+`put` racing with it either refreshed the row first (and the blob stays) or
+runs after the commit and finds nothing, writing the blob again. `incref`
+raises BlobMissing when the row is gone, so a put that lost the race is
+retried instead of leaving a reference to missing bytes.
+
+Small text blobs (`put(..., pack=True)`) are not written as files at all but
+appended to segment files (segment_store.py); `read` looks there first, so
+callers never need to know where a blob's bytes live.
+
+Usage:
+  python blob_store.py stats
+  python blob_store.py gc [--grace-hours 24] [--dry-run]
+"""
+import os
+import sys
+import hashlib
+import argparse
+import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from storage import Store, get_store
+from segment_store import SegmentStore, SEGMENT_MAX_RECORD
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BLOB_DIR = os.environ.get("BLOB_DIR", os.path.join(BASE_DIR, "blobs"))
+BLOB_GC_GRACE_HOURS = float(os.environ.get("BLOB_GC_GRACE_HOURS", "24"))
+
+BLOB_SCHEMA = [
+    # released_at: kiedy refcount spadł do zera (albo blob zapisano, a nikt go jeszcze nie wziął)
+    """CREATE TABLE IF NOT EXISTS blobs (
+        digest TEXT PRIMARY KEY,
+        size BIGINT NOT NULL,
+        refcount INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        released_at TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_blobs_released ON blobs (refcount, released_at)",
+]
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat()
+
+
+class BlobMissing(KeyError):
+    """The blob row was removed between `put` and `incref`; put the data again."""
+
+
+class BlobStore:
+    def __init__(self, root: str = BLOB_DIR, store: Optional[Store] = None):
+        self.root = os.path.abspath(root)
+        self.store = store or get_store()
+        self.store.ensure_schema(BLOB_SCHEMA)
+        os.makedirs(self.root, exist_ok=True)
+        self.segments = SegmentStore(store=self.store)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def owns(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(self.root + os.sep)
+
+    def put(self, data: bytes, pack: bool = False) -> Tuple[str, str, bool]:
+        """Store `data`; returns `(digest, path, newly_written)`. The caller must `incref` it.
+
+        With `pack`, data up to SEGMENT_MAX_RECORD bytes goes to a segment file and `path`
+        is only the blob's nominal location - read it back with `read`.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        # wiersz przed plikiem: odświeżony released_at chroni blob przed równoległym gc
+        self.store.execute(
+            "INSERT INTO blobs (digest, size, refcount, created_at, released_at) VALUES (?, ?, 0, ?, ?) "
+            "ON CONFLICT (digest) DO UPDATE SET released_at = CASE WHEN blobs.refcount = 0 "
+            "THEN excluded.released_at ELSE blobs.released_at END",
+            (digest, len(data), _now(), _now()),
+        )
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            return digest, path, False
+        if pack and len(data) <= SEGMENT_MAX_RECORD:
+            new = not self.segments.contains(digest)
+            self.segments.append(digest, data)
+            return digest, path, new
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return digest, path, True
+
+    def read(self, digest: str) -> bytes:
+        data = self.segments.get(digest)
+        if data is not None:
+            return data
+        with open(self.path_for(digest), "rb") as f:
+            return f.read()
+
+    def pack(self, digest: str) -> bool:
+        """Move an existing small blob file into a segment; returns True if a file was removed."""
+        path = self.path_for(digest)
+        if not os.path.exists(path) or os.path.getsize(path) > SEGMENT_MAX_RECORD:
+            return False
+        with open(path, "rb") as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != digest:
+            print(f"Warning: zawartość {path} nie zgadza się z nazwą, pomijam")
+            return False
+        self.segments.append(digest, data)
+        os.remove(path)
+        return True
+
+    def incref(self, cur, digest: str) -> None:
+        """Take a reference inside the caller's write transaction."""
+        cur.execute("UPDATE blobs SET refcount = refcount + 1, released_at = NULL WHERE digest = ?", (digest,))
+        if cur.rowcount != 1:
+            raise BlobMissing(digest)
+
+    def decref(self, cur, digest: str) -> None:
+        cur.execute(
+            "UPDATE blobs SET refcount = refcount - 1, "
+            "released_at = CASE WHEN refcount <= 1 THEN ? ELSE released_at END "
+            "WHERE digest = ? AND refcount > 0",
+            (_now(), digest),
+        )
+
+    def _drop(self, digest: str, released_before: Optional[str] = None) -> Optional[int]:
+        """Remove an unreferenced blob (row, segment record, file); returns its size or None if it is in use."""
+        path = self.path_for(digest)
+        tomb = f"{path}.{os.getpid()}.gc.tmp"
+        moved = False
+        try:
+            with self.store.transaction(write=True) as cur:
+                # ponowne sprawdzenie w transakcji - ktoś mógł właśnie wziąć referencję
+                sql = "SELECT size FROM blobs WHERE digest = ? AND refcount = 0"
+                params = [digest]
+                if released_before:
+                    sql += " AND released_at < ?"
+                    params.append(released_before)
+                cur.execute(sql, params)
+                row = cur.fetchone()
+                if row is None:
+                    return None
+                cur.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                cur.execute("DELETE FROM segment_records WHERE digest = ?", (digest,))
+                # plik znika spod ścieżki bloba przed commitem: put czekający na tę transakcję
+                # nie zobaczy ani wiersza, ani pliku i zapisze blob od nowa
+                try:
+                    os.replace(path, tomb)
+                    moved = True
+                except FileNotFoundError:
+                    pass
+        except BaseException:
+            if moved:
+                os.replace(tomb, path)
+            raise
+        if moved:
+            os.remove(tomb)
+        return int(row["size"])
+
+    def drop_if_unreferenced(self, digest: str) -> Optional[int]:
+        """Remove the blob now (no grace period) if nothing references it; returns bytes freed."""
+        return self._drop(digest)
+
+    def gc(self, grace_hours: float = BLOB_GC_GRACE_HOURS, dry_run: bool = False) -> Dict[str, Any]:
+        """Delete blobs unreferenced for longer than the grace period, plus files nobody knows about."""
+        cutoff = (datetime.datetime.now() - datetime.timedelta(hours=grace_hours)).isoformat()
+        report = {"deleted": 0, "bytes_freed": 0, "orphans": 0, "dry_run": dry_run}
+        rows = self.store.execute(
+            "SELECT digest, size FROM blobs WHERE refcount = 0 AND released_at < ?", (cutoff,)
+        )
+        for row in rows:
+            if not dry_run and self._drop(row["digest"], cutoff) is None:
+                continue
+            report["deleted"] += 1
+            report["bytes_freed"] += row["size"]
+
+        # pliki bez wiersza w tabeli (przerwany put, ręczne kopie) - też po okresie karencji
+        cutoff_ts = datetime.datetime.fromisoformat(cutoff).timestamp()
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if os.path.getmtime(path) >= cutoff_ts:
+                    continue
+                if name.endswith(".tmp") or not self.store.execute("SELECT 1 FROM blobs WHERE digest = ?", (name,)):
+                    report["orphans"] += 1
+                    report["bytes_freed"] += os.path.getsize(path)
+                    if not dry_run:
+                        os.remove(path)
+        if not dry_run:
+            # usunięte rekordy w segmentach zwalniamy przepisując prawie puste segmenty
+            report["segments"] = self.segments.compact()
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self.store.execute(
+            "SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS bytes, COALESCE(SUM(refcount), 0) AS refs, "
+            "COALESCE(SUM(CASE WHEN refcount = 0 THEN size ELSE 0 END), 0) AS unreferenced_bytes FROM blobs"
+        )
+        stats = {k: int(v) for k, v in rows[0].items()}
+        # bajty, których nie zapisaliśmy dzięki deduplikacji
+        saved = self.store.execute("SELECT COALESCE(SUM(size * (refcount - 1)), 0) AS saved FROM blobs WHERE refcount > 1")
+        stats["dedup_saved_bytes"] = int(saved[0]["saved"])
+        return stats
+
+
+def main():
+    p = argparse.ArgumentParser(description="Content-addressed blob store")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats")
+    g = sub.add_parser("gc")
+    g.add_argument("--grace-hours", type=float, default=BLOB_GC_GRACE_HOURS)
+    g.add_argument("--dry-run", action="store_true")
+    args = p.parse_args()
+
+    blobs = BlobStore()
+    if args.cmd == "stats":
+        print(blobs.stats())
+    else:
+        report = blobs.gc(args.grace_hours, args.dry_run)
+        print(f"Usunięto {report['deleted']} blobów i {report['orphans']} osieroconych plików, "
+              f"zwolniono {report['bytes_freed'] / (1024 * 1024):.2f} MB" + (" (dry-run)" if args.dry_run else ""))
+
+
+__all__ = ["BlobMissing", "BlobStore", "BLOB_DIR"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
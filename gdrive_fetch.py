@@ -1,48 +1,316 @@
+"""Incremental sync of the notes folder on Google Drive into `drive_notes/`.
+
+A manifest in the store (`drive_manifest`: Drive file id -> md5Checksum /
+modifiedDate / local path) remembers what is already on disk, so a run lists
+the folder once and downloads only new or changed files, several at a time
+(GDRIVE_SYNC_WORKERS). A file is entered in the manifest only after its
+download finished (temp file + os.replace), so a run that fails half-way
+simply picks up the rest next time. Callbacks passed as `on_new` get every
+new or changed file downloaded by this run.
+
+Downloading is not processing: `drive_processed` records, per user, which
+version (md5/modifiedDate) of each file went through the upload pipeline.
+`pending_for(username)` lists downloaded files that user has not processed
+yet - also ones fetched by an earlier download-only run - and the caller
+calls `mark_processed` once a file is done (main.py `drive-sync`).
+
+A downloaded file that disappeared from disk (retention.py trims old
+downloads and drops their manifest rows via `forget_downloads`) counts as not
+downloaded: the next sync fetches it again if it is still on Drive, and
+`pending_for` skips it until then. `drive_processed` is left alone, so a
+re-downloaded file of the same version is not processed a second time.
+
+Drive access sits behind `DriveSource`: `PyDriveSource` talks to Drive
+(saved credentials from GDRIVE_CREDENTIALS, a service account from
+GDRIVE_SERVICE_ACCOUNT_JSON, or - only on a terminal - the interactive
+command-line flow), `LocalDirSource` serves a local directory the same way
+for offline runs and tests.
+
+Usage:
+  python gdrive_fetch.py [--local DIR] [--workers 4]
+"""
 import os
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
+import sys
+import hashlib
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Protocol
 
-FOLDER_ID = "1A6_69CaxPr_reZRsIgoHv9C6CS9ll7Nv"  # Twój folder w Google Drive
-LOCAL_FOLDER = "drive_notes"  # lokalny folder do zapisu plików
+from storage import Store, get_store
 
-def fetch_notes_from_drive():
-    os.makedirs(LOCAL_FOLDER, exist_ok=True)
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FOLDER_ID = os.environ.get("GDRIVE_FOLDER_ID", "1A6_69CaxPr_reZRsIgoHv9C6CS9ll7Nv")  # Twój folder w Google Drive
+LOCAL_FOLDER = os.environ.get("DRIVE_NOTES_DIR", os.path.join(BASE_DIR, "drive_notes"))  # lokalny folder do zapisu plików
+GDRIVE_CREDENTIALS = os.environ.get("GDRIVE_CREDENTIALS", os.path.join(BASE_DIR, "mycreds.txt"))
+GDRIVE_SERVICE_ACCOUNT_JSON = os.environ.get("GDRIVE_SERVICE_ACCOUNT_JSON")
+GDRIVE_SYNC_WORKERS = int(os.environ.get("GDRIVE_SYNC_WORKERS", "4"))
 
-    # Autoryzacja – w tym trybie otwiera się przeglądarka
-    gauth = GoogleAuth()
-    gauth.CommandLineAuth()  # 🔑 to działa ręcznie i zapisuje token w credentials.json
-    drive = GoogleDrive(gauth)
+GOOGLE_DOC = "application/vnd.google-apps.document"
 
-    file_list = drive.ListFile({
-        'q': f"'{FOLDER_ID}' in parents and trashed=false",
-        'supportsAllDrives': True,
-        'includeItemsFromAllDrives': True
-    }).GetList()
+MANIFEST_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS drive_manifest (
+        file_id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        md5 TEXT,
+        modified TEXT,
+        local_path TEXT NOT NULL,
+        size BIGINT,
+        synced_at TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_drive_manifest_path ON drive_manifest (local_path)",
+    # która wersja pliku przeszła już przez pipeline danego użytkownika
+    """CREATE TABLE IF NOT EXISTS drive_processed (
+        file_id TEXT NOT NULL,
+        username TEXT NOT NULL,
+        md5 TEXT,
+        modified TEXT,
+        processed_at TEXT NOT NULL,
+        PRIMARY KEY (file_id, username)
+    )""",
+]
 
-    if not file_list:
-        print("Brak plików w folderze!")
-        return 0
 
-    downloaded = 0
-    for file in file_list:
-        file_title = file['title']
-        mime_type = file['mimeType']
-        local_path = os.path.join(LOCAL_FOLDER, file_title)
+# === ŹRÓDŁA ===
+class DriveSource(Protocol):
+    """Lists and downloads the files of one folder.
+
+    `list_files` returns dicts with `id`, `title`, `md5` (None for Google Docs),
+    `modified` (ISO) and `mime`; `download` writes one of them to `dest`.
+    """
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        ...
+
+    def download(self, item: Dict[str, Any], dest: str) -> None:
+        ...
+
+
+class PyDriveSource:
+    def __init__(self, folder_id: str = FOLDER_ID):
+        from pydrive2.drive import GoogleDrive
+        self.folder_id = folder_id
+        self.drive = GoogleDrive(self._authenticate())
+        self._local = threading.local()
+
+    @staticmethod
+    def _authenticate():
+        from pydrive2.auth import GoogleAuth
+        if GDRIVE_SERVICE_ACCOUNT_JSON:
+            gauth = GoogleAuth(settings={"client_config_backend": "service",
+                                         "service_config": {"client_json_file_path": GDRIVE_SERVICE_ACCOUNT_JSON}})
+            gauth.ServiceAuth()
+            return gauth
+        gauth = GoogleAuth()
+        if os.path.exists(GDRIVE_CREDENTIALS):
+            gauth.LoadCredentialsFile(GDRIVE_CREDENTIALS)
+        if gauth.credentials is None:
+            if not sys.stdin.isatty():
+                raise RuntimeError(f"Brak zapisanych poświadczeń Drive ({GDRIVE_CREDENTIALS}) - uruchom raz "
+                                   "`python gdrive_fetch.py` w terminalu albo ustaw GDRIVE_SERVICE_ACCOUNT_JSON")
+            gauth.CommandLineAuth()  # 🔑 jednorazowo, ręcznie
+        elif gauth.access_token_expired:
+            gauth.Refresh()
+        else:
+            gauth.Authorize()
+        gauth.SaveCredentialsFile(GDRIVE_CREDENTIALS)
+        return gauth
+
+    def _http(self):
+        # obiekt httplib2 nie jest bezpieczny wątkowo - osobny na wątek pobierania
+        if not hasattr(self._local, "http"):
+            self._local.http = self.drive.auth.Get_Http_Object()
+        return self._local.http
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        file_list = self.drive.ListFile({
+            'q': f"'{self.folder_id}' in parents and trashed=false",
+            'supportsAllDrives': True,
+            'includeItemsFromAllDrives': True
+        }).GetList()
+        return [{"id": f["id"], "title": f["title"], "md5": f.get("md5Checksum"), "modified": f.get("modifiedDate"),
+                 "mime": f["mimeType"], "handle": f} for f in file_list]
+
+    def download(self, item: Dict[str, Any], dest: str) -> None:
+        if item["mime"] == GOOGLE_DOC:
+            # konwersja Google Docs do pliku .txt
+            item["handle"].GetContentFile(dest, mimetype='text/plain', param={"http": self._http()})
+        else:
+            item["handle"].GetContentFile(dest, param={"http": self._http()})
+
+
+class LocalDirSource:
+    """A local directory posing as the Drive folder (offline runs, tests)."""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        items = []
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if not os.path.isfile(path) or name.startswith("."):
+                continue
+            with open(path, "rb") as f:
+                md5 = hashlib.md5(f.read()).hexdigest()
+            modified = datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+            items.append({"id": "local:" + name, "title": name, "md5": md5, "modified": modified,
+                          "mime": "application/octet-stream"})
+        return items
+
+    def download(self, item: Dict[str, Any], dest: str) -> None:
+        with open(os.path.join(self.root, item["title"]), "rb") as src, open(dest, "wb") as out:
+            out.write(src.read())
 
+
+# === SYNCHRONIZACJA ===
+class DriveSync:
+    def __init__(self, source: DriveSource, local_folder: str = LOCAL_FOLDER, store: Optional[Store] = None,
+                 workers: int = GDRIVE_SYNC_WORKERS):
+        self.source = source
+        self.local_folder = local_folder
+        self.store = store or get_store()
+        self.store.ensure_schema(MANIFEST_SCHEMA)
+        self.workers = max(1, workers)
+
+    def manifest(self) -> Dict[str, Dict[str, Any]]:
+        return {r["file_id"]: r for r in self.store.execute("SELECT * FROM drive_manifest")}
+
+    def pending_for(self, username: str) -> List[Dict[str, Any]]:
+        """Downloaded files (manifest rows + absolute `path`) not yet processed for `username` in this version."""
+        rows = self.store.execute(
+            "SELECT m.* FROM drive_manifest m LEFT JOIN drive_processed p "
+            "ON p.file_id = m.file_id AND p.username = ? "
+            "WHERE p.file_id IS NULL OR COALESCE(p.md5, '') <> COALESCE(m.md5, '') "
+            "OR COALESCE(p.modified, '') <> COALESCE(m.modified, '') ORDER BY m.local_path",
+            (username.lower(),),
+        )
+        pending = []
+        for row in rows:
+            row["path"] = os.path.join(self.local_folder, row["local_path"])
+            # usunięty z dysku - czeka na ponowne pobranie
+            if os.path.exists(row["path"]):
+                pending.append(row)
+        return pending
+
+    def mark_processed(self, username: str, row: Dict[str, Any]) -> None:
+        self.store.execute(
+            "INSERT INTO drive_processed (file_id, username, md5, modified, processed_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (file_id, username) DO UPDATE SET md5 = excluded.md5, modified = excluded.modified, "
+            "processed_at = excluded.processed_at",
+            (row["file_id"], username.lower(), row.get("md5"), row.get("modified"), datetime.datetime.now().isoformat()),
+        )
+
+    def _changed(self, item: Dict[str, Any], known: Optional[Dict[str, Any]]) -> bool:
+        if known is None or not os.path.exists(os.path.join(self.local_folder, known["local_path"])):
+            return True
+        if item.get("md5") and known.get("md5"):
+            return item["md5"] != known["md5"]
+        return item.get("modified") != known.get("modified")
+
+    def _local_name(self, item: Dict[str, Any], known: Optional[Dict[str, Any]], taken: Dict[str, str]) -> str:
+        if known:
+            return known["local_path"]
+        name = item["title"] + (".txt" if item["mime"] == GOOGLE_DOC else "")
+        # dwa pliki o tej samej nazwie na Drive nie mogą nadpisać się lokalnie
+        if name in taken and taken[name] != item["id"]:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}_{item['id'][:8]}{ext}"
+        return name
+
+    def _download(self, item: Dict[str, Any], local_name: str) -> str:
+        dest = os.path.join(self.local_folder, local_name)
+        tmp = f"{dest}.{threading.get_ident()}.part"
         try:
-            if mime_type == 'application/vnd.google-apps.document':
-                # konwersja Google Docs do pliku .txt
-                file.GetContentFile(local_path + ".txt", mimetype='text/plain')
-            else:
-                file.GetContentFile(local_path)
-            downloaded += 1
-            print(f"Pobrano: {file_title}")
-        except Exception as e:
-            print(f"Błąd przy pobieraniu {file_title}: {e}")
-
-    print(f"✅ Pobrano łącznie {downloaded} plików.")
-    return downloaded
+            self.source.download(item, tmp)
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.store.execute(
+            "INSERT INTO drive_manifest (file_id, title, md5, modified, local_path, size, synced_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (file_id) DO UPDATE SET title = excluded.title, "
+            "md5 = excluded.md5, modified = excluded.modified, local_path = excluded.local_path, "
+            "size = excluded.size, synced_at = excluded.synced_at",
+            (item["id"], item["title"], item.get("md5"), item.get("modified"), local_name,
+             os.path.getsize(dest), datetime.datetime.now().isoformat()),
+        )
+        return dest
+
+    def sync(self, on_new: Optional[Callable[[Dict[str, Any], str], None]] = None) -> Dict[str, Any]:
+        """Download new/changed files; returns counts and the local paths that arrived."""
+        os.makedirs(self.local_folder, exist_ok=True)
+        manifest = self.manifest()
+        taken = {m["local_path"]: fid for fid, m in manifest.items()}
+        todo = []
+        report: Dict[str, Any] = {"unchanged": 0, "downloaded": 0, "failed": 0, "new_files": []}
+        for item in self.source.list_files():
+            known = manifest.get(item["id"])
+            if not self._changed(item, known):
+                report["unchanged"] += 1
+                continue
+            name = self._local_name(item, known, taken)
+            taken[name] = item["id"]
+            todo.append((item, name))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._download, item, name): item for item, name in todo}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    path = future.result()
+                except Exception as e:
+                    # bez wpisu w manifeście - następny przebieg spróbuje ponownie
+                    print(f"Błąd przy pobieraniu {item['title']}: {e}")
+                    report["failed"] += 1
+                    continue
+                print(f"Pobrano: {item['title']}")
+                report["downloaded"] += 1
+                report["new_files"].append(path)
+                if on_new is not None:
+                    try:
+                        on_new(item, path)
+                    except Exception as e:
+                        print(f"Warning: on_new failed for {item['title']}: {e}")
+        return report
+
+
+def forget_downloads(local_paths: List[str], store: Optional[Store] = None) -> int:
+    """Drop manifest rows of downloads removed from disk (paths relative to the local folder)."""
+    if not local_paths:
+        return 0
+    store = store or get_store()
+    store.ensure_schema(MANIFEST_SCHEMA)
+    with store.transaction(write=True) as cur:
+        cur.executemany("DELETE FROM drive_manifest WHERE local_path = ?", [(p,) for p in local_paths])
+    return len(local_paths)
+
+
+def fetch_notes_from_drive(source: Optional[DriveSource] = None,
+                           on_new: Optional[Callable[[Dict[str, Any], str], None]] = None) -> int:
+    """Sync the Drive folder into LOCAL_FOLDER; returns the number of files downloaded."""
+    report = DriveSync(source or PyDriveSource()).sync(on_new)
+    print(f"✅ Pobrano łącznie {report['downloaded']} plików "
+          f"({report['failed']} błędów, {report['unchanged']} bez zmian).")
+    return report["downloaded"]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Incremental Google Drive sync")
+    p.add_argument("--local", help="katalog udający folder Drive (tryb offline)")
+    p.add_argument("--workers", type=int, default=GDRIVE_SYNC_WORKERS)
+    args = p.parse_args()
+    source = LocalDirSource(args.local) if args.local else PyDriveSource()
+    report = DriveSync(source, workers=args.workers).sync()
+    print(f"✅ Pobrano łącznie {report['downloaded']} plików ({report['failed']} błędów).")
+
+
+__all__ = ["DriveSource", "PyDriveSource", "LocalDirSource", "DriveSync", "forget_downloads",
+           "fetch_notes_from_drive"]
+
 
 # Uruchomienie skryptu ręcznie
 if __name__ == "__main__":
-    fetch_notes_from_drive()
+    sys.exit(main())
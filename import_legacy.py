@@ -0,0 +1,250 @@
+"""Bulk importer for the legacy `data/<date>/<time>/` recording tree.
+
+The old recorder wrote one directory per recording:
+
+    data/16.11.2025/19:33/recording_1763318015316.webm   (or .wav / .m4a ...)
+    data/16.11.2025/19:33/recording_1763318015316.wav    (decoded copy)
+    data/16.11.2025/19:33/recording_1763318015316.txt    (transcript)
+    data/16.11.2025/19:33/recording_1763318015316_summary.txt
+
+Each recording becomes one job of the given user: the audio is hashed and
+stored through the audio policy (one compressed copy, decoded WAVs are not
+imported), the existing transcript and summary are registered as artifacts
+with the recording's original timestamp, and the processed ledger learns the
+digest so a later upload of the same audio reuses the imported transcript.
+ASR runs only for recordings without a transcript (--transcribe-gaps); no
+LLM calls are made.
+
+Recordings are processed by a thread pool. Progress is a delta checkpoint
+(session_manager) keyed by the recording path, so an interrupted import
+resumes where it stopped; job ids are deterministic, so even without the
+checkpoint nothing is imported twice.
+
+Usage:
+  python import_legacy.py --user ala [--root data] [--workers 8] [--transcribe-gaps] [--dry-run]
+"""
+import os
+import re
+import sys
+import hashlib
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from artifacts import ArtifactStore
+from audio_policy import canonical_audio, decode_for_asr, is_compressed
+from processed_index import get_processed_index
+from search_index import SearchIndex
+from session_manager import SessionManager
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEGACY_DATA_DIR = os.environ.get("LEGACY_DATA_DIR", os.path.join(BASE_DIR, "data"))
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", str(min(8, (os.cpu_count() or 2) * 2))))
+# co tyle nagrań zapisujemy postęp (łatka w logu checkpointu)
+IMPORT_CHECKPOINT_EVERY = int(os.environ.get("IMPORT_CHECKPOINT_EVERY", "50"))
+
+AUDIO_EXTS = (".webm", ".m4a", ".ogg", ".opus", ".mp3", ".flac", ".wav")
+_STEM_RE = re.compile(r"^(recording_\d+)(_summary)?\.(\w+)$")
+
+
+def _recording_time(stem: str, dirpath: str) -> str:
+    """Original recording time: the ms timestamp in the name, else the date/time directories."""
+    m = re.search(r"(\d{12,})", stem)
+    if m:
+        return datetime.datetime.fromtimestamp(int(m.group(1)) / 1000).isoformat()
+    try:
+        day, hour = dirpath.rstrip(os.sep).split(os.sep)[-2:]
+        return datetime.datetime.strptime(f"{day} {hour}", "%d.%m.%Y %H:%M").isoformat()
+    except ValueError:
+        return datetime.datetime.now().isoformat()
+
+
+def scan(root: str) -> List[Dict[str, Any]]:
+    """Group the files of the tree into recordings: `{key, dir, stem, audio: [...], transcript, summary}`."""
+    recordings: Dict[str, Dict[str, Any]] = {}
+    for dirpath, _, files in os.walk(root):
+        for name in sorted(files):
+            m = _STEM_RE.match(name)
+            if not m:
+                continue
+            stem, is_summary, ext = m.group(1), bool(m.group(2)), "." + m.group(3).lower()
+            key = os.path.relpath(os.path.join(dirpath, stem), root)
+            rec = recordings.setdefault(key, {"key": key, "dir": dirpath, "stem": stem, "audio": [],
+                                              "transcript": None, "summary": None})
+            path = os.path.join(dirpath, name)
+            if is_summary and ext == ".txt":
+                rec["summary"] = path
+            elif ext == ".txt":
+                rec["transcript"] = path
+            elif ext in AUDIO_EXTS:
+                rec["audio"].append(path)
+    return [recordings[k] for k in sorted(recordings)]
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class LegacyImporter:
+    def __init__(self, artifacts: ArtifactStore, username: str, transcriber=None, dry_run: bool = False):
+        self.artifacts = artifacts
+        self.username = username.lower()
+        self.transcriber = transcriber
+        self.dry_run = dry_run
+        self.processed = get_processed_index()
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def _claim(self, digest: str) -> bool:
+        """First worker to see an audio digest imports it; later ones are duplicates."""
+        with self._lock:
+            if digest in self._claimed:
+                return False
+            self._claimed.add(digest)
+            return True
+
+    def import_recording(self, rec: Dict[str, Any]) -> str:
+        """Import one recording; returns its status (imported / duplicate / skipped / exists).
+
+        Kinds the job already has are not written again, so a recording cut off
+        halfway by a crash is completed on the next run.
+        """
+        job_id = f"legacy_{rec['stem']}"
+        existing = {a["kind"] for a in self.artifacts.for_job(self.username, job_id)}
+        created_at = _recording_time(rec["stem"], rec["dir"])
+        # skompresowany oryginał ma pierwszeństwo przed zdekodowanym WAV-em
+        audio_path = next((p for p in rec["audio"] if is_compressed(p)), rec["audio"][0] if rec["audio"] else None)
+        audio = digest = None
+        if audio_path:
+            audio = _read(audio_path)
+            digest = hashlib.sha256(audio).hexdigest()
+            previous = self.processed.get(digest)
+            if not self._claim(digest) or (previous and previous.get("username") == self.username
+                                           and previous.get("job_id") != job_id):
+                return "duplicate"
+        wanted = {k for k, present in (("audio", audio_path), ("transcript", rec["transcript"] or (audio_path and self.transcriber)),
+                                       ("summary", rec["summary"])) if present}
+        if not wanted:
+            return "skipped"
+        if wanted <= existing:
+            return "exists"
+
+        transcript_text = None
+        if "transcript" not in existing:
+            if rec["transcript"]:
+                transcript_text = _read(rec["transcript"]).decode("utf-8", errors="replace")
+            elif self.transcriber is not None and not self.dry_run:
+                try:
+                    transcript_text = self.transcriber.transcribe(decode_for_asr(audio_path))
+                except Exception as e:
+                    print(f"Błąd transkrypcji {audio_path}: {e}")
+        if self.dry_run:
+            return "imported"
+
+        transcript_name = f"{rec['stem']}.txt"
+        if audio_path and "audio" not in existing:
+            name, data = canonical_audio(os.path.basename(audio_path), audio)
+            self.artifacts.write(self.username, "audio", name, data, job_id, created_at=created_at)
+        if transcript_text is not None:
+            self.artifacts.write(self.username, "transcript", transcript_name, transcript_text, job_id,
+                                 created_at=created_at)
+        if rec["summary"] and "summary" not in existing:
+            self.artifacts.write(self.username, "summary", os.path.basename(rec["summary"]),
+                                 _read(rec["summary"]).decode("utf-8", errors="replace"), job_id, created_at=created_at)
+        if digest and not (previous and previous.get("job_id") == job_id):
+            self.processed.record(digest, {
+                "orig": os.path.basename(audio_path),
+                "wav": None,
+                "transcript": transcript_name if transcript_text is not None or "transcript" in existing else None,
+                "processed_at": datetime.datetime.now().isoformat(),
+                "username": self.username,
+                "job_id": job_id,
+                "imported_from": rec["key"],
+            })
+        return "imported"
+
+
+def run_import(root: str, username: str, workers: int = IMPORT_WORKERS, transcribe_gaps: bool = False,
+               dry_run: bool = False, artifacts: Optional[ArtifactStore] = None,
+               sessions: Optional[SessionManager] = None) -> Dict[str, int]:
+    if artifacts is None:
+        notes, summaries = os.path.join(BASE_DIR, "notes_data"), os.path.join(BASE_DIR, "summary_data")
+        artifacts = ArtifactStore({"audio": notes, "wav": notes, "transcript": notes,
+                                   "summary": summaries, "analysis": summaries})
+        # zaimportowane teksty od razu trafiają do wyszukiwarki i indeksu podobnych notatek
+        search_index = SearchIndex(artifacts.store)
+        artifacts.on_write(search_index.index_artifact)
+        try:
+            from related_index import get_related_index
+            related = get_related_index()
+            if related is not None:
+                artifacts.on_write(related.index_artifact)
+        except Exception as e:
+            print(f"Warning: related index unavailable: {e}")
+    sessions = sessions or SessionManager(store=artifacts.store)
+
+    transcriber = None
+    if transcribe_gaps and not dry_run:
+        from backends import get_transcriber
+        transcriber = get_transcriber()
+
+    root = os.path.abspath(root)
+    session_id = "legacy_import_" + hashlib.sha256(f"{root}|{username.lower()}".encode("utf-8")).hexdigest()[:12]
+    sessions.create_session(session_id, {"root": root, "username": username.lower()})
+    done = sessions.get_checkpoint(session_id) if not dry_run else {}
+
+    found = scan(root)
+    recordings = [r for r in found if r["key"] not in done]
+    print(f"Do importu: {len(recordings)} nagrań ({len(found) - len(recordings)} już zrobionych wg checkpointu)")
+    importer = LegacyImporter(artifacts, username, transcriber, dry_run)
+    counts: Dict[str, int] = {}
+    pending: Dict[str, str] = {}
+
+    def flush():
+        if pending and not dry_run:
+            sessions.update_checkpoint(session_id, dict(pending))
+        pending.clear()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(importer.import_recording, rec): rec for rec in recordings}
+        for i, future in enumerate(as_completed(futures), start=1):
+            rec = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                # błędne nagranie nie trafia do checkpointu - kolejny przebieg spróbuje ponownie
+                print(f"Błąd importu {rec['key']}: {e}")
+                status = "failed"
+            counts[status] = counts.get(status, 0) + 1
+            if status != "failed":
+                pending[rec["key"]] = status
+            if len(pending) >= IMPORT_CHECKPOINT_EVERY:
+                flush()
+            if i % 500 == 0:
+                print(f"  {i}/{len(recordings)} {counts}")
+    flush()
+    return counts
+
+
+def main():
+    p = argparse.ArgumentParser(description="Import the legacy data/<date>/<time>/ recording tree")
+    p.add_argument("--user", required=True, help="konto, do którego trafią nagrania")
+    p.add_argument("--root", default=LEGACY_DATA_DIR)
+    p.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    p.add_argument("--transcribe-gaps", action="store_true", help="uruchom ASR dla nagrań bez transkrypcji")
+    p.add_argument("--dry-run", action="store_true")
+    args = p.parse_args()
+
+    counts = run_import(args.root, args.user, args.workers, args.transcribe_gaps, args.dry_run)
+    print(f"Gotowe: {counts}" + (" (dry-run)" if args.dry_run else ""))
+
+
+__all__ = ["LegacyImporter", "run_import", "scan"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
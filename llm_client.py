@@ -0,0 +1,295 @@
+import os
+import time
+import threading
+from typing import Any, Dict, List, Optional
+
+# === KONFIGURACJA ===
+# górny limit pojedynczego wywołania; realny timeout maleje wraz z wiekiem zadania
+LLM_CALL_TIMEOUT = float(os.environ.get("LLM_CALL_TIMEOUT", "60"))
+# po tylu kolejnych błędach breaker się otwiera
+LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", "5"))
+# po tylu sekundach otwarty breaker przepuszcza jedno wywołanie próbne (half-open)
+LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", "30"))
+# minimalny sensowny timeout - poniżej tego nie ma po co dzwonić
+LLM_MIN_TIMEOUT = float(os.environ.get("LLM_MIN_TIMEOUT", "2"))
+# wspólny limit wywołań na minutę dla wszystkich wątków procesu; 0 = bez limitu
+LLM_RATE_LIMIT_RPM = float(os.environ.get("LLM_RATE_LIMIT_RPM", "0"))
+# po 429 bez nagłówka Retry-After wstrzymujemy wszystkie wywołania na tyle sekund
+LLM_RATE_LIMIT_PAUSE = float(os.environ.get("LLM_RATE_LIMIT_PAUSE", "30"))
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the provider while the breaker is open."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a job has no time budget left for another LLM call."""
+
+
+class Deadline:
+    """Absolute deadline for a whole job (upload, batch run); timeouts shrink as it ages."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float = LLM_CALL_TIMEOUT) -> float:
+        remaining = self.remaining()
+        if remaining < LLM_MIN_TIMEOUT:
+            raise DeadlineExceeded(f"Brak czasu na wywołanie LLM (zostało {remaining:.1f}s z {self.seconds:.0f}s)")
+        return min(cap, remaining)
+
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` consecutive failures -> half-open after `reset_timeout`.
+
+    In half-open state a single probe call is let through; success closes the
+    breaker, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, threshold: int = LLM_BREAKER_THRESHOLD, reset_timeout: float = LLM_BREAKER_RESET):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures_total = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self) -> None:
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"Circuit breaker '{self.name}' otwarty - pomijam wywołanie")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+            self.successes += 1
+
+    def record_ignored(self) -> None:
+        """The call failed for a reason that says nothing about provider health (4xx, 429).
+
+        Neither counts as a failure nor closes the breaker; only frees the half-open probe slot.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self.failures_total += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self.trips += 1
+                print(f"[WARN] Circuit breaker '{self.name}' otwarty po {self._failures} błędach")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._current_state()
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)) if state == self.OPEN else 0.0
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "successes": self.successes,
+                "failures": self.failures_total,
+                "retry_in_s": round(retry_in, 1),
+            }
+
+
+class RateLimiter:
+    """Spaces calls evenly (`rpm` per minute) across all threads of the process.
+
+    `pause` pushes the next free slot back for everyone, so a 429 seen by one
+    worker throttles the whole pool instead of each worker retrying on its own.
+    """
+
+    def __init__(self, rpm: float = LLM_RATE_LIMIT_RPM):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+        self.waited_s = 0.0
+
+    def acquire(self, deadline: Optional[Deadline] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_at)
+            self._next_at = slot + self.interval
+            wait = slot - now
+            self.waited_s += wait
+        if wait <= 0:
+            return
+        if deadline is not None and wait >= deadline.remaining():
+            raise DeadlineExceeded(f"Limit wywołań: kolejny slot za {wait:.1f}s, po deadlinie zadania")
+        time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rpm": round(60.0 / self.interval, 1) if self.interval else 0,
+                "next_slot_in_s": round(max(0.0, self._next_at - time.monotonic()), 1),
+                "waited_s": round(self.waited_s, 1),
+            }
+
+
+groq_breaker = CircuitBreaker("groq")
+groq_limiter = RateLimiter()
+
+
+def _status_code(e: Exception) -> Optional[int]:
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(e: Exception) -> str:
+    """"rate_limit" (429), "transient" (timeout, 5xx, connection) or "client" (anything else).
+
+    Only transient errors say the provider is unhealthy and count on the breaker.
+    """
+    status = _status_code(e)
+    if status == 429:
+        return "rate_limit"
+    if status is not None:
+        return "transient" if status >= 500 else "client"
+    # groq/openai SDK: APITimeoutError, APIConnectionError; httpx: ConnectTimeout, ConnectError, ...
+    name = type(e).__name__
+    if isinstance(e, (TimeoutError, ConnectionError)) or "Timeout" in name or "Connect" in name:
+        return "transient"
+    err = str(e).lower()
+    if "rate limit" in err or "429" in err:
+        return "rate_limit"
+    return "client"
+
+
+def _retry_after(e: Exception) -> float:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return LLM_RATE_LIMIT_PAUSE
+
+
+def extract_choice_text(response):
+    try:
+        choice = response.choices[0]
+    except Exception:
+        return str(response)
+    msg = getattr(choice, "message", None)
+    if msg is None:
+        try:
+            msg = choice.get("message") if isinstance(choice, dict) else None
+        except Exception:
+            msg = None
+    if isinstance(msg, dict):
+        if "content" in msg:
+            content = msg["content"]
+            if isinstance(content, dict):
+                return content.get("text") or (content.get("parts") and " ".join(content.get("parts"))) or str(content)
+            return content
+    else:
+        text = getattr(msg, "content", None) or getattr(msg, "text", None)
+        if text is not None:
+            return text
+    text = getattr(choice, "text", None) or getattr(choice, "message_content", None)
+    if text:
+        return text
+    return str(response)
+
+
+def chat_completion(backend, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                    deadline: Optional[Deadline] = None, breaker: Optional[CircuitBreaker] = None,
+                    limiter: Optional[RateLimiter] = None) -> str:
+    """Single chat-completion call guarded by the rate limiter, circuit breaker and job deadline.
+
+    `backend` is any `backends.CompletionBackend` (Groq, fake). Raises
+    CircuitOpenError without touching the network while the breaker is open,
+    DeadlineExceeded when the job is out of time, and re-raises provider errors.
+    Only timeouts, 5xx and connection errors count on the breaker; a 429
+    pauses the limiter (Retry-After or LLM_RATE_LIMIT_PAUSE) for every caller.
+    """
+    breaker = breaker or groq_breaker
+    limiter = limiter or groq_limiter
+    limiter.acquire(deadline)
+    timeout = deadline.timeout() if deadline else LLM_CALL_TIMEOUT
+    breaker.before_call()
+    try:
+        text = backend.complete(model, messages, temperature, max_tokens, timeout=timeout)
+    except Exception as e:
+        kind = classify_error(e)
+        if kind == "transient":
+            breaker.record_failure()
+        else:
+            if kind == "rate_limit":
+                limiter.pause(_retry_after(e))
+            breaker.record_ignored()
+        raise
+    breaker.record_success()
+    return text
+
+
+def llm_status() -> Dict[str, Any]:
+    return {
+        "breaker": groq_breaker.snapshot(),
+        "rate_limit": groq_limiter.snapshot(),
+        "call_timeout_s": LLM_CALL_TIMEOUT,
+    }
+
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "Deadline",
+    "DeadlineExceeded",
+    "RateLimiter",
+    "chat_completion",
+    "classify_error",
+    "extract_choice_text",
+    "groq_breaker",
+    "groq_limiter",
+    "llm_status",
+]
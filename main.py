@@ -1,16 +1,31 @@
+import base64
 import hashlib
-import os, io, json, datetime, wave, shutil
+import uuid
+import os, io, sys, argparse, datetime
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Depends, Body, Query
 from fastapi.security import OAuth2PasswordRequestForm
-from auth import register_user, authenticate_user, create_access_token, get_current_user
+from auth import (register_user_async, authenticate_user_async, get_current_user, require_admin, user_cache_stats,
+                  issue_tokens, rotate_refresh_token, revoke_refresh_token, RefreshTokenRotated, ADMIN_USERS)
+from password_hashing import HashingBusy, hashing_stats
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from pydub import AudioSegment
-import vosk
-from groq import Groq
 from dotenv import load_dotenv
 from session_manager import SessionManager
+from processed_index import get_processed_index
+from artifacts import ArtifactStore
+from retention import get_retention_manager
+from scheduler import get_scheduler
+from gdrive_fetch import DriveSync, LocalDirSource, PyDriveSource
+from search_index import SearchIndex, analyze as search_terms, make_snippet
+from related_index import embed, get_related_index
+from audio_policy import AUDIO_KEEP_WAV, canonical_audio, is_compressed
+from transcript_compactor import compact_transcript, COMPACTION_ENABLED
+from prompts import PromptTemplate, get_template
+from triage import triage, tier_stats, TEMPLATE_RESPONSE
+from llm_client import Deadline, chat_completion, llm_status
+from backends import BackendError, get_completion_backend, get_transcriber
 
 load_dotenv()
 
@@ -22,12 +37,6 @@ SUMMARY_FOLDER = os.path.join(BASE_DIR, "summary_data")
 os.makedirs(NOTES_FOLDER, exist_ok=True)
 os.makedirs(SUMMARY_FOLDER, exist_ok=True)
 
-# ensure processed.json exists (we may reset it for new sessions)
-PROCESSED_PATH = os.path.join(BASE_DIR, "processed.json")
-if not os.path.exists(PROCESSED_PATH):
-    with open(PROCESSED_PATH, "w", encoding="utf-8") as f:
-        json.dump({}, f)
-
 CHECKPOINT_DIR = os.path.join(BASE_DIR, "checkpoints")
 os.makedirs(CHECKPOINT_DIR, exist_ok=True)
 
@@ -35,73 +44,80 @@ os.makedirs(CHECKPOINT_DIR, exist_ok=True)
 SESSION_ID = os.environ.get("SESSION_ID", "default")
 session_manager = SessionManager(checkpoints_dir=CHECKPOINT_DIR)
 
-def _cleanup_user_files(clean_dirs, processed_path):
-    """Remove files inside the given directories and reset processed.json.
-
-    This deletes only the contents of the configured folders, not the folders themselves.
-    """
-    for d in clean_dirs:
-        try:
-            if not os.path.exists(d):
-                continue
-            for entry in os.listdir(d):
-                entry_path = os.path.join(d, entry)
-                try:
-                    if os.path.islink(entry_path) or os.path.isfile(entry_path):
-                        os.remove(entry_path)
-                    elif os.path.isdir(entry_path):
-                        shutil.rmtree(entry_path)
-                except Exception as e:
-                    print(f"Warning: could not remove {entry_path}: {e}")
-        except Exception as e:
-            print(f"Warning: could not cleanup directory {d}: {e}")
+# artefakty użytkowników: osobny (shardowany) katalog per konto + indeks w bazie
+artifacts = ArtifactStore({
+    "audio": NOTES_FOLDER,
+    "wav": NOTES_FOLDER,
+    "transcript": NOTES_FOLDER,
+    "summary": SUMMARY_FOLDER,
+    "analysis": SUMMARY_FOLDER,
+})
+
+# indeks pełnotekstowy aktualizowany przy każdym zapisie transkrypcji/summary/analizy
+search_index = SearchIndex(artifacts.store)
+artifacts.on_write(search_index.index_artifact)
+artifacts.on_delete(search_index.remove_artifact)
+artifacts.on_delete_user(search_index.remove_user)
+# wektory "podobnych notatek" (wymaga numpy; bez niego /notes/{id}/related zwraca 503)
+related_index = get_related_index()
+if related_index is not None:
+    artifacts.on_write(related_index.index_artifact)
+    artifacts.on_delete(related_index.remove_artifact)
+    artifacts.on_delete_user(related_index.remove_user)
+
+session_manager.create_session(SESSION_ID)
+
+# backendy wybierane przez ASR_BACKEND / LLM_BACKEND (fake = testy obciążeniowe offline)
+VOSK_MODEL_PATH = os.environ.get("VOSK_MODEL_PATH", os.path.join(BASE_DIR, "vosk-model-small-pl-0.22"))
+try:
+    transcriber = get_transcriber(VOSK_MODEL_PATH)
+    llm_backend = get_completion_backend()
+except BackendError as e:
+    raise SystemExit(str(e))
 
-    # reset processed.json
-    try:
-        with open(processed_path, "w", encoding="utf-8") as f:
-            json.dump({}, f)
-    except Exception as e:
-        print(f"Warning: could not reset processed file {processed_path}: {e}")
+MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
+# łączny budżet czasu na wywołania LLM jednego uploadu (summary + analiza)
+JOB_DEADLINE_S = float(os.environ.get("JOB_DEADLINE_S", "180"))
+# katalog udający folder Drive (offline / testy); puste = prawdziwy Google Drive
+GDRIVE_LOCAL_SOURCE = os.environ.get("GDRIVE_LOCAL_SOURCE")
+DRIVE_AUDIO_EXTS = (".m4a", ".webm", ".ogg", ".opus", ".mp3", ".wav", ".flac")
+# właściciel folderu Drive: jego konto dostaje nagrania z Drive (endpoint i zadanie drive_sync)
+NOTES_OWNER = os.environ.get("NOTES_OWNER", SESSION_ID).lower()
+# scheduler zadań wsadowych w procesie aplikacji (aktywny jest tylko jeden worker, reszta czeka)
+SCHEDULER_IN_APP = os.environ.get("SCHEDULER_IN_APP", "0") == "1"
 
-# create session and perform cleanup when a new session is created
-created = session_manager.create_session(SESSION_ID)
-if created:
-    _cleanup_user_files([
-        NOTES_FOLDER,
-        SUMMARY_FOLDER,
-        os.path.join(BASE_DIR, "drive_notes")
-    ], PROCESSED_PATH)
+app = FastAPI(title="NotePsyche - Audio notes + summaries")
+app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
+scheduler = get_scheduler(artifacts.store)
 
-VOSK_MODEL_PATH = os.environ.get("VOSK_MODEL_PATH", os.path.join(BASE_DIR, "vosk-model-small-pl-0.22"))
-if not os.path.exists(VOSK_MODEL_PATH):
-    raise SystemExit(f"Nie znaleziono modelu Vosk w {VOSK_MODEL_PATH}")
 
-vosk_model = vosk.Model(VOSK_MODEL_PATH)
+@app.on_event("startup")
+def start_scheduler():
+    if SCHEDULER_IN_APP:
+        scheduler.start()
 
-MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise SystemExit("Brak GROQ_API_KEY w środowisku")
 
-client = Groq(api_key=GROQ_API_KEY)
+@app.on_event("shutdown")
+def stop_scheduler():
+    if SCHEDULER_IN_APP:
+        scheduler.stop()
 
-app = FastAPI(title="NotePsyche - Audio notes + summaries")
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 
 # === POMOCNICZE FUNKCJE ===
 def load_checkpoint(session_id: str = SESSION_ID):
     try:
         cp = session_manager.get_checkpoint(session_id)
         if not cp:
-            return {"processed_files": []}
+            return {}
         return cp
     except Exception:
-        return {"processed_files": []}
+        return {}
 
 
 def save_checkpoint(data: dict, session_id: str = SESSION_ID):
+    """Merge `data` into the session checkpoint (appends a patch, no full rewrite)."""
     try:
-        session_manager.save_checkpoint(session_id, data)
+        session_manager.update_checkpoint(session_id, data)
     except Exception:
         # best-effort
         pass
@@ -113,12 +129,13 @@ def sha256_of_bytes(b: bytes):
 
 def load_processed():
     try:
-        with open(PROCESSED_PATH, "r", encoding="utf-8") as f: return json.load(f)
-    except: return {}
+        return get_processed_index().all()
+    except Exception:
+        return {}
 
 
-def save_processed(d):
-    with open(PROCESSED_PATH, "w", encoding="utf-8") as f: json.dump(d, f, ensure_ascii=False, indent=2)
+def record_processed(digest: str, record: dict):
+    get_processed_index().record(digest, record)
 
 
 def convert_to_wav_bytes(data: bytes) -> bytes:
@@ -130,157 +147,200 @@ def convert_to_wav_bytes(data: bytes) -> bytes:
 
 
 def transcribe_wav_bytes(wav_bytes: bytes) -> str:
-    wf = wave.open(io.BytesIO(wav_bytes), "rb")
-    rec = vosk.KaldiRecognizer(vosk_model, wf.getframerate())
-    rec.SetWords(False)
-    text = []
-    while True:
-        data = wf.readframes(4000)
-        if not data: break
-        if rec.AcceptWaveform(data):
-            try: text.append(json.loads(rec.Result()).get("text", ""))
-            except: pass
-    try: text.append(json.loads(rec.FinalResult()).get("text", ""))
-    except: pass
-    wf.close()
-    return " ".join(t for t in text if t).strip()
-
-
-def summarize_text_with_groq(text: str) -> str:
-    prompt = (
-        "Wyobraź sobie, że jesteś psychologiem i analizujesz nagranie osoby, która mówi o swoich myślach i emocjach.\n"
-        "Twoim zadaniem jest:\n"
-        "- W delikatny i empatyczny sposób wskaż najważniejsze tematy i wzorce, które pojawiają się w nagraniu..\n"
-        "- Podziel się refleksją na temat emocji, nastroju i możliwych wyzwań psychologicznych, które mogą wpływać na samopoczucie rozmówcy..\n"
-        "- Zadaj pytania refleksyjne, które pomogą osobie głębiej zrozumieć swoje myśli, uczucia i potrzeby.\n"
-        "- Skoncentruj się na wspieraniu, zrozumieniu i budowaniu poczucia bezpieczeństwa, aby osoba czuła się wysłuchana i doceniona.\n"
-        "- Formułuj wnioski w przyjaznym, ciepłym tonie, tak jakbyś rozmawiał z pacjentem twarzą w twarz, unikaj sztywnej, akademickiej formy..\n\n"
-        f"Nagranie: {text}\n\n"
-        "Proszę, odpowiedz w sposób jasny, ciepły i empatyczny, który zachęca do refleksji i samoświadomości, tak jakbyś prowadził rozmowę, która naprawdę pomaga osobie lepiej zrozumieć siebie.."
-    )
-    resp = client.chat.completions.create(model=MODEL, messages=[{"role":"user","content":prompt}], temperature=0.3, max_tokens=1200)
-    try:
-        choice = resp.choices[0]
-        msg = getattr(choice, "message", None)
-        if isinstance(msg, dict):
-            content = msg.get("content")
-            return content.get("text") if isinstance(content, dict) else str(resp)
-        return getattr(msg, "content", None) or getattr(choice, "text", None) or str(resp)
-    except Exception:
-        return str(resp)
+    return transcriber.transcribe(wav_bytes)
+
 
+def summarize_text_with_groq(text: str, template: Optional[PromptTemplate] = None, model: Optional[str] = None,
+                             deadline: Optional[Deadline] = None) -> str:
+    template = template or get_template("note_summary")
+    return chat_completion(llm_backend, model or MODEL, template.render(text=text), template.temperature,
+                           template.max_tokens, deadline=deadline)
 
-def analyze_single_summary(summary_path: str) -> str:
+
+def analyze_single_summary(summary_path: str, template: Optional[PromptTemplate] = None, model: Optional[str] = None,
+                           deadline: Optional[Deadline] = None) -> str:
     with open(summary_path, "r", encoding="utf-8") as f:
         text = f.read()
+    return analyze_summary_text(text, template, model, deadline)
 
-    prompt = (
-        "Jesteś psychologiem. Przeczytaj poniższe notatki podsumowujące "
-        "rozmowę pacjenta. Przygotuj analizę w formie zrozumiałych punktów, "
-        "zwracając się do pacjenta, tak jakbyś omawiał jego doświadczenia i emocje. "
-        "Udziel wskazówek, refleksji i możliwych pytań do dalszej pracy nad sobą.\n\n"
-        f"{text}\n\n"
-        "Wynik podaj w formie listy punktowanej, przyjaznym tonem."
-    )
 
+def analyze_summary_text(text: str, template: Optional[PromptTemplate] = None, model: Optional[str] = None,
+                         deadline: Optional[Deadline] = None) -> str:
+    template = template or get_template("summary_analysis")
     try:
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.25,
-            max_tokens=800
-        )
-
-        choice = resp.choices[0]
-        msg = getattr(choice, "message", None)
-        if isinstance(msg, dict):
-            content = msg.get("content")
-            analysis_text = content.get("text") if isinstance(content, dict) else str(resp)
-        else:
-            analysis_text = getattr(msg, "content", None) or getattr(choice, "text", None) or str(resp)
-
+        analysis_text = chat_completion(llm_backend, model or MODEL, template.render(text=text), template.temperature,
+                                        template.max_tokens, deadline=deadline)
     except Exception as e:
         analysis_text = f"[Błąd przy generowaniu analizy: {e}]"
 
-    stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    summary_name = os.path.splitext(os.path.basename(summary_path))[0]
-    analysis_name = f"analysis_{stamp}_{summary_name}.txt"
-    analysis_folder = os.path.dirname(summary_path)
-    analysis_path = os.path.join(analysis_folder, analysis_name)
+    return analysis_text
+
 
+def _previous_outputs(digest: str) -> Optional[dict]:
+    """Text artifacts of the last job that processed the same audio bytes, if they still exist."""
     try:
-        with open(analysis_path, "w", encoding="utf-8") as af:
-            af.write(analysis_text)
+        record = get_processed_index().get(digest)
+        if not record or not record.get("job_id") or not record.get("username"):
+            return None
+        outputs = {}
+        for a in artifacts.for_job(record["username"], record["job_id"]):
+            # pusta transkrypcja = nieudane ASR, tego nie powielamy
+            if a["kind"] in ("transcript", "summary", "analysis") and a.get("digest") and a["size"] > 0:
+                outputs[a["kind"]] = a
+        return {"username": record["username"], "job_id": record["job_id"], "outputs": outputs,
+                "prompt_keys": record.get("prompt_keys")}
     except Exception as e:
-        print(f"Błąd zapisu analizy do pliku: {e}")
-
-    return analysis_text
+        print(f"Warning: could not look up previous outputs: {e}")
+        return None
 
 
-def process_uploaded_audio(saved_path: str, orig_name: str, compute_summary: bool = True, session_id: Optional[str] = None):
+def _apply_audio_policy(username: str, saved_path: str, audio_bytes: bytes, job_id: str):
+    """Replace an uncompressed upload with its canonical compressed copy (see audio_policy.py)."""
+    if is_compressed(saved_path):
+        return
+    name, data = canonical_audio(os.path.basename(saved_path), audio_bytes)
+    if data is audio_bytes:
+        return
     try:
-        wav_bytes = convert_to_wav_bytes(open(saved_path, "rb").read())
+        artifacts.write(username, "audio", name, data, job_id)
+        for old in artifacts.for_job(username, job_id):
+            if old["kind"] == "audio" and artifacts.abspath(old) == os.path.abspath(saved_path):
+                artifacts.delete(old)
     except Exception as e:
-        print("Konwersja do WAV nie powiodla sie:", e)
-        return
+        print(f"Warning: audio policy failed for {saved_path}: {e}")
+
+
+def process_uploaded_audio(saved_path: str, orig_name: str, compute_summary: bool = True, session_id: Optional[str] = None,
+                           job_id: Optional[str] = None):
+    deadline = Deadline(JOB_DEADLINE_S)
+    username = session_id or SESSION_ID
+    with open(saved_path, "rb") as f:
+        audio_bytes = f.read()
+    digest = sha256_of_bytes(audio_bytes)
 
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     safe_name = os.path.splitext(orig_name)[0].replace(" ", "_")
-    wav_name = f"{timestamp}_{safe_name}.wav"
-    wav_path = os.path.join(NOTES_FOLDER, wav_name)
-    with open(wav_path, "wb") as wf: wf.write(wav_bytes)
+    job_id = job_id or f"{timestamp}_{safe_name}"
+    transcript_name = f"{safe_name}_{timestamp}.txt"
+    wav_name = None
+
+    # wersja szablonu (A/B per użytkownik) trafia do rejestru processed razem z artefaktami
+    summary_template = get_template("note_summary", bucket=username)
+    analysis_template = get_template("summary_analysis", bucket=username)
+    prompt_keys = {"summary": summary_template.cache_key(digest), "analysis": analysis_template.cache_key(digest)}
+
+    # identyczne nagranie było już przetworzone: współdzielimy bloby zamiast liczyć od nowa;
+    # summary i analizę tylko wtedy, gdy powstały z tych samych wersji promptów
+    previous = _previous_outputs(digest)
+    if (previous and previous["username"] == username.lower() and previous["prompt_keys"] == prompt_keys
+            and {"transcript", "summary", "analysis"} <= set(previous["outputs"])):
+        for artifact in previous["outputs"].values():
+            artifacts.link(artifact, username, job_id)
+        print(f"Nagranie {orig_name} identyczne z zadaniem {previous['job_id']} - użyto gotowych wyników")
+        save_checkpoint({"last_processed_file": digest, "last_processed": datetime.datetime.now().isoformat()},
+                        session_id=username)
+        return
+
+    if previous and "transcript" in previous["outputs"]:
+        transcript = artifacts.link(previous["outputs"]["transcript"], username, job_id)
+        text = artifacts.read_text(transcript)
+    else:
+        try:
+            wav_bytes = convert_to_wav_bytes(audio_bytes)
+        except Exception as e:
+            print("Konwersja do WAV nie powiodla sie:", e)
+            return
+        # WAV 16 kHz jest tylko wejściem dla ASR - domyślnie nie trafia na dysk
+        if AUDIO_KEEP_WAV:
+            wav_name = f"{timestamp}_{safe_name}.wav"
+            artifacts.write(username, "wav", wav_name, wav_bytes, job_id)
+
+        try:
+            text = transcribe_wav_bytes(wav_bytes)
+        except Exception as e:
+            print(f"Błąd transkrypcji: {e}")
+            text = ""
 
+        artifacts.write(username, "transcript", transcript_name, text, job_id)
+    _apply_audio_policy(username, saved_path, audio_bytes, job_id)
+
+    # surowa transkrypcja zostaje na dysku, do promptu idzie wersja skompaktowana
+    prompt_text = text
+    compaction = None
+    if COMPACTION_ENABLED and text:
+        try:
+            prompt_text, compaction = compact_transcript(text)
+            print(f"Kompakcja transkrypcji {transcript_name}: {compaction['original_tokens']} -> "
+                  f"{compaction['compact_tokens']} tokenów (oszczędność {compaction['saved_tokens']})")
+        except Exception as e:
+            print(f"Warning: transcript compaction failed: {e}")
+            prompt_text = text
+
+    # lokalny triage: trywialne nagrania nie idą do LLM, słabe do małego modelu
     try:
-        text = transcribe_wav_bytes(wav_bytes)
+        route = triage(prompt_text)
     except Exception as e:
-        print(f"Błąd transkrypcji: {e}")
-        text = ""
+        print(f"Warning: triage failed, using default model: {e}")
+        route = {"tier": "large", "model": MODEL}
+    print(f"Triage {transcript_name}: {route['tier']} ({route.get('model') or 'szablon'})")
 
-    transcript_name = f"{safe_name}_{timestamp}.txt"
-    transcript_path = os.path.join(NOTES_FOLDER, transcript_name)
-    with open(transcript_path, "w", encoding="utf-8") as tf: tf.write(text)
-
-    processed = load_processed()
     try:
-        processed[sha256_of_bytes(open(saved_path, "rb").read())] = {
+        record_processed(digest, {
             "orig": orig_name,
             "wav": wav_name,
             "transcript": transcript_name,
-            "processed_at": datetime.datetime.now().isoformat()
-        }
-        save_processed(processed)
+            "processed_at": datetime.datetime.now().isoformat(),
+            "username": username.lower(),
+            "job_id": job_id,
+            "compaction": compaction,
+            "prompts": {"summary": summary_template.key, "analysis": analysis_template.key},
+            "prompt_keys": prompt_keys,
+            "triage": route
+        })
         try:
-            # update session checkpoint with list of processed file hashes
+            # checkpoint sesji: tylko ostatni plik, pełna lista jest w ledgerze processed
             # save under provided session id if available (default handled by save_checkpoint)
             save_checkpoint({
-                "processed_files": list(processed.keys()),
+                "last_processed_file": digest,
                 "last_processed": datetime.datetime.now().isoformat()
-            }, session_id=session_id or SESSION_ID)
+            }, session_id=username)
         except Exception:
             pass
     except Exception as e:
         print(f"Błąd zapisu processed: {e}")
 
-    summary_file = None
+    summary = None
     if compute_summary:
         try:
-            summary_text = summarize_text_with_groq(text if text else "[brak transkrypcji]")
+            if route["tier"] == "template":
+                summary_text = TEMPLATE_RESPONSE
+            else:
+                summary_text = summarize_text_with_groq(prompt_text if prompt_text else "[brak transkrypcji]", summary_template,
+                                                        route["model"], deadline)
         except Exception as e:
             summary_text = f"[Błąd przy generowaniu summary: {e}]"
-        summary_file = os.path.join(SUMMARY_FOLDER, f"summary_{timestamp}_{safe_name}.txt")
         try:
-            with open(summary_file, "w", encoding="utf-8") as sf: sf.write(summary_text)
+            summary = artifacts.write(username, "summary", f"summary_{timestamp}_{safe_name}.txt", summary_text, job_id)
         except Exception as e:
             print(f"Błąd zapisu summary: {e}")
 
-    if summary_file:
+    if summary:
         try:
-            analysis_text = analyze_single_summary(summary_file)
-            analysis_path = os.path.join(SUMMARY_FOLDER, f"analysis_{timestamp}_{safe_name}.txt")
-            with open(analysis_path, "w", encoding="utf-8") as af: af.write(analysis_text)
+            if route["tier"] == "template":
+                analysis_text = TEMPLATE_RESPONSE
+            else:
+                analysis_text = analyze_summary_text(artifacts.read_text(summary), analysis_template, route["model"],
+                                                     deadline)
+            artifacts.write(username, "analysis", f"analysis_{timestamp}_{safe_name}.txt", analysis_text, job_id)
         except Exception as e:
             print(f"[Błąd przy generowaniu analizy: {e}]")
 
+    # limit miejsca użytkownika pilnujemy od razu; wiek i limit globalny - `python retention.py run`
+    try:
+        get_retention_manager(artifacts).enforce_user_quota(username)
+    except Exception as e:
+        print(f"Warning: retention check failed: {e}")
+
 
 # === ENDPOINTY ===
 @app.get("/", response_class=HTMLResponse)
@@ -297,67 +357,130 @@ async def register(form: OAuth2PasswordRequestForm = Depends()):
     password = form.password
     if not username or not password:
         raise HTTPException(status_code=400, detail="Username and password required")
-    created = register_user(username, password)
+    try:
+        created = await register_user_async(username, password)
+    except HashingBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
     if not created:
         raise HTTPException(status_code=400, detail="User already exists")
 
-    # create session for the new user and clean previous files
+    # create session for the new user (files are per-user, nothing to clean up)
     try:
-        was_new = session_manager.create_session(username)
-        if was_new:
-            _cleanup_user_files([
-                NOTES_FOLDER,
-                SUMMARY_FOLDER,
-                os.path.join(BASE_DIR, "drive_notes")
-            ], PROCESSED_PATH)
+        session_manager.create_session(username)
     except Exception:
         pass
 
-    access_token = create_access_token({"sub": username})
-    return {"access_token": access_token, "token_type": "bearer"}
+    return issue_tokens(username)
 
 
 @app.post("/login")
 async def login(form: OAuth2PasswordRequestForm = Depends()):
     username = form.username
     password = form.password
-    user = authenticate_user(username, password)
+    try:
+        user = await authenticate_user_async(username, password)
+    except HashingBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    # ensure session exists and cleanup if this is the first time
+    # ensure session exists
     try:
-        was_new = session_manager.create_session(username)
-        if was_new:
-            _cleanup_user_files([
-                NOTES_FOLDER,
-                SUMMARY_FOLDER,
-                os.path.join(BASE_DIR, "drive_notes")
-            ], PROCESSED_PATH)
+        session_manager.create_session(username)
     except Exception:
         pass
 
-    access_token = create_access_token({"sub": username})
-    return {"access_token": access_token, "token_type": "bearer"}
+    return issue_tokens(username)
+
+
+@app.post("/token/refresh")
+async def token_refresh(refresh_token: str = Body(..., embed=True)):
+    """Exchange a refresh token for a new access token and a rotated refresh token.
+
+    409 = the token was rotated moments ago by a parallel request (another tab);
+    the client keeps its session and uses the token stored by that request.
+    """
+    try:
+        rotated = rotate_refresh_token(refresh_token)
+    except RefreshTokenRotated as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not rotated:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+    return issue_tokens(rotated["username"], rotated["refresh_token"])
+
+
+@app.post("/logout")
+async def logout(refresh_token: str = Body(..., embed=True)):
+    revoke_refresh_token(refresh_token)
+    return {"status": "ok"}
 
 
 @app.post("/upload_audio")
 async def upload_audio(background_tasks: BackgroundTasks, file: UploadFile = File(...), summary: Optional[bool] = True, current_user: dict = Depends(get_current_user)):
     data = await file.read()
     if not data: raise HTTPException(status_code=400, detail="Brak danych audio")
-    saved_path = os.path.join(NOTES_FOLDER, f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-    with open(saved_path, "wb") as f: f.write(data)
-    # pass session id (username) so checkpointing is per-user
-    username = current_user.get("username") if isinstance(current_user, dict) else None
-    background_tasks.add_task(process_uploaded_audio, saved_path, file.filename, summary, username)
-    return {"status": "ok", "saved": file.filename}
+    # pass session id (username) so checkpointing and artifacts are per-user
+    username = current_user["username"]
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    # sufiks losowy: dwa uploady tego samego pliku w tej samej sekundzie to dwa różne zadania
+    job_id = f"{stamp}_{os.path.splitext(file.filename)[0].replace(' ', '_')}_{uuid.uuid4().hex[:8]}"
+    saved = artifacts.write(username, "audio", f"{stamp}_{file.filename}", data, job_id)
+    background_tasks.add_task(process_uploaded_audio, artifacts.abspath(saved), file.filename, summary, username, job_id)
+    return {"status": "ok", "saved": file.filename, "job_id": job_id}
+
+
+def sync_drive_for_user(username: str, compute_summary: bool = True) -> dict:
+    """Incremental Drive sync, then every downloaded recording the user has not processed goes through the pipeline.
+
+    Files count as processed per user (drive_processed), so files downloaded by
+    an earlier run - or by a plain `gdrive_fetch.py` - are not lost.
+    """
+    source = LocalDirSource(GDRIVE_LOCAL_SOURCE) if GDRIVE_LOCAL_SOURCE else PyDriveSource()
+    drive = DriveSync(source, store=artifacts.store)
+    report = drive.sync()
+    report["processed"] = 0
+    for row in drive.pending_for(username):
+        name = os.path.basename(row["path"])
+        if name.lower().endswith(DRIVE_AUDIO_EXTS):
+            try:
+                with open(row["path"], "rb") as f:
+                    data = f.read()
+                stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+                job_id = f"{stamp}_drive_{os.path.splitext(name)[0].replace(' ', '_')}_{uuid.uuid4().hex[:8]}"
+                saved = artifacts.write(username, "audio", f"{stamp}_{name}", data, job_id)
+                process_uploaded_audio(artifacts.abspath(saved), name, compute_summary, username, job_id)
+            except Exception as e:
+                # bez wpisu w drive_processed - następna synchronizacja spróbuje ponownie
+                print(f"Błąd przetwarzania {name} z Drive: {e}")
+                report["failed"] += 1
+                continue
+            report["processed"] += 1
+        # pliki inne niż audio też oznaczamy, żeby nie wracały przy każdym przebiegu
+        drive.mark_processed(username, row)
+    print(f"Drive sync ({username}): {report['downloaded']} pobranych, {report['processed']} przetworzonych, "
+          f"{report['failed']} błędów")
+    return report
+
+
+@app.post("/drive/sync")
+async def drive_sync(background_tasks: BackgroundTasks, summary: Optional[bool] = True,
+                     current_user: dict = Depends(get_current_user)):
+    """Fetch new/changed files from the Drive folder in the background and process them for NOTES_OWNER.
+
+    Only the owner (or an account in ADMIN_USERS) may trigger it - the folder's
+    recordings always land in the owner's account.
+    """
+    username = current_user["username"].lower()
+    if username != NOTES_OWNER and username not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Folder Drive należy do innego konta")
+    background_tasks.add_task(sync_drive_for_user, NOTES_OWNER, summary)
+    return {"status": "scheduled", "owner": NOTES_OWNER}
 
 
 @app.get("/list_analyses", response_class=HTMLResponse)
-async def list_analyses():
-    files = sorted([f for f in os.listdir(SUMMARY_FOLDER) if f.startswith("analysis_") and f.endswith(".txt")],
-                   key=lambda f: os.path.getmtime(os.path.join(SUMMARY_FOLDER, f)))
-    html_files = "".join(f"<li class='file'>{f}</li>" for f in files)
+async def list_analyses(current_user: dict = Depends(get_current_user)):
+    rows = artifacts.list(current_user["username"], "analysis", limit=500)
+    html_files = "".join(f"<li class='file'>{a['name']}</li>" for a in reversed(rows))
     return f"""
     <html><body>
     <h2>Lista analiz</h2>
@@ -367,31 +490,17 @@ async def list_analyses():
     """
 
 @app.get("/list_analyses_content")
-async def list_analyses_content():
-    files = sorted(
-        [f for f in os.listdir(SUMMARY_FOLDER) if f.startswith("analysis_") and f.endswith(".txt")],
-        key=lambda f: os.path.getmtime(os.path.join(SUMMARY_FOLDER, f))
-    )
-    if not files:
+async def list_analyses_content(current_user: dict = Depends(get_current_user)):
+    latest = artifacts.latest(current_user["username"], "analysis")
+    if not latest:
         return {"latest_analysis": "Brak analiz"}
-    latest_file = files[-1]
-    with open(os.path.join(SUMMARY_FOLDER, latest_file), "r", encoding="utf-8") as f:
-        latest_analysis = f.read()
-    return {"latest_analysis": latest_analysis}
+    return {"latest_analysis": artifacts.read_text(latest)}
 
 
 @app.get("/last_analysis", response_class=HTMLResponse)
-async def last_analysis():
-    files = sorted(
-        [f for f in os.listdir(SUMMARY_FOLDER) if f.startswith("analysis_") and f.endswith(".txt")],
-        key=lambda f: os.path.getmtime(os.path.join(SUMMARY_FOLDER, f))
-    )
-    if not files:
-        content = "Brak analiz"
-    else:
-        latest_file = files[-1]
-        with open(os.path.join(SUMMARY_FOLDER, latest_file), "r", encoding="utf-8") as f:
-            content = f.read()
+async def last_analysis(current_user: dict = Depends(get_current_user)):
+    latest = artifacts.latest(current_user["username"], "analysis")
+    content = artifacts.read_text(latest) if latest else "Brak analiz"
 
     # Simple HTML page with a back button
     safe_html = content.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
@@ -404,21 +513,202 @@ async def last_analysis():
     """
 
 
+ANALYSIS_KINDS = ("summary", "analysis")
+
+
+def _encode_cursor(artifact: dict) -> str:
+    # pozycja w porządku list(): (created_at, id)
+    return base64.urlsafe_b64encode(f"{artifact['created_at']}|{artifact['id']}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, artifact_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().rsplit("|", 1)
+        return created_at, int(artifact_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _artifact_json(a: dict, include_content: bool = False) -> dict:
+    item = {k: a[k] for k in ("id", "kind", "name", "job_id", "size", "created_at")}
+    if include_content:
+        try:
+            item["content"] = artifacts.read_text(a)
+        except Exception as e:
+            item["content"] = None
+            print(f"Warning: could not read {a['path']}: {e}")
+    return item
+
+
+@app.get("/api/analyses")
+async def api_analyses(
+    kind: Optional[str] = Query(None, description="summary | analysis (domyślnie oba)"),
+    since: Optional[str] = Query(None, description="ISO data/czas, włącznie"),
+    until: Optional[str] = Query(None, description="ISO data/czas, wyłącznie"),
+    limit: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = None,
+    include_content: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
+    """Summaries/analyses of the current user, newest first, with cursor pagination."""
+    if kind and kind not in ANALYSIS_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(ANALYSIS_KINDS)}")
+    # o jeden więcej niż limit: wiemy, czy jest następna strona, bez COUNT(*)
+    rows = artifacts.list(current_user["username"], kind or ANALYSIS_KINDS, limit=limit + 1,
+                          before=_decode_cursor(cursor) if cursor else None, since=since, until=until)
+    page = rows[:limit]
+    return {
+        "items": [_artifact_json(a, include_content) for a in page],
+        "next_cursor": _encode_cursor(page[-1]) if len(rows) > limit else None,
+    }
+
+
+@app.get("/api/analyses/latest")
+async def api_latest_analysis(kind: str = Query("analysis"), include_content: bool = True,
+                              current_user: dict = Depends(get_current_user)):
+    if kind not in ANALYSIS_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(ANALYSIS_KINDS)}")
+    latest = artifacts.latest(current_user["username"], kind)
+    if not latest:
+        raise HTTPException(status_code=404, detail="Brak analiz")
+    return _artifact_json(latest, include_content)
+
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1),
+    kind: Optional[str] = Query(None, description="transcript | summary | analysis"),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(get_current_user),
+):
+    """BM25 full-text search over the current user's notes with highlighted snippets."""
+    username = current_user["username"]
+    hits = search_index.search(username, q, limit=limit, kinds=[kind] if kind else None)
+    found = artifacts.get_many(username, [doc_id for doc_id, _ in hits])
+    terms = set(search_terms(q))
+    items = []
+    for doc_id, score in hits:
+        a = found.get(doc_id)
+        if not a:
+            continue
+        item = _artifact_json(a)
+        item["score"] = round(score, 4)
+        try:
+            item["snippet"] = make_snippet(artifacts.read_text(a), terms)
+        except Exception:
+            item["snippet"] = ""
+        items.append(item)
+    return {"query": q, "items": items}
+
+
+@app.get("/notes/{artifact_id}/related")
+async def related_notes(artifact_id: int, k: int = Query(5, ge=1, le=50),
+                        current_user: dict = Depends(get_current_user)):
+    """Earlier notes of the current user most similar to the given transcript/summary."""
+    if related_index is None:
+        raise HTTPException(status_code=503, detail="Indeks podobieństwa niedostępny (brak numpy)")
+    username = current_user["username"]
+    source = artifacts.get_many(username, [artifact_id]).get(artifact_id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Nie znaleziono notatki")
+    vec = related_index.vector_for(username, artifact_id)
+    if vec is None:
+        vec = embed(artifacts.read_text(source))
+    # z zapasem: odrzucamy artefakty z tego samego zadania i duplikaty (transkrypcja + summary jednej notatki)
+    candidates = related_index.nearest(username, vec, k * 4, exclude=(artifact_id,))
+    found = artifacts.get_many(username, [doc_id for doc_id, _ in candidates])
+    items, seen_jobs = [], {source.get("job_id")}
+    for doc_id, similarity in candidates:
+        a = found.get(doc_id)
+        if not a or (a.get("job_id") and a["job_id"] in seen_jobs):
+            continue
+        seen_jobs.add(a.get("job_id"))
+        item = _artifact_json(a)
+        item["similarity"] = round(similarity, 4)
+        items.append(item)
+        if len(items) >= k:
+            break
+    return {"note": _artifact_json(source), "related": items}
+
+
 @app.get("/check_summary")
-async def check_summary():
-    """Check if a recent summary file exists (created in last 60 seconds)."""
+async def check_summary(current_user: dict = Depends(get_current_user)):
+    """Check if a recent summary of the current user exists (created in last 60 seconds)."""
     try:
-        files = [f for f in os.listdir(SUMMARY_FOLDER) if f.startswith("summary_") and f.endswith(".txt")]
-        if not files:
+        latest = artifacts.latest(current_user["username"], "summary")
+        if not latest:
             return {"has_summary": False}
-        
-        # Get the most recently modified summary file
-        latest_file = max(files, key=lambda f: os.path.getmtime(os.path.join(SUMMARY_FOLDER, f)))
-        latest_time = os.path.getmtime(os.path.join(SUMMARY_FOLDER, latest_file))
-        current_time = datetime.datetime.now().timestamp()
-        
+
         # Consider a summary "recent" if created within the last 60 seconds
-        is_recent = (current_time - latest_time) < 60
-        return {"has_summary": is_recent, "file": latest_file}
+        age = datetime.datetime.now() - datetime.datetime.fromisoformat(latest["created_at"])
+        return {"has_summary": age.total_seconds() < 60, "file": latest["name"]}
     except Exception:
         return {"has_summary": False}
+
+
+@app.get("/triage/stats")
+async def triage_stats():
+    """Per-tier traffic handled by this worker process since startup."""
+    return tier_stats()
+
+
+@app.get("/llm/status")
+async def get_llm_status():
+    """Circuit breaker state and trip counts for this worker process."""
+    status = llm_status()
+    status["backends"] = {"asr": transcriber.name, "llm": llm_backend.name}
+    return status
+
+
+@app.get("/scheduler/status")
+async def scheduler_status(current_user: dict = Depends(require_admin)):
+    """Batch jobs: schedule, next run, last result; `leader` tells whether this worker runs them."""
+    return scheduler.status()
+
+
+@app.get("/scheduler/history")
+async def scheduler_history(job: Optional[str] = None, limit: int = Query(20, ge=1, le=200),
+                            current_user: dict = Depends(require_admin)):
+    return scheduler.history(job, limit)
+
+
+@app.post("/scheduler/jobs/{name}/{action}")
+async def scheduler_control(name: str, action: str, current_user: dict = Depends(require_admin)):
+    """`run` = start as soon as the active scheduler allows, `skip` = drop the next scheduled run."""
+    if action not in ("run", "skip"):
+        raise HTTPException(status_code=404, detail="Nieznana akcja")
+    try:
+        if action == "run":
+            scheduler.request_run(name)
+        else:
+            scheduler.skip_next(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "ok", "job": name, "action": action}
+
+
+@app.get("/auth/cache_stats")
+async def auth_cache_stats():
+    """Hit rate and size of this worker's authenticated-user cache."""
+    return user_cache_stats()
+
+
+@app.get("/auth/hashing_stats")
+async def auth_hashing_stats():
+    """Argon2 pool size, queue depth and wait/run times for this worker process."""
+    return hashing_stats()
+
+
+def main():
+    p = argparse.ArgumentParser(description="NotePsyche batch commands (the web app: uvicorn main:app)")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    d = sub.add_parser("drive-sync", help="pobierz nowe pliki z Drive i przetwórz nagrania właściciela")
+    d.add_argument("--user", default=NOTES_OWNER, help="konto docelowe (domyślnie NOTES_OWNER)")
+    d.add_argument("--no-summary", action="store_true", help="tylko transkrypcja, bez summary i analizy")
+    args = p.parse_args()
+    report = sync_drive_for_user(args.user.lower(), compute_summary=not args.no_summary)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Import the legacy JSON files into the store (SQLite or DATABASE_URL Postgres).
+
+Usage:
+  python migrate_json.py [--users users.json] [--processed processed.json]
+                         [--sessions checkpoints/sessions_metadata.json] [--dry-run]
+
+Safe to run repeatedly: existing rows are never overwritten.
+"""
+import os
+import json
+import argparse
+
+from dotenv import load_dotenv
+
+from storage import get_store
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _read_json(path):
+    if not path or not os.path.exists(path):
+        print(f"Pomijam {path} (brak pliku)")
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception as e:
+        print(f"Warning: could not read {path}: {e}")
+        return {}
+
+
+def migrate_users(store, path, dry_run=False):
+    users = _read_json(path)
+    imported = skipped = 0
+    seen = set()
+    for username, rec in users.items():
+        name = username.lower()
+        hashed = (rec or {}).get("hashed_password")
+        # get_user zawsze szukał po lower(), więc wpisy różniące się wielkością liter kolidują
+        if not hashed or name in seen:
+            print(f"Pomijam użytkownika {username!r} (brak hasła lub duplikat po lower())")
+            skipped += 1
+            continue
+        seen.add(name)
+        if dry_run or store.create_user(name, hashed):
+            imported += 1
+        else:
+            skipped += 1
+    return imported, skipped
+
+
+def migrate_processed(store, path, dry_run=False):
+    processed = _read_json(path)
+    imported = skipped = 0
+    for digest, rec in processed.items():
+        if store.get_processed(digest):
+            skipped += 1
+            continue
+        if not dry_run:
+            store.put_processed(digest, rec or {})
+        imported += 1
+    return imported, skipped
+
+
+def migrate_sessions(store, path, dry_run=False):
+    sessions = _read_json(path)
+    imported = skipped = 0
+    with store.transaction(write=True) as cur:
+        for session_id, rec in sessions.items():
+            rec = rec or {}
+            created = rec.get("created") or rec.get("last_updated")
+            if not created:
+                skipped += 1
+                continue
+            if dry_run:
+                imported += 1
+                continue
+            cur.execute(
+                "INSERT INTO sessions (session_id, created, last_updated, info) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (session_id) DO NOTHING",
+                (session_id, created, rec.get("last_updated") or created,
+                 json.dumps(rec.get("info") or {}, ensure_ascii=False)),
+            )
+            if cur.rowcount == 1:
+                imported += 1
+            else:
+                skipped += 1
+    return imported, skipped
+
+
+def main():
+    p = argparse.ArgumentParser(description="Import JSON state files into the database store")
+    p.add_argument("--users", default=os.path.join(BASE_DIR, "users.json"))
+    p.add_argument("--processed", default=os.path.join(BASE_DIR, "processed.json"))
+    p.add_argument("--sessions", default=os.path.join(BASE_DIR, "checkpoints", "sessions_metadata.json"))
+    p.add_argument("--dry-run", action="store_true")
+    args = p.parse_args()
+
+    load_dotenv()
+    store = get_store()
+    print(f"Store: {store.kind} ({'DATABASE_URL' if store.kind == 'postgres' else store.url})")
+
+    for label, fn, path in (
+        ("users", migrate_users, args.users),
+        ("processed", migrate_processed, args.processed),
+        ("sessions", migrate_sessions, args.sessions),
+    ):
+        imported, skipped = fn(store, path, args.dry_run)
+        print(f"{label}: zaimportowano {imported}, pominięto {skipped}")
+
+    print("✅ Migracja zakończona." + (" (dry-run)" if args.dry_run else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Argon2 hashing on a dedicated, memory-budgeted thread pool.
+
+Argon2id with m=64 MiB blocks the caller for hundreds of milliseconds and
+allocates its memory cost per concurrent hash. Running it directly in `async`
+endpoints stalls the uvicorn event loop; running it unbounded in the default
+thread pool lets a login storm allocate gigabytes. Here the pool size is
+derived from HASH_MEMORY_BUDGET_MB / ARGON2_MEMORY_KIB, excess requests wait in
+a bounded queue and beyond that are rejected with HashingBusy.
+
+argon2-cffi releases the GIL while hashing, so plain threads give real
+parallelism.
+"""
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+# === KONFIGURACJA ===
+ARGON2_MEMORY_KIB = int(os.environ.get("ARGON2_MEMORY_KIB", "65536"))
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "3"))
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", "4"))
+# pamięć dostępna na hashowanie w jednym workerze uvicorna
+HASH_MEMORY_BUDGET_MB = int(os.environ.get("HASH_MEMORY_BUDGET_MB", "512"))
+# ile żądań może czekać w kolejce, zanim zaczniemy odrzucać (503)
+HASH_MAX_QUEUE = int(os.environ.get("HASH_MAX_QUEUE", "64"))
+
+HASH_CONCURRENCY = max(1, (HASH_MEMORY_BUDGET_MB * 1024) // ARGON2_MEMORY_KIB)
+
+# deprecated="auto" + aktualne parametry: needs_update() wykrywa hashe ze starymi parametrami
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__memory_cost=ARGON2_MEMORY_KIB,
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+
+class HashingBusy(RuntimeError):
+    """The hashing queue is full; the caller should retry later."""
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.max_queued = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "concurrency": HASH_CONCURRENCY,
+                "memory_budget_mb": HASH_MEMORY_BUDGET_MB,
+                "params": {"m_kib": ARGON2_MEMORY_KIB, "t": ARGON2_TIME_COST, "p": ARGON2_PARALLELISM},
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_wait_ms": round(1000 * self.wait_total / done, 1),
+                "avg_run_ms": round(1000 * self.run_total / done, 1),
+            }
+
+
+metrics = _Metrics()
+_executor = ThreadPoolExecutor(max_workers=HASH_CONCURRENCY, thread_name_prefix="argon2")
+
+
+def _timed(fn, job, *args):
+    started = time.monotonic()
+    with metrics._lock:
+        if job["state"] == "abandoned":
+            # żądanie anulowane, zanim zadanie ruszyło - kolejka już rozliczona, nie ma dla kogo liczyć
+            return None
+        job["state"] = "started"
+        metrics.queued -= 1
+        metrics.in_flight += 1
+        metrics.wait_total += started - job["submitted_at"]
+    try:
+        return fn(*args)
+    finally:
+        with metrics._lock:
+            metrics.in_flight -= 1
+            metrics.completed += 1
+            metrics.run_total += time.monotonic() - started
+
+
+async def _run(fn, *args):
+    with metrics._lock:
+        if metrics.queued >= HASH_MAX_QUEUE:
+            metrics.rejected += 1
+            raise HashingBusy("Za dużo równoczesnych logowań - spróbuj ponownie za chwilę")
+        metrics.queued += 1
+        metrics.max_queued = max(metrics.max_queued, metrics.queued)
+    job = {"state": "queued", "submitted_at": time.monotonic()}
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor, _timed, fn, job, *args)
+    finally:
+        # anulowanie (rozłączony klient, timeout) przed startem zadania: _timed nie zdejmie go z kolejki
+        with metrics._lock:
+            if job["state"] == "queued":
+                job["state"] = "abandoned"
+                metrics.queued -= 1
+
+
+# === API SYNCHRONICZNE (skrypty, migracje) ===
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """Verify `password`; when the stored hash uses outdated parameters also return a fresh hash."""
+    try:
+        return pwd_context.verify_and_update(password, hashed)
+    except Exception:
+        return False, None
+
+
+# === API ASYNC (endpointy) ===
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+
+async def verify_and_update_async(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    ok, new_hash = await _run(verify_and_update, password, hashed)
+    if ok and new_hash:
+        with metrics._lock:
+            metrics.rehashed += 1
+    return ok, new_hash
+
+
+def hashing_stats() -> Dict:
+    return metrics.snapshot()
+
+
+__all__ = [
+    "HASH_CONCURRENCY",
+    "HashingBusy",
+    "hash_password",
+    "hash_password_async",
+    "hashing_stats",
+    "pwd_context",
+    "verify_and_update",
+    "verify_and_update_async",
+]
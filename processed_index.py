@@ -0,0 +1,107 @@
+"""In-memory digest index over the append-only processed ledger.
+
+Each upload appends one row to `processed_ledger` (see storage.py) instead of
+rewriting the whole registry. Every worker keeps a dict digest -> record built
+once at startup and then tailed: before a lookup it reads only ledger rows with
+seq greater than the last one it has seen (at most every
+PROCESSED_INDEX_REFRESH_S seconds), so lookups are O(1) and an upload costs one
+INSERT. A 'clear' entry written by `Store.clear_processed` resets the index.
+"""
+import os
+import time
+import datetime
+import threading
+from typing import Any, Dict, Optional
+
+from storage import Store, get_store
+
+# === KONFIGURACJA ===
+# jak często (najwyżej) doczytywać nowe wpisy ledgera z innych workerów; 0 = przy każdym odczycie
+PROCESSED_INDEX_REFRESH_S = float(os.environ.get("PROCESSED_INDEX_REFRESH_S", "1.0"))
+# ile wpisów ledgera czytać jednym zapytaniem przy odbudowie indeksu
+PROCESSED_INDEX_BATCH = int(os.environ.get("PROCESSED_INDEX_BATCH", "5000"))
+
+
+class ProcessedIndex:
+    def __init__(self, store: Optional[Store] = None, refresh_s: float = PROCESSED_INDEX_REFRESH_S):
+        self.store = store or get_store()
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._last_seq = 0
+        self._last_refresh = 0.0
+        self.applied = 0
+        self.refresh(force=True)
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        if entry["seq"] <= self._last_seq:
+            return
+        self._last_seq = entry["seq"]
+        self.applied += 1
+        if entry["op"] == "clear":
+            self._records.clear()
+        elif entry["record"] is not None:
+            self._records[entry["digest"]] = entry["record"]
+
+    def refresh(self, force: bool = False) -> int:
+        """Read ledger entries appended since the last refresh; returns how many were applied."""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_s:
+            return 0
+        applied = 0
+        with self._lock:
+            while True:
+                batch = self.store.processed_since(self._last_seq, limit=PROCESSED_INDEX_BATCH)
+                for entry in batch:
+                    self._apply(entry)
+                applied += len(batch)
+                if len(batch) < PROCESSED_INDEX_BATCH:
+                    break
+            self._last_refresh = now
+        return applied
+
+    def record(self, digest: str, record: Dict[str, Any]) -> None:
+        """Append to the ledger and update the local index without waiting for the next refresh."""
+        record = dict(record)
+        record.setdefault("processed_at", datetime.datetime.now().isoformat())
+        seq = self.store.put_processed(digest, record)
+        with self._lock:
+            # wcześniejsze wpisy innych workerów doczytamy przy następnym refresh(); tu tylko nasz
+            self._records[digest] = record
+            if seq == self._last_seq + 1:
+                self._last_seq = seq
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        return self._records.get(digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return self.get(digest) is not None
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._records)
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        self.refresh()
+        with self._lock:
+            return dict(self._records)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._records), "last_seq": self._last_seq, "applied": self.applied}
+
+
+_index: Optional[ProcessedIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_processed_index() -> ProcessedIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ProcessedIndex()
+    return _index
+
+
+__all__ = ["ProcessedIndex", "get_processed_index", "PROCESSED_INDEX_REFRESH_S"]
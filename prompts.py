@@ -0,0 +1,182 @@
+import os
+import hashlib
+import zlib
+from typing import Any, Dict, List, Optional
+
+from tokens import count_tokens
+
+
+class PromptTemplate:
+    """Versioned prompt: a fixed system prefix plus a variable user suffix.
+
+    All instructions live in the system message so the prefix is byte-identical
+    between requests (provider-side prefix caching, shared cache keys); only the
+    user message carries the transcript/notes.
+    """
+
+    def __init__(self, template_id: str, version: str, system: str, suffix: str,
+                 temperature: float = 0.3, max_tokens: int = 800):
+        self.template_id = template_id
+        self.version = version
+        self.system = system
+        self.suffix = suffix
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        # stała część liczona raz przy rejestracji
+        self.fixed_tokens = count_tokens(system) + count_tokens(suffix.format_map(_Blank()))
+        self.prefix_hash = hashlib.sha256(system.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def key(self) -> str:
+        return f"{self.template_id}@{self.version}"
+
+    def render(self, **variables: Any) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.suffix.format(**variables)},
+        ]
+
+    def estimate_tokens(self, **variables: Any) -> int:
+        """Prompt tokens for a request: precomputed fixed part + the variables."""
+        return self.fixed_tokens + sum(count_tokens(str(v)) for v in variables.values())
+
+    def cache_key(self, *parts: str) -> str:
+        """Cache key that changes whenever the template version or the inputs change."""
+        h = hashlib.sha256(self.key.encode("utf-8"))
+        for p in parts:
+            h.update(b"\x00")
+            h.update((p or "").encode("utf-8"))
+        return h.hexdigest()
+
+
+class _Blank(dict):
+    def __missing__(self, key):
+        return ""
+
+
+_REGISTRY: Dict[str, Dict[str, PromptTemplate]] = {}
+_DEFAULT_VERSION: Dict[str, str] = {}
+
+
+def register(template: PromptTemplate, default: bool = False) -> PromptTemplate:
+    versions = _REGISTRY.setdefault(template.template_id, {})
+    versions[template.version] = template
+    if default or template.template_id not in _DEFAULT_VERSION:
+        _DEFAULT_VERSION[template.template_id] = template.version
+    return template
+
+
+def _env_name(template_id: str, kind: str) -> str:
+    return f"PROMPT_{kind}_{template_id.upper()}"
+
+
+def _ab_version(template_id: str, bucket: str) -> Optional[str]:
+    """Pick a version from PROMPT_AB_<ID>="v1:80,v2:20" deterministically by bucket."""
+    spec = os.environ.get(_env_name(template_id, "AB"))
+    if not spec or not bucket:
+        return None
+    weights = []
+    for part in spec.split(","):
+        try:
+            version, weight = part.split(":")
+            weights.append((version.strip(), int(weight)))
+        except ValueError:
+            continue
+    total = sum(w for _, w in weights)
+    if total <= 0:
+        return None
+    point = zlib.crc32(f"{template_id}:{bucket}".encode("utf-8")) % total
+    for version, weight in weights:
+        if point < weight:
+            return version
+        point -= weight
+    return None
+
+
+def get_template(template_id: str, version: Optional[str] = None, bucket: Optional[str] = None) -> PromptTemplate:
+    """Resolve a template: explicit version > PROMPT_VERSION_<ID> > A/B bucket > default.
+
+    Unknown versions fall back to the default one instead of failing the request.
+    """
+    versions = _REGISTRY.get(template_id)
+    if not versions:
+        raise KeyError(f"Unknown prompt template: {template_id}")
+    for candidate in (version, os.environ.get(_env_name(template_id, "VERSION")), _ab_version(template_id, bucket)):
+        if candidate and candidate in versions:
+            return versions[candidate]
+    return versions[_DEFAULT_VERSION[template_id]]
+
+
+def list_templates() -> List[Dict[str, Any]]:
+    return [
+        {"id": t.template_id, "version": t.version, "fixed_tokens": t.fixed_tokens,
+         "prefix_hash": t.prefix_hash, "default": _DEFAULT_VERSION.get(t.template_id) == t.version}
+        for versions in _REGISTRY.values() for t in versions.values()
+    ]
+
+
+# === SZABLONY ===
+register(PromptTemplate(
+    "note_summary", "v1",
+    system=(
+        "Wyobraź sobie, że jesteś psychologiem i analizujesz nagranie osoby, która mówi o swoich myślach i emocjach.\n"
+        "Twoim zadaniem jest:\n"
+        "- W delikatny i empatyczny sposób wskaż najważniejsze tematy i wzorce, które pojawiają się w nagraniu..\n"
+        "- Podziel się refleksją na temat emocji, nastroju i możliwych wyzwań psychologicznych, które mogą wpływać na samopoczucie rozmówcy..\n"
+        "- Zadaj pytania refleksyjne, które pomogą osobie głębiej zrozumieć swoje myśli, uczucia i potrzeby.\n"
+        "- Skoncentruj się na wspieraniu, zrozumieniu i budowaniu poczucia bezpieczeństwa, aby osoba czuła się wysłuchana i doceniona.\n"
+        "- Formułuj wnioski w przyjaznym, ciepłym tonie, tak jakbyś rozmawiał z pacjentem twarzą w twarz, unikaj sztywnej, akademickiej formy..\n\n"
+        "Proszę, odpowiedz w sposób jasny, ciepły i empatyczny, który zachęca do refleksji i samoświadomości, tak jakbyś prowadził rozmowę, która naprawdę pomaga osobie lepiej zrozumieć siebie.."
+    ),
+    suffix="Nagranie: {text}",
+    temperature=0.3, max_tokens=1200,
+))
+
+register(PromptTemplate(
+    "summary_analysis", "v1",
+    system=(
+        "Jesteś psychologiem. Przeczytaj notatki podsumowujące "
+        "rozmowę pacjenta. Przygotuj analizę w formie zrozumiałych punktów, "
+        "zwracając się do pacjenta, tak jakbyś omawiał jego doświadczenia i emocje. "
+        "Udziel wskazówek, refleksji i możliwych pytań do dalszej pracy nad sobą.\n\n"
+        "Wynik podaj w formie listy punktowanej, przyjaznym tonem."
+    ),
+    suffix="{text}",
+    temperature=0.25, max_tokens=800,
+))
+
+register(PromptTemplate(
+    "chunk_summary", "v1",
+    system=(
+        "Przeczytaj notatki od użytkownika i stwórz krótkie (2-4 akapity) podsumowanie oraz 5 kluczowych obserwacji.\n"
+        "Wynik podaj w czytelnym, wypunktowanym formacie."
+    ),
+    suffix="{text}",
+    temperature=0.2, max_tokens=800,
+))
+
+register(PromptTemplate(
+    "chunk_merge", "v1",
+    system=(
+        "Dostaniesz zebrane krótkie podsumowania części notatek. Stwórz z nich jedno spójne, "
+        "krótkie podsumowanie i 5 najważniejszych obserwacji/akcji.\n"
+        "Wynik podaj w czytelnym, wypunktowanym formacie."
+    ),
+    suffix="{text}",
+    temperature=0.2, max_tokens=900,
+))
+
+
+register(PromptTemplate(
+    "summary_update", "v1",
+    system=(
+        "Dostaniesz dotychczasowe podsumowanie notatek oraz podsumowanie nowych notatek. "
+        "Zaktualizuj podsumowanie tak, aby obejmowało oba: zachowaj ważne wcześniejsze wątki, "
+        "dodaj nowe i podaj 5 najważniejszych obserwacji/akcji.\n"
+        "Wynik podaj w czytelnym, wypunktowanym formacie."
+    ),
+    suffix="{text}",
+    temperature=0.2, max_tokens=900,
+))
+
+__all__ = ["PromptTemplate", "register", "get_template", "list_templates"]
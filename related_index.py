@@ -0,0 +1,221 @@
+"""CPU-only "related notes" index.
+
+Each transcript/summary is embedded once, when it is written, as a hashed
+TF-IDF-style projection: Polish-normalized terms (search_index.analyze) and
+their bigrams are hashed into EMBED_DIM signed buckets, weighted 1 + log(tf)
+and L2-normalized. No model download, deterministic across workers.
+
+Vectors are appended to one float32 matrix file per user
+(`vector_index/<key>.f32`, EMBED_DIM columns) with a parallel int64 file of
+artifact ids; queries memory-map the matrix and take a brute-force top-k of
+the dot products with NumPy, which stays in the low milliseconds for the
+tens of thousands of notes a single user can have. A deleted artifact's id
+is overwritten in place with -1 and skipped by queries; `reindex` drops
+those rows for good.
+
+Usage:
+  python related_index.py reindex
+"""
+import os
+import sys
+import math
+import zlib
+import argparse
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except Exception:  # bez numpy indeks podobieństwa jest wyłączony
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from artifacts import user_key
+from search_index import analyze
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", os.path.join(BASE_DIR, "vector_index"))
+EMBED_DIM = int(os.environ.get("EMBED_DIM", "512"))
+RELATED_KINDS = tuple(k.strip() for k in os.environ.get("RELATED_KINDS", "transcript,summary").split(",") if k.strip())
+
+
+def embed(text: str, dim: int = EMBED_DIM):
+    """Hashed, signed, log-tf weighted bag of terms and bigrams; unit length (or all zeros)."""
+    terms = analyze(text)
+    features = Counter(terms)
+    features.update(f"{a} {b}" for a, b in zip(terms, terms[1:]))
+    vec = np.zeros(dim, dtype=np.float32)
+    for feature, tf in features.items():
+        h = zlib.crc32(feature.encode("utf-8"))
+        # osobny bit na znak - kolizje się znoszą zamiast sumować
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        weight = 1.0 + math.log(tf)
+        vec[h % dim] += sign * (weight if " " not in feature else 0.5 * weight)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm > 0 else vec
+
+
+class RelatedIndex:
+    def __init__(self, root: str = VECTOR_INDEX_DIR, dim: int = EMBED_DIM):
+        if np is None:
+            raise RuntimeError("numpy jest wymagany dla indeksu podobnych notatek")
+        self.root = root
+        self.dim = dim
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _paths(self, username: str) -> Tuple[str, str]:
+        base = os.path.join(self.root, user_key(username))
+        return base + ".f32", base + ".ids"
+
+    @contextmanager
+    def _locked(self, username: str):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._paths(username)[0] + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, username: str):
+        """Memory-mapped (vectors, ids) of a user; rows past the shorter file are ignored."""
+        vec_path, ids_path = self._paths(username)
+        if not os.path.exists(vec_path) or not os.path.exists(ids_path):
+            return None, None
+        rows = min(os.path.getsize(vec_path) // (4 * self.dim), os.path.getsize(ids_path) // 8)
+        if rows == 0:
+            return None, None
+        vectors = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(rows,))
+        return vectors, ids
+
+    # === INDEKSOWANIE ===
+    def add(self, username: str, artifact_id: int, text: str) -> None:
+        vec = embed(text, self.dim)
+        if not vec.any():
+            return
+        vec_path, ids_path = self._paths(username)
+        with self._locked(username):
+            # najpierw wektor, potem id: po przerwanym zapisie nadmiarowy wiersz jest ignorowany
+            with open(vec_path, "ab") as f:
+                f.write(vec.astype(np.float32).tobytes())
+            with open(ids_path, "ab") as f:
+                f.write(np.array([artifact_id], dtype=np.int64).tobytes())
+
+    def index_artifact(self, artifact: Dict[str, Any], data: Any) -> None:
+        """ArtifactStore.on_write listener."""
+        if artifact["kind"] not in RELATED_KINDS:
+            return
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        self.add(artifact["username"], artifact["id"], data)
+
+    def remove(self, username: str, artifact_id: int) -> int:
+        """Tombstone the rows of one artifact (id -> -1); returns how many were found."""
+        ids_path = self._paths(username)[1]
+        with self._locked(username):
+            if not os.path.exists(ids_path) or os.path.getsize(ids_path) < 8:
+                return 0
+            ids = np.memmap(ids_path, dtype=np.int64, mode="r+", shape=(os.path.getsize(ids_path) // 8,))
+            rows = np.flatnonzero(ids == artifact_id)
+            if len(rows):
+                ids[rows] = -1
+                ids.flush()
+            del ids
+            return len(rows)
+
+    def remove_artifact(self, artifact: Dict[str, Any]) -> None:
+        """ArtifactStore.on_delete listener."""
+        if artifact["kind"] in RELATED_KINDS:
+            self.remove(artifact["username"], artifact["id"])
+
+    def remove_user(self, username: str) -> None:
+        with self._locked(username):
+            for path in self._paths(username):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # === ZAPYTANIA ===
+    def vector_for(self, username: str, artifact_id: int):
+        vectors, ids = self._load(username)
+        if vectors is None:
+            return None
+        rows = np.flatnonzero(ids == artifact_id)
+        return np.array(vectors[rows[-1]]) if len(rows) else None
+
+    def nearest(self, username: str, query, k: int = 10, exclude: Tuple[int, ...] = ()) -> List[Tuple[int, float]]:
+        """Top-k `(artifact_id, cosine similarity)` for a unit query vector."""
+        vectors, ids = self._load(username)
+        if vectors is None:
+            return []
+        scores = vectors @ query
+        # -1 = usunięty artefakt
+        scores = np.where((ids < 0) | np.isin(ids, exclude), -np.inf, scores)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def stats(self, username: str) -> Dict[str, Any]:
+        vectors, _ = self._load(username)
+        return {"vectors": 0 if vectors is None else int(vectors.shape[0]), "dim": self.dim}
+
+    def reindex(self, artifacts) -> int:
+        """Rebuild all matrices from the artifacts table; returns the number of vectors written."""
+        rows = artifacts.store.execute(
+            f"SELECT * FROM artifacts WHERE kind IN ({', '.join('?' for _ in RELATED_KINDS)}) ORDER BY id",
+            RELATED_KINDS,
+        )
+        for username in {r["username"] for r in rows}:
+            self.remove_user(username)
+        written = 0
+        for artifact in rows:
+            try:
+                self.add(artifact["username"], artifact["id"], artifacts.read_text(artifact))
+                written += 1
+            except Exception as e:
+                print(f"Warning: could not embed {artifact['path']}: {e}")
+        return written
+
+
+_index: Optional[RelatedIndex] = None
+
+
+def get_related_index() -> Optional[RelatedIndex]:
+    """Process-wide index, or None when numpy is not installed."""
+    global _index
+    if _index is None and np is not None:
+        _index = RelatedIndex()
+    return _index
+
+
+def main():
+    p = argparse.ArgumentParser(description="Related-notes vector index")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("reindex")
+    args = p.parse_args()
+
+    from artifacts import ArtifactStore
+    notes, summaries = os.path.join(BASE_DIR, "notes_data"), os.path.join(BASE_DIR, "summary_data")
+    artifacts = ArtifactStore({"audio": notes, "wav": notes, "transcript": notes,
+                               "summary": summaries, "analysis": summaries})
+    if args.cmd == "reindex":
+        print(f"Zapisano {RelatedIndex().reindex(artifacts)} wektorów")
+
+
+__all__ = ["RelatedIndex", "embed", "get_related_index", "RELATED_KINDS"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
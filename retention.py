@@ -0,0 +1,289 @@
+"""Tiered retention: hot artifacts, cold archive bundles, quota-driven eviction.
+
+Hot tier = blob store / segment files (fast reads), cold tier = per-user zip
+bundles (archive_store.py). A run of the manager:
+
+1. ages out: artifacts not read for RETENTION_ARCHIVE_DAYS are archived,
+   decoded WAVs whose job still has its compressed audio are deleted;
+2. enforces RETENTION_USER_QUOTA_MB per user and RETENTION_GLOBAL_QUOTA_MB
+   for the whole installation, evicting regenerable WAVs first and then the
+   least recently read text artifacts (accessed_at, falling back to created_at);
+3. drops Drive downloads older than RETENTION_DRIVE_DAYS together with their
+   manifest rows, so the next Drive sync fetches them again if needed, and
+   runs the blob garbage collector.
+
+Quotas count both tiers: hot bytes plus the user's archive bundles (global:
+every blob still on disk, referenced or not, plus all bundles). An evicted
+blob nobody else references is removed right away, and an eviction is
+credited only with the bytes it actually freed minus what the bundle grew.
+Audio is stored in bundles uncompressed, so moving it to the cold tier frees
+nothing; quota eviction therefore never archives audio, and a user whose
+audio alone exceeds the quota is reported instead.
+
+Nothing is lost: archived artifacts stay listed and searchable and are
+rehydrated transparently by ArtifactStore.read_bytes. After each upload the
+app checks the quota of that one user, so continuous ingestion stays bounded
+between full runs.
+
+Usage:
+  python retention.py report
+  python retention.py run [--dry-run]
+"""
+import os
+import sys
+import argparse
+import datetime
+from typing import Any, Dict, List, Optional
+
+from artifacts import ArtifactStore, user_key
+from archive_store import STORED_KINDS
+from gdrive_fetch import forget_downloads
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RETENTION_ARCHIVE_DAYS = float(os.environ.get("RETENTION_ARCHIVE_DAYS", "90"))
+# 0 = bez limitu
+RETENTION_USER_QUOTA_MB = float(os.environ.get("RETENTION_USER_QUOTA_MB", "1024"))
+RETENTION_GLOBAL_QUOTA_MB = float(os.environ.get("RETENTION_GLOBAL_QUOTA_MB", "20480"))
+RETENTION_DRIVE_DAYS = float(os.environ.get("RETENTION_DRIVE_DAYS", "30"))
+DRIVE_NOTES_DIR = os.environ.get("DRIVE_NOTES_DIR", os.path.join(BASE_DIR, "drive_notes"))
+
+_MB = 1024 * 1024
+# kolejność eksmisji: najpierw odtwarzalne WAV-y, potem najdawniej czytane
+_EVICTION_ORDER = "ORDER BY CASE WHEN kind = 'wav' THEN 0 ELSE 1 END, COALESCE(accessed_at, created_at), id"
+
+
+class RetentionManager:
+    def __init__(self, artifacts: ArtifactStore, archive_days: float = RETENTION_ARCHIVE_DAYS,
+                 user_quota_mb: float = RETENTION_USER_QUOTA_MB, global_quota_mb: float = RETENTION_GLOBAL_QUOTA_MB):
+        self.artifacts = artifacts
+        self.store = artifacts.store
+        self.archive_days = archive_days
+        self.user_quota = int(user_quota_mb * _MB)
+        self.global_quota = int(global_quota_mb * _MB)
+
+    # === ZUŻYCIE ===
+    def hot_usage(self, username: Optional[str] = None) -> int:
+        """Hot bytes referenced by one user (shared blobs count for every holder), or on disk overall."""
+        if username:
+            rows = self.store.execute(
+                "SELECT COALESCE(SUM(size), 0) AS bytes FROM artifacts WHERE resident = 1 AND username = ?",
+                (username.lower(),),
+            )
+            return int(rows[0]["bytes"])
+        # bloby czekające na gc też zajmują dysk
+        blobs = self.store.execute("SELECT COALESCE(SUM(size), 0) AS bytes FROM blobs")
+        legacy = self.store.execute(
+            "SELECT COALESCE(SUM(size), 0) AS bytes FROM artifacts WHERE resident = 1 AND digest IS NULL"
+        )
+        return int(blobs[0]["bytes"]) + int(legacy[0]["bytes"])
+
+    def user_usage(self, username: str) -> int:
+        """Quota usage of one user: hot artifacts plus the user's archive bundles."""
+        return self.hot_usage(username) + self.artifacts.archive.usage(user_key(username))
+
+    def global_usage(self) -> int:
+        """Bytes on disk in both tiers."""
+        return self.hot_usage() + self.artifacts.archive.usage()
+
+    def report(self) -> Dict[str, Any]:
+        users = self.store.execute(
+            "SELECT username, SUM(CASE WHEN resident = 1 THEN size ELSE 0 END) AS hot, "
+            "SUM(CASE WHEN resident = 1 THEN 0 ELSE size END) AS archived, COUNT(*) AS artifacts "
+            "FROM artifacts GROUP BY username ORDER BY hot DESC"
+        )
+        return {
+            "hot_bytes": self.hot_usage(),
+            "archive_bytes": self.artifacts.archive.usage(),
+            "global_quota": self.global_quota,
+            "user_quota": self.user_quota,
+            "users": [{"username": u["username"], "hot": int(u["hot"]), "archived": int(u["archived"]),
+                       "artifacts": int(u["artifacts"]),
+                       "archive_bytes": self.artifacts.archive.usage(user_key(u["username"]))} for u in users],
+        }
+
+    # === EKSMISJA ===
+    def _regenerable(self, artifact: Dict[str, Any]) -> bool:
+        """A decoded WAV can be recreated while its job still has the uploaded audio."""
+        if artifact["kind"] != "wav" or not artifact.get("job_id"):
+            return False
+        return any(a["kind"] == "audio" for a in self.artifacts.for_job(artifact["username"], artifact["job_id"]))
+
+    def _evict(self, artifact: Dict[str, Any], dry_run: bool, archive_stored: bool = True) -> Optional[Dict[str, int]]:
+        """Delete (regenerable) or archive one artifact.
+
+        Returns `{"user": ..., "disk": ...}`: bytes the owner's quota and the disk got back,
+        net of what the archive bundle grew; None when evicting would not free anything.
+        """
+        regenerable = self._regenerable(artifact)
+        if not regenerable and not archive_stored and artifact["kind"] in STORED_KINDS:
+            # audio w paczce leży bez kompresji - przeniesienie nic nie zwalnia
+            return None
+        size = int(artifact["size"])
+        if dry_run:
+            return {"user": size, "disk": size}
+        added = 0
+        if regenerable:
+            self.artifacts.delete(artifact)
+        else:
+            added = self.artifacts.archive_artifact(artifact)
+        if artifact.get("digest"):
+            # ostatnia referencja - blob znika od razu, bez czekania na gc
+            dropped = self.artifacts.blobs.drop_if_unreferenced(artifact["digest"]) or 0
+        else:
+            dropped = size
+        return {"user": size - added, "disk": dropped - added}
+
+    def age_out(self, dry_run: bool = False) -> Dict[str, int]:
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=self.archive_days)).isoformat()
+        rows = self.store.execute(
+            f"SELECT * FROM artifacts WHERE resident = 1 AND COALESCE(accessed_at, created_at) < ? {_EVICTION_ORDER}",
+            (cutoff,),
+        )
+        report = {"evicted": 0, "bytes": 0}
+        for artifact in rows:
+            try:
+                freed = self._evict(artifact, dry_run)
+            except Exception as e:
+                print(f"Warning: could not age out {artifact['path']}: {e}")
+                continue
+            report["evicted"] += 1
+            report["bytes"] += freed["disk"]
+        return report
+
+    def enforce_user_quota(self, username: str, dry_run: bool = False) -> Dict[str, Any]:
+        report = {"evicted": 0, "bytes": 0, "over_quota": False}
+        if not self.user_quota:
+            return report
+        usage = self.user_usage(username)
+        if usage <= self.user_quota:
+            return report
+        rows = self.store.execute(
+            f"SELECT * FROM artifacts WHERE resident = 1 AND username = ? {_EVICTION_ORDER}", (username.lower(),)
+        )
+        for artifact in rows:
+            if usage <= self.user_quota:
+                break
+            try:
+                freed = self._evict(artifact, dry_run, archive_stored=False)
+            except Exception as e:
+                print(f"Warning: could not evict {artifact['path']}: {e}")
+                continue
+            if freed is None:
+                continue
+            usage -= freed["user"]
+            report["evicted"] += 1
+            report["bytes"] += freed["user"]
+        if usage > self.user_quota:
+            report["over_quota"] = True
+            print(f"Warning: {username} przekracza limit ({usage / _MB:.1f} MB z {self.user_quota / _MB:.0f} MB) "
+                  f"samym audio - nie ma czego zwolnić")
+        return report
+
+    def enforce_global_quota(self, dry_run: bool = False) -> Dict[str, Any]:
+        report = {"evicted": 0, "bytes": 0, "over_quota": False}
+        if not self.global_quota:
+            return report
+        usage = self.global_usage()
+        if usage <= self.global_quota:
+            return report
+        rows = self.store.execute(f"SELECT * FROM artifacts WHERE resident = 1 {_EVICTION_ORDER}")
+        for artifact in rows:
+            if usage <= self.global_quota:
+                break
+            try:
+                freed = self._evict(artifact, dry_run, archive_stored=False)
+            except Exception as e:
+                print(f"Warning: could not evict {artifact['path']}: {e}")
+                continue
+            if freed is None:
+                continue
+            usage -= freed["disk"]
+            report["evicted"] += 1
+            report["bytes"] += freed["disk"]
+        if usage > self.global_quota:
+            report["over_quota"] = True
+            print(f"Warning: instalacja przekracza limit ({usage / _MB:.1f} MB z {self.global_quota / _MB:.0f} MB)")
+        return report
+
+    def trim_drive_cache(self, max_age_days: float = RETENTION_DRIVE_DAYS, root: str = DRIVE_NOTES_DIR,
+                         dry_run: bool = False) -> Dict[str, int]:
+        """Remove Drive downloads older than `max_age_days` and forget them in the Drive manifest.
+
+        Without the manifest rows the next sync downloads a trimmed file again
+        (if it is still on Drive); versions already processed stay marked in
+        `drive_processed` and are not processed twice.
+        """
+        report = {"removed": 0, "bytes": 0}
+        removed: List[str] = []
+        if not os.path.isdir(root):
+            return report
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).timestamp()
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if name.startswith(".") or os.path.getmtime(path) >= cutoff:
+                    continue
+                report["removed"] += 1
+                report["bytes"] += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+                    removed.append(os.path.relpath(path, root))
+        forget_downloads(removed, self.store)
+        return report
+
+    def run(self, dry_run: bool = False, gc: bool = True) -> Dict[str, Any]:
+        report: Dict[str, Any] = {"dry_run": dry_run, "aged_out": self.age_out(dry_run), "user_quota": {}}
+        users: List[Dict[str, Any]] = self.store.execute(
+            "SELECT DISTINCT username FROM artifacts WHERE resident = 1"
+        ) if self.user_quota else []
+        for row in users:
+            # limit liczy też paczki archiwum, więc sprawdzamy każdego użytkownika z gorącymi danymi
+            if self.user_usage(row["username"]) > self.user_quota:
+                report["user_quota"][row["username"]] = self.enforce_user_quota(row["username"], dry_run)
+        report["global_quota"] = self.enforce_global_quota(dry_run)
+        report["drive_cache"] = self.trim_drive_cache(dry_run=dry_run)
+        if gc and not dry_run:
+            report["gc"] = self.artifacts.blobs.gc()
+        return report
+
+
+_manager: Optional[RetentionManager] = None
+
+
+def get_retention_manager(artifacts: ArtifactStore) -> RetentionManager:
+    global _manager
+    if _manager is None or _manager.artifacts is not artifacts:
+        _manager = RetentionManager(artifacts)
+    return _manager
+
+
+def main():
+    p = argparse.ArgumentParser(description="Tiered retention for artifacts")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("report")
+    r = sub.add_parser("run")
+    r.add_argument("--dry-run", action="store_true")
+    r.add_argument("--no-gc", action="store_true")
+    args = p.parse_args()
+
+    notes, summaries = os.path.join(BASE_DIR, "notes_data"), os.path.join(BASE_DIR, "summary_data")
+    artifacts = ArtifactStore({"audio": notes, "wav": notes, "transcript": notes,
+                               "summary": summaries, "analysis": summaries})
+    manager = RetentionManager(artifacts)
+    if args.cmd == "report":
+        report = manager.report()
+        print(f"Gorący poziom: {report['hot_bytes'] / _MB:.1f} MB, archiwum: {report['archive_bytes'] / _MB:.1f} MB "
+              f"(limit łącznie {report['global_quota'] / _MB:.0f} MB)")
+        for u in report["users"]:
+            print(f"  {u['username']:<30} hot {u['hot'] / _MB:8.1f} MB  archived {u['archived'] / _MB:8.1f} MB  "
+                  f"bundles {u['archive_bytes'] / _MB:8.1f} MB  ({u['artifacts']} artefaktów)")
+    else:
+        print(manager.run(dry_run=args.dry_run, gc=not args.no_gc))
+
+
+__all__ = ["RetentionManager", "get_retention_manager"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,5 @@
 #!/bin/bash
-# Uruchamia automatycznie summary_groq.py z Twoim venv
-
-# Aktywacja virtual environment (jeśli używasz venv)
-source /home/przemek/note_app/venv/bin/activate
-
-# Uruchomienie skryptu Python
-python /home/przemek/note_app/summary_groq.py
\ No newline at end of file
+# Jednorazowe podsumowanie przez scheduler (historia przebiegów, bez nakładania się).
+# Zamiast crona: `python scheduler.py run` albo SCHEDULER_IN_APP=1 w aplikacji.
+cd "$(dirname "$0")"
+exec "${PYTHON:-python}" scheduler.py once summary
@@ -0,0 +1,556 @@
+"""Built-in scheduler for the batch jobs (replaces cron + run_summary.sh).
+
+Jobs are the existing command-line tools, started as subprocesses with the
+current interpreter from BASE_DIR (no hard-coded venv paths):
+
+    drive_sync  main.py drive-sync                      SCHEDULE_DRIVE_SYNC  "15 * * * *"
+    summary     summary_groq.py --incremental --no-fetch SCHEDULE_SUMMARY    "30 2 * * *"
+    analysis    analyze_notes.py                        SCHEDULE_ANALYSIS    "0 3 * * *"
+    retention   retention.py run                        SCHEDULE_RETENTION   "30 4 * * *"
+
+Schedules are 5-field cron expressions (minute hour day month weekday; `*`,
+`a-b`, `a,b`, `*/n`), in local time; an empty value or "off" disables the
+job. Every run is shifted by a random jitter (SCHEDULER_JITTER_S), and the
+batch jobs (offpeak) that fall outside SCHEDULER_OFFPEAK ("01:00-06:00")
+are deferred into that window, so load does not land all at once. At most
+SCHEDULER_MAX_CONCURRENT jobs run at a time; each job also has its own cap,
+enforced with flock slots so a manual `once` run cannot overlap the daemon.
+
+Only one scheduler is active across processes (non-blocking flock on
+SCHEDULER_LOCK): with several uvicorn workers the others stay on standby and
+take over when the leader exits. State lives in the store - `scheduler_jobs`
+(next run, run-now / skip flags) and `scheduler_runs` (history with status,
+duration and the tail of the output) - so the controls work from any
+process (over HTTP only for accounts in ADMIN_USERS). A slot missed while
+nothing was running is caught up once after start (SCHEDULER_BACKFILL).
+
+Usage:
+  python scheduler.py run                 # daemon in the foreground
+  python scheduler.py status
+  python scheduler.py history [--job summary] [--limit 20]
+  python scheduler.py run-now summary     # picked up by the active scheduler
+  python scheduler.py skip summary        # skip the next scheduled run
+  python scheduler.py once summary        # run now in this process
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from storage import Store, get_store
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEDULER_TICK_S = float(os.environ.get("SCHEDULER_TICK_S", "30"))
+SCHEDULER_JITTER_S = float(os.environ.get("SCHEDULER_JITTER_S", "300"))
+# okno poza szczytem dla zadań wsadowych; puste = bez ograniczeń
+SCHEDULER_OFFPEAK = os.environ.get("SCHEDULER_OFFPEAK", "01:00-06:00")
+SCHEDULER_MAX_CONCURRENT = int(os.environ.get("SCHEDULER_MAX_CONCURRENT", "2"))
+SCHEDULER_BACKFILL = os.environ.get("SCHEDULER_BACKFILL", "1") == "1"
+SCHEDULER_JOB_TIMEOUT_S = float(os.environ.get("SCHEDULER_JOB_TIMEOUT_S", str(4 * 3600)))
+SCHEDULER_LOCK_DIR = os.environ.get("SCHEDULER_LOCK_DIR", os.path.join(BASE_DIR, "checkpoints"))
+SCHEDULER_LOCK = os.environ.get("SCHEDULER_LOCK", os.path.join(SCHEDULER_LOCK_DIR, "scheduler.lock"))
+# tyle ostatnich znaków wyjścia zadania trafia do historii
+SCHEDULER_OUTPUT_TAIL = int(os.environ.get("SCHEDULER_OUTPUT_TAIL", "4000"))
+
+SCHEDULER_SCHEMA = {
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS scheduler_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            trigger TEXT NOT NULL,
+            scheduled_for TEXT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            duration_s REAL,
+            status TEXT NOT NULL,
+            exit_code INTEGER,
+            output TEXT
+        )""",
+    ],
+    "postgres": [
+        """CREATE TABLE IF NOT EXISTS scheduler_runs (
+            id BIGSERIAL PRIMARY KEY,
+            job TEXT NOT NULL,
+            trigger TEXT NOT NULL,
+            scheduled_for TEXT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            duration_s REAL,
+            status TEXT NOT NULL,
+            exit_code INTEGER,
+            output TEXT
+        )""",
+    ],
+}
+SCHEDULER_JOBS_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS scheduler_jobs (
+        name TEXT PRIMARY KEY,
+        cron TEXT NOT NULL,
+        next_run_at TEXT,
+        run_requested INTEGER NOT NULL DEFAULT 0,
+        skip_next INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_scheduler_runs_job ON scheduler_runs (job, id)",
+]
+
+
+# === CRON ===
+class CronExpr:
+    """Minimal 5-field cron expression; day-of-month and weekday match either when both are set."""
+
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Wyrażenie cron musi mieć 5 pól: {expr!r}")
+        self.expr = expr
+        sets = [self._parse(f, lo, hi) for f, (lo, hi) in zip(fields, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = sets
+        self._dom_any, self._dow_any = fields[2] == "*", fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            rng, _, step = part.partition("/")
+            if rng == "*":
+                start, end = lo, hi
+            elif "-" in rng:
+                start, end = (int(x) for x in rng.split("-", 1))
+            else:
+                start = end = int(rng)
+                if step:
+                    end = hi
+            # dzień tygodnia 7 = niedziela, jak w cronie
+            top = 7 if hi == 6 else hi
+            if start < lo or end > top or start > end:
+                raise ValueError(f"Pole cron poza zakresem {lo}-{hi}: {field!r}")
+            values.update(v % 7 if hi == 6 else v for v in range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, d: datetime.datetime) -> bool:
+        dom = d.day in self.days
+        dow = (d.weekday() + 1) % 7 in self.weekdays
+        if self._dom_any or self._dow_any:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, after: datetime.datetime) -> datetime.datetime:
+        t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Wyrażenie cron nigdy nie pasuje: {self.expr!r}")
+
+
+def _parse_window(spec: str):
+    if not spec.strip():
+        return None
+    bounds = []
+    for part in spec.split("-", 1):
+        hour, minute = part.strip().split(":")
+        bounds.append(int(hour) * 60 + int(minute))
+    return tuple(bounds)
+
+
+def in_window(t: datetime.datetime, window=None) -> bool:
+    window = window if window is not None else _parse_window(SCHEDULER_OFFPEAK)
+    if window is None:
+        return True
+    start, end = window
+    m = t.hour * 60 + t.minute
+    return start <= m < end if start <= end else (m >= start or m < end)
+
+
+def defer_to_window(t: datetime.datetime, window=None) -> datetime.datetime:
+    """`t` itself if inside the off-peak window, else the start of the next window."""
+    window = window if window is not None else _parse_window(SCHEDULER_OFFPEAK)
+    if window is None or in_window(t, window):
+        return t
+    start = t.replace(hour=window[0] // 60, minute=window[0] % 60, second=0, microsecond=0)
+    return start if start > t else start + datetime.timedelta(days=1)
+
+
+# === ZADANIA ===
+class Job:
+    def __init__(self, name: str, cron: str, command: List[str], offpeak: bool = False, max_concurrent: int = 1,
+                 timeout: float = SCHEDULER_JOB_TIMEOUT_S, jitter: float = SCHEDULER_JITTER_S):
+        self.name = name
+        self.cron = CronExpr(cron) if cron else None
+        self.command = command
+        self.offpeak = offpeak
+        self.max_concurrent = max(1, max_concurrent)
+        self.timeout = timeout
+        self.jitter = jitter
+
+    def next_run(self, after: datetime.datetime) -> Optional[datetime.datetime]:
+        if self.cron is None:
+            return None
+        t = self.cron.next_after(after) + datetime.timedelta(seconds=random.uniform(0, self.jitter))
+        return defer_to_window(t) if self.offpeak else t
+
+
+def _schedule(name: str, default: str) -> str:
+    value = os.environ.get(f"SCHEDULE_{name.upper()}", default).strip()
+    return "" if value.lower() == "off" else value
+
+
+def default_jobs() -> List[Job]:
+    return [
+        # pobiera i od razu przetwarza nagrania dla NOTES_OWNER (samo gdrive_fetch.py niczego nie przetwarza)
+        Job("drive_sync", _schedule("drive_sync", "15 * * * *"), [os.path.join(BASE_DIR, "main.py"), "drive-sync"]),
+        Job("summary", _schedule("summary", "30 2 * * *"),
+            [os.path.join(BASE_DIR, "summary_groq.py"), "--incremental", "--no-fetch"], offpeak=True),
+        Job("analysis", _schedule("analysis", "0 3 * * *"), [os.path.join(BASE_DIR, "analyze_notes.py")],
+            offpeak=True),
+        Job("retention", _schedule("retention", "30 4 * * *"), [os.path.join(BASE_DIR, "retention.py"), "run"],
+            offpeak=True),
+    ]
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now()
+
+
+class Scheduler:
+    def __init__(self, jobs: Optional[List[Job]] = None, store: Optional[Store] = None,
+                 lock_path: str = SCHEDULER_LOCK, max_concurrent: int = SCHEDULER_MAX_CONCURRENT,
+                 tick_s: float = SCHEDULER_TICK_S, backfill: bool = SCHEDULER_BACKFILL):
+        self.jobs = {j.name: j for j in (jobs if jobs is not None else default_jobs())}
+        self.store = store or get_store()
+        self.store.ensure_schema(SCHEDULER_SCHEMA[self.store.kind] + SCHEDULER_JOBS_SCHEMA)
+        self.lock_path = lock_path
+        self.max_concurrent = max(1, max_concurrent)
+        self.tick_s = tick_s
+        self.backfill = backfill
+        self._lock_file = None
+        self._running: Dict[str, int] = {}
+        self._state_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # === LIDER ===
+    def _lead(self) -> bool:
+        """Hold the process-wide scheduler lock; the first process to get it runs the jobs."""
+        if self._lock_file is not None:
+            return True
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            f = open(self.lock_path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            self._lock_file = f
+        else:
+            self._lock_file = True
+        self._on_leader()
+        return True
+
+    def _on_leader(self) -> None:
+        print(f"Scheduler aktywny (pid {os.getpid()}): {', '.join(self.jobs)}")
+        # przebiegi poprzedniego lidera, który padł w trakcie
+        self.store.execute("UPDATE scheduler_runs SET status = 'interrupted' WHERE status = 'running'")
+        now = _now()
+        known = {r["name"]: r for r in self.store.execute("SELECT * FROM scheduler_jobs")}
+        for job in self.jobs.values():
+            cron = job.cron.expr if job.cron else ""
+            row = known.get(job.name)
+            next_run = row["next_run_at"] if row and row["cron"] == cron else None
+            if next_run and next_run < now.isoformat() and not self.backfill:
+                self._record(job.name, "cron", next_run, "missed")
+                next_run = None
+            if next_run is None:
+                t = job.next_run(now)
+                next_run = t.isoformat() if t else None
+            self.store.execute(
+                "INSERT INTO scheduler_jobs (name, cron, next_run_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET cron = excluded.cron, next_run_at = excluded.next_run_at, "
+                "updated_at = excluded.updated_at",
+                (job.name, cron, next_run, now.isoformat()),
+            )
+
+    def release(self) -> None:
+        if self._lock_file is not None and self._lock_file is not True:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+        self._lock_file = None
+
+    # === HISTORIA ===
+    def _record(self, job: str, trigger: str, scheduled_for: Optional[str], status: str,
+                output: Optional[str] = None) -> int:
+        now = _now().isoformat()
+        with self.store.transaction(write=True) as cur:
+            cur.execute("INSERT INTO scheduler_runs (job, trigger, scheduled_for, started_at, status, output) "
+                        "VALUES (?, ?, ?, ?, ?, ?) RETURNING id", (job, trigger, scheduled_for, now, status, output))
+            return int(cur.fetchone()["id"])
+
+    def _finish(self, run_id: int, status: str, started: float, exit_code: Optional[int], output: str) -> None:
+        self.store.execute(
+            "UPDATE scheduler_runs SET finished_at = ?, duration_s = ?, status = ?, exit_code = ?, output = ? "
+            "WHERE id = ?",
+            (_now().isoformat(), round(time.monotonic() - started, 2), status, exit_code,
+             output[-SCHEDULER_OUTPUT_TAIL:], run_id),
+        )
+
+    # === URUCHAMIANIE ===
+    def _slot(self, job: Job):
+        """Free flock slot of the job (at most max_concurrent across all processes), or None."""
+        if fcntl is None:
+            return True
+        os.makedirs(SCHEDULER_LOCK_DIR, exist_ok=True)
+        for i in range(job.max_concurrent):
+            f = open(os.path.join(SCHEDULER_LOCK_DIR, f"job-{job.name}.{i}.lock"), "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    def run_job(self, name: str, trigger: str = "manual", scheduled_for: Optional[str] = None) -> Dict[str, Any]:
+        """Run one job to completion in this thread and record it in the history."""
+        job = self.jobs[name]
+        slot = self._slot(job)
+        if slot is None:
+            # poprzedni przebieg (tu albo w innym procesie) jeszcze trwa
+            self._record(name, trigger, scheduled_for, "overlap")
+            print(f"[scheduler] {name}: poprzedni przebieg jeszcze trwa - pomijam")
+            return {"job": name, "status": "overlap"}
+        run_id = self._record(name, trigger, scheduled_for, "running")
+        started = time.monotonic()
+        print(f"[scheduler] {name}: start ({trigger})")
+        try:
+            proc = subprocess.run([sys.executable, *job.command], cwd=BASE_DIR, capture_output=True, text=True,
+                                  timeout=job.timeout, env=dict(os.environ, PYTHONUNBUFFERED="1"))
+            output = (proc.stdout or "") + (proc.stderr or "")
+            status, exit_code = ("ok" if proc.returncode == 0 else "failed"), proc.returncode
+        except subprocess.TimeoutExpired as e:
+            out = e.stdout or b""
+            output = (out.decode("utf-8", errors="replace") if isinstance(out, bytes) else out) + \
+                f"\n[scheduler] przekroczono limit {job.timeout:.0f}s"
+            status, exit_code = "timeout", None
+        except Exception as e:
+            output, status, exit_code = f"[scheduler] nie udało się uruchomić: {e}", "failed", None
+        finally:
+            if slot is not True:
+                fcntl.flock(slot, fcntl.LOCK_UN)
+                slot.close()
+        self._finish(run_id, status, started, exit_code, output)
+        print(f"[scheduler] {name}: {status} po {time.monotonic() - started:.1f}s")
+        return {"job": name, "status": status, "exit_code": exit_code, "run_id": run_id}
+
+    def _launch(self, job: Job, trigger: str, scheduled_for: Optional[str]) -> None:
+        def target():
+            try:
+                self.run_job(job.name, trigger, scheduled_for)
+            except Exception as e:
+                print(f"Warning: scheduler job {job.name} failed: {e}")
+            finally:
+                with self._state_lock:
+                    self._running[job.name] -= 1
+        with self._state_lock:
+            self._running[job.name] = self._running.get(job.name, 0) + 1
+        threading.Thread(target=target, name=f"scheduler-{job.name}", daemon=True).start()
+
+    def _can_start(self, job: Job) -> bool:
+        with self._state_lock:
+            return (sum(self._running.values()) < self.max_concurrent
+                    and self._running.get(job.name, 0) < job.max_concurrent)
+
+    def tick(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        """Start whatever is due; returns the names of jobs started."""
+        if not self._lead():
+            return []
+        now = now or _now()
+        started = []
+        for row in self.store.execute("SELECT * FROM scheduler_jobs ORDER BY run_requested DESC, next_run_at"):
+            job = self.jobs.get(row["name"])
+            if job is None:
+                continue
+            if row["run_requested"]:
+                if not self._can_start(job):
+                    continue
+                self.store.execute("UPDATE scheduler_jobs SET run_requested = 0 WHERE name = ?", (job.name,))
+                self._launch(job, "manual", None)
+                started.append(job.name)
+                continue
+            if not row["next_run_at"] or row["next_run_at"] > now.isoformat():
+                continue
+            if job.offpeak and not in_window(now):
+                # zaległy przebieg (backfill) też czeka na okno poza szczytem
+                self._set_next(job.name, defer_to_window(now) + datetime.timedelta(
+                    seconds=random.uniform(0, job.jitter)))
+                continue
+            if row["skip_next"]:
+                self._record(job.name, "cron", row["next_run_at"], "skipped")
+                self.store.execute("UPDATE scheduler_jobs SET skip_next = 0 WHERE name = ?", (job.name,))
+            elif not self._can_start(job):
+                # limit współbieżności - zadanie czeka na kolejny tick
+                continue
+            else:
+                self._launch(job, "cron", row["next_run_at"])
+                started.append(job.name)
+            self._set_next(job.name, job.next_run(now))
+        return started
+
+    def _set_next(self, name: str, t: Optional[datetime.datetime]) -> None:
+        self.store.execute("UPDATE scheduler_jobs SET next_run_at = ?, updated_at = ? WHERE name = ?",
+                           (t.isoformat() if t else None, _now().isoformat(), name))
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Warning: scheduler tick failed: {e}")
+            self._stop.wait(self.tick_s)
+
+    def start(self) -> None:
+        """Run the tick loop in a daemon thread (standby until this process gets the lock)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.release()
+
+    # === STEROWANIE (z dowolnego procesu) ===
+    def _check(self, name: str) -> None:
+        if name not in self.jobs:
+            raise KeyError(f"Nieznane zadanie: {name}")
+
+    def request_run(self, name: str) -> None:
+        self._check(name)
+        self._ensure_row(name)
+        self.store.execute("UPDATE scheduler_jobs SET run_requested = 1, updated_at = ? WHERE name = ?",
+                           (_now().isoformat(), name))
+
+    def skip_next(self, name: str) -> None:
+        self._check(name)
+        self._ensure_row(name)
+        self.store.execute("UPDATE scheduler_jobs SET skip_next = 1, updated_at = ? WHERE name = ?",
+                           (_now().isoformat(), name))
+
+    def _ensure_row(self, name: str) -> None:
+        job = self.jobs[name]
+        self.store.execute(
+            "INSERT INTO scheduler_jobs (name, cron, next_run_at, updated_at) VALUES (?, ?, NULL, ?) "
+            "ON CONFLICT (name) DO NOTHING", (name, job.cron.expr if job.cron else "", _now().isoformat()))
+
+    def history(self, job: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        if job:
+            return self.store.execute("SELECT * FROM scheduler_runs WHERE job = ? ORDER BY id DESC LIMIT ?",
+                                      (job, limit))
+        return self.store.execute("SELECT * FROM scheduler_runs ORDER BY id DESC LIMIT ?", (limit,))
+
+    def status(self) -> Dict[str, Any]:
+        rows = {r["name"]: r for r in self.store.execute("SELECT * FROM scheduler_jobs")}
+        jobs = []
+        for name, job in self.jobs.items():
+            row = rows.get(name, {})
+            last = self.store.execute(
+                "SELECT status, started_at, duration_s FROM scheduler_runs WHERE job = ? ORDER BY id DESC LIMIT 1",
+                (name,))
+            jobs.append({"name": name, "cron": job.cron.expr if job.cron else None, "offpeak": job.offpeak,
+                         "next_run_at": row.get("next_run_at"), "run_requested": bool(row.get("run_requested")),
+                         "skip_next": bool(row.get("skip_next")), "last_run": last[0] if last else None})
+        with self._state_lock:
+            running = {k: v for k, v in self._running.items() if v}
+        return {"leader": self._lock_file is not None, "pid": os.getpid(), "offpeak": SCHEDULER_OFFPEAK,
+                "max_concurrent": self.max_concurrent, "running_here": running, "jobs": jobs}
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def get_scheduler(store: Optional[Store] = None) -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(store=store)
+    return _scheduler
+
+
+def main():
+    p = argparse.ArgumentParser(description="Scheduler for batch jobs")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("run")
+    sub.add_parser("status")
+    h = sub.add_parser("history")
+    h.add_argument("--job")
+    h.add_argument("--limit", type=int, default=20)
+    for cmd in ("run-now", "skip", "once"):
+        sub.add_parser(cmd).add_argument("job")
+    args = p.parse_args()
+
+    scheduler = Scheduler()
+    if args.cmd == "run":
+        scheduler.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            scheduler.stop()
+        return
+    if args.cmd == "status":
+        status = scheduler.status()
+        print(f"Okno poza szczytem: {status['offpeak'] or 'brak'}, maks. równolegle: {status['max_concurrent']}")
+        for j in status["jobs"]:
+            last = j["last_run"]
+            last_s = f"{last['status']} {last['started_at'][:16]} ({last['duration_s'] or 0:.0f}s)" if last else "-"
+            flags = (" [run-now]" if j["run_requested"] else "") + (" [skip]" if j["skip_next"] else "")
+            print(f"  {j['name']:<12} {j['cron'] or 'wyłączone':<14} następny: {(j['next_run_at'] or '-')[:16]:<16}  "
+                  f"ostatni: {last_s}{flags}")
+        return
+    if args.cmd == "history":
+        for r in scheduler.history(args.job, args.limit):
+            duration = f"{r['duration_s']:.1f}s" if r["duration_s"] is not None else "-"
+            print(f"  #{r['id']:<5} {r['job']:<12} {r['trigger']:<7} {r['started_at'][:19]}  {r['status']:<11} "
+                  f"{duration:>9}  kod {r['exit_code'] if r['exit_code'] is not None else '-'}")
+        return
+    try:
+        if args.cmd == "run-now":
+            scheduler.request_run(args.job)
+            print(f"Zlecono uruchomienie {args.job} - wykona je aktywny scheduler")
+        elif args.cmd == "skip":
+            scheduler.skip_next(args.job)
+            print(f"Następny zaplanowany przebieg {args.job} zostanie pominięty")
+        else:
+            result = scheduler.run_job(args.job)
+            return 0 if result["status"] == "ok" else 1
+    except KeyError as e:
+        raise SystemExit(str(e))
+
+
+__all__ = ["CronExpr", "Job", "Scheduler", "default_jobs", "get_scheduler"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
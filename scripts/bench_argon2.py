@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Benchmark Argon2 hashing with the configured parameters.
+
+Usage:
+  python3 scripts/bench_argon2.py --rounds 10
+  ARGON2_MEMORY_KIB=32768 ARGON2_TIME_COST=2 python3 scripts/bench_argon2.py
+
+Reports single-hash latency (sequential) and throughput when HASH_CONCURRENCY
+hashes run in parallel on the hashing pool, plus the memory that concurrency
+needs. Use it to size HASH_MEMORY_BUDGET_MB and the Argon2 parameters.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import password_hashing as ph
+
+
+def percentile(values, q):
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[idx]
+
+
+async def parallel(n):
+    start = time.monotonic()
+    await asyncio.gather(*(ph.hash_password_async(f"bench-{i}") for i in range(n)))
+    return time.monotonic() - start
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--rounds', type=int, default=10)
+    p.add_argument('--parallel', type=int, default=None, help='hashes for the pool run (default: 4x concurrency)')
+    args = p.parse_args()
+
+    print(f"Argon2id m={ph.ARGON2_MEMORY_KIB} KiB, t={ph.ARGON2_TIME_COST}, p={ph.ARGON2_PARALLELISM}")
+    print(f"Budżet pamięci: {ph.HASH_MEMORY_BUDGET_MB} MB -> współbieżność {ph.HASH_CONCURRENCY} "
+          f"({ph.HASH_CONCURRENCY * ph.ARGON2_MEMORY_KIB // 1024} MB w szczycie)")
+
+    timings = []
+    hashed = None
+    for i in range(args.rounds):
+        start = time.monotonic()
+        hashed = ph.hash_password(f"bench-{i}")
+        timings.append(time.monotonic() - start)
+    start = time.monotonic()
+    ph.verify_and_update("bench-last", hashed)
+    verify_ms = 1000 * (time.monotonic() - start)
+
+    print(f"hash:   mean {1000 * statistics.mean(timings):.1f} ms, p50 {1000 * percentile(timings, 0.5):.1f} ms, "
+          f"p95 {1000 * percentile(timings, 0.95):.1f} ms ({args.rounds} prób)")
+    print(f"verify: {verify_ms:.1f} ms")
+
+    n = args.parallel or ph.HASH_CONCURRENCY * 4
+    elapsed = asyncio.run(parallel(n))
+    print(f"pula:   {n} hashy w {elapsed:.2f} s -> {n / elapsed:.1f} hash/s")
+    print(ph.hashing_stats())
+
+
+if __name__ == '__main__':
+    main()
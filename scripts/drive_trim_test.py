@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Regression test: retention trims Drive downloads, the next sync fetches them again.
+
+Usage:
+  python3 scripts/drive_trim_test.py
+
+Runs offline against a temporary SQLite store and a LocalDirSource standing in
+for the Drive folder:
+ - sync one file and mark it processed for a user
+ - age it past RETENTION_DRIVE_DAYS and run RetentionManager.trim_drive_cache
+ - check the manifest row is gone, pending_for does not return the missing file
+   and a new sync downloads it again without queueing it for processing
+ - delete a download by hand and check the sync notices that too
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Store
+from artifacts import ArtifactStore
+from archive_store import ArchiveStore
+from blob_store import BlobStore
+from gdrive_fetch import DriveSync, LocalDirSource
+from retention import RetentionManager
+
+
+def main():
+    tmp = tempfile.mkdtemp(prefix="drive_trim_")
+    remote, local = os.path.join(tmp, "remote"), os.path.join(tmp, "drive_notes")
+    os.makedirs(remote)
+    with open(os.path.join(remote, "notatka.txt"), "w", encoding="utf-8") as f:
+        f.write("treść notatki")
+
+    store = Store("sqlite:///" + os.path.join(tmp, "test.db"))
+    artifacts = ArtifactStore({kind: os.path.join(tmp, kind) for kind in ("audio", "wav", "transcript", "summary",
+                                                                          "analysis")},
+                              store=store, blobs=BlobStore(os.path.join(tmp, "blobs"), store=store),
+                              archive=ArchiveStore(os.path.join(tmp, "archive")))
+    sync = DriveSync(LocalDirSource(remote), local_folder=local, store=store, workers=1)
+
+    report = sync.sync()
+    assert report["downloaded"] == 1, report
+    pending = sync.pending_for("tester")
+    assert [r["local_path"] for r in pending] == ["notatka.txt"], pending
+    sync.mark_processed("tester", pending[0])
+
+    # plik starszy niż limit - retencja go usuwa razem z wpisem w manifeście
+    path = os.path.join(local, "notatka.txt")
+    old = time.time() - 3 * 86400
+    os.utime(path, (old, old))
+    trimmed = RetentionManager(artifacts).trim_drive_cache(max_age_days=1, root=local)
+    assert trimmed["removed"] == 1, trimmed
+    assert not os.path.exists(path)
+    assert sync.manifest() == {}, sync.manifest()
+    assert sync.pending_for("tester") == []
+
+    report = sync.sync()
+    assert report["downloaded"] == 1, report
+    assert os.path.exists(path)
+    # ta sama wersja była już przetworzona
+    assert sync.pending_for("tester") == []
+    assert sync.pending_for("other")[0]["path"] == path
+
+    # ręcznie usunięty plik: wpis w manifeście został, a sync i tak go pobiera
+    os.remove(path)
+    assert sync.pending_for("other") == []
+    report = sync.sync()
+    assert report["downloaded"] == 1 and report["unchanged"] == 0, report
+    assert os.path.exists(path)
+
+    print("✅ drive trim: OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Groq/OpenAI chat-completions API.
+
+Usage:
+  python3 scripts/fake_llm_server.py --port 8081 --latency uniform:0.2,1.5 --error-rate 0.05
+  GROQ_BASE_URL=http://127.0.0.1:8081 GROQ_API_KEY=fake uvicorn main:app --workers 4
+
+Serves POST /openai/v1/chat/completions (Groq SDK path) and /v1/chat/completions
+(OpenAI SDK path) with deterministic replies from backends.FakeCompletion, so the
+real SDK, timeouts and circuit breaker are exercised without network access.
+Injected errors are returned as HTTP 503 (or 429 with --rate-limit-share).
+GET /stats returns call and error counts.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import BackendError, FakeCompletion
+from tokens import count_tokens
+
+
+def make_handler(backend, rate_limit_share):
+    rng = random.Random(0)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                return self._send(200, backend.stats())
+            self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._send(404, {"error": {"message": "not found"}})
+            try:
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except ValueError:
+                return self._send(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+            model = req.get("model", "fake")
+            messages = req.get("messages", [])
+            try:
+                text = backend.complete(model, messages, req.get("temperature", 1.0), req.get("max_tokens") or 1024)
+            except BackendError as e:
+                if rng.random() < rate_limit_share:
+                    return self._send(429, {"error": {"message": f"Rate limit reached: {e}", "type": "tokens"}})
+                return self._send(503, {"error": {"message": str(e), "type": "service_unavailable"}})
+
+            prompt_tokens = sum(count_tokens(m.get("content", "")) for m in messages)
+            completion_tokens = count_tokens(text)
+            self._send(200, {
+                "id": f"chatcmpl-fake-{int(time.time() * 1000)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8081)
+    p.add_argument('--latency', default='0', help='e.g. fixed:0.3, uniform:0.1,1.0, lognormal:-1,0.6')
+    p.add_argument('--error-rate', type=float, default=0.0)
+    p.add_argument('--rate-limit-share', type=float, default=0.0, help='share of injected errors returned as 429')
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args()
+
+    backend = FakeCompletion(args.latency, args.error_rate, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(backend, args.rate_limit_share))
+    print(f"Fake chat-completions API on http://{args.host}:{args.port} (latency={args.latency}, errors={args.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
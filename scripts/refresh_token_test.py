@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Regression test: refresh token rotation, reuse grace window and logout.
+
+Usage:
+  python3 scripts/refresh_token_test.py
+
+Runs against a temporary SQLite store (NOTEPSYCHE_DB) and checks that:
+ - a token rotated a moment ago raises RefreshTokenRotated (409, another tab won)
+ - a token revoked by logout is rejected (401), also inside the grace window
+ - the token rotated just before that logout is rejected too
+ - reuse of a rotated token after the grace window revokes the whole family
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["NOTEPSYCHE_DB"] = os.path.join(tempfile.mkdtemp(prefix="refresh_"), "test.db")
+
+import auth
+
+
+def expect_rotated(token):
+    try:
+        auth.rotate_refresh_token(token)
+    except auth.RefreshTokenRotated:
+        return
+    raise AssertionError("oczekiwano RefreshTokenRotated")
+
+
+def main():
+    auth.save_user("tester", "nie-hash")
+
+    # wyścig dwóch kart: druga dostaje 409, nie wylogowanie
+    first = auth.create_refresh_token("tester")
+    second = auth.rotate_refresh_token(first)["refresh_token"]
+    expect_rotated(first)
+
+    # wylogowanie, potem odświeżenie w oknie karencji -> 401
+    auth.revoke_refresh_token(second)
+    assert auth.rotate_refresh_token(second) is None
+    assert auth.rotate_refresh_token(first) is None
+
+    # ponowne użycie po oknie karencji unieważnia całą rodzinę
+    auth.REFRESH_REUSE_GRACE_S = 0
+    token = auth.create_refresh_token("tester")
+    current = auth.rotate_refresh_token(token)["refresh_token"]
+    assert auth.rotate_refresh_token(token) is None
+    assert auth.rotate_refresh_token(current) is None
+
+    print("✅ refresh tokens: OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
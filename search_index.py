@@ -0,0 +1,271 @@
+"""Full-text search over transcripts, summaries and analyses.
+
+An inverted index kept in the store (so every worker and both SQLite/Postgres
+see the same data) with BM25 ranking and per-user scoping:
+
+- search_docs:     one row per indexed artifact (user, kind, length in terms)
+- search_postings: (user, term, doc) -> term frequency, PK = lookup key
+- search_stats:    document count and total length per user (for BM25 avgdl)
+
+Terms are Polish-normalized: lowercase, diacritics folded (ł -> l, ż -> z ...),
+stopwords dropped and common inflection suffixes stripped, so "hazardzie",
+"hazardu" and "hazard" hit the same postings. Artifacts are indexed as they
+are written (ArtifactStore.on_write); `python search_index.py reindex`
+rebuilds everything from the artifacts table.
+
+Usage:
+  python search_index.py reindex
+  python search_index.py query <username> "słowa do znalezienia"
+"""
+import os
+import re
+import sys
+import math
+import html
+import argparse
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from storage import Store, get_store
+
+# === KONFIGURACJA ===
+BM25_K1 = float(os.environ.get("SEARCH_BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("SEARCH_BM25_B", "0.75"))
+SNIPPET_WORDS = int(os.environ.get("SEARCH_SNIPPET_WORDS", "30"))
+
+TEXT_KINDS = ("transcript", "summary", "analysis")
+
+SEARCH_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS search_docs (
+        doc_id BIGINT PRIMARY KEY,
+        username TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        length INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_search_docs_user ON search_docs (username)",
+    """CREATE TABLE IF NOT EXISTS search_postings (
+        username TEXT NOT NULL,
+        term TEXT NOT NULL,
+        doc_id BIGINT NOT NULL,
+        tf INTEGER NOT NULL,
+        PRIMARY KEY (username, term, doc_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_search_postings_doc ON search_postings (doc_id)",
+    """CREATE TABLE IF NOT EXISTS search_stats (
+        username TEXT PRIMARY KEY,
+        docs INTEGER NOT NULL,
+        total_length BIGINT NOT NULL
+    )""",
+]
+
+# === NORMALIZACJA (PL) ===
+_FOLD = str.maketrans("ąćęłńóśźż", "acelnoszz")
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# po złożeniu diakrytyków
+STOPWORDS = frozenset("""
+a aby ale am ani az bo by byc byl byla bylo byly bede bedzie chce co czy dla do go gdy gdzie
+i ich ile im ja jak jakby jako je jego jej jest jestem jeszcze juz ktora ktore ktory ma mam mi
+mnie moj moze mu na nad nam nas nic nie niz no o od on ona one oni ono po pod poza przez przy
+sa se sie ta tak tam te tego tej ten to tu ty tym u w we wiec wtedy z za ze zeby
+yyy yy eee mmm hmm
+""".split())
+
+# od najdłuższych; obcinamy tylko, gdy zostaje rdzeń >= 4 znaków
+_SUFFIXES = sorted(set("""
+owania owanie owaniu anie enie aniu eniu owac iwac ywac owal owala owali
+ami ach ego emu ymi imi ych ich iej owi owy owa owe acy ace zie
+ow om em ie ia ii ij ej ym im al ala ali alo
+a e i o u y
+""".split()), key=len, reverse=True)
+
+
+def fold(word: str) -> str:
+    word = word.lower().translate(_FOLD)
+    # pozostałe znaki diakrytyczne (np. z cytatów obcojęzycznych)
+    if not word.isascii():
+        word = "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+    return word
+
+
+def stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def normalize_token(token: str) -> Optional[str]:
+    word = fold(token)
+    if len(word) < 2 or word in STOPWORDS or word.isdigit():
+        return None
+    return stem(word)
+
+
+def analyze(text: str) -> List[str]:
+    """Text -> list of normalized terms (in order, with repeats)."""
+    return [t for t in (normalize_token(m) for m in _TOKEN_RE.findall(text or "")) if t]
+
+
+def make_snippet(text: str, terms: Set[str], words: int = SNIPPET_WORDS) -> str:
+    """HTML-escaped excerpt around the first match, matched words wrapped in <mark>."""
+    tokens = list(re.finditer(r"\S+", text or ""))
+    if not tokens:
+        return ""
+    hits = [i for i, m in enumerate(tokens) if any(normalize_token(w) in terms for w in _TOKEN_RE.findall(m.group()))]
+    start = max(0, (hits[0] if hits else 0) - words // 3)
+    end = min(len(tokens), start + words)
+    hit_set = set(hits)
+    parts = []
+    for i in range(start, end):
+        word = html.escape(tokens[i].group())
+        parts.append(f"<mark>{word}</mark>" if i in hit_set else word)
+    return ("… " if start > 0 else "") + " ".join(parts) + (" …" if end < len(tokens) else "")
+
+
+class SearchIndex:
+    def __init__(self, store: Optional[Store] = None):
+        self.store = store or get_store()
+        self.store.ensure_schema(SEARCH_SCHEMA)
+
+    # === INDEKSOWANIE ===
+    def add(self, doc_id: int, username: str, kind: str, text: str) -> int:
+        """(Re)index one document; returns the number of distinct terms."""
+        username = username.lower()
+        counts = Counter(analyze(text))
+        length = sum(counts.values())
+        with self.store.transaction(write=True) as cur:
+            self._remove(cur, doc_id)
+            cur.execute("INSERT INTO search_docs (doc_id, username, kind, length) VALUES (?, ?, ?, ?)",
+                        (doc_id, username, kind, length))
+            cur.executemany("INSERT INTO search_postings (username, term, doc_id, tf) VALUES (?, ?, ?, ?)",
+                            [(username, term, doc_id, tf) for term, tf in counts.items()])
+            cur.execute(
+                "INSERT INTO search_stats (username, docs, total_length) VALUES (?, 1, ?) "
+                "ON CONFLICT (username) DO UPDATE SET docs = search_stats.docs + 1, "
+                "total_length = search_stats.total_length + excluded.total_length",
+                (username, length),
+            )
+        return len(counts)
+
+    def _remove(self, cur, doc_id: int) -> None:
+        cur.execute("SELECT username, length FROM search_docs WHERE doc_id = ?", (doc_id,))
+        row = cur.fetchone()
+        if not row:
+            return
+        cur.execute("DELETE FROM search_postings WHERE doc_id = ?", (doc_id,))
+        cur.execute("DELETE FROM search_docs WHERE doc_id = ?", (doc_id,))
+        cur.execute("UPDATE search_stats SET docs = docs - 1, total_length = total_length - ? WHERE username = ?",
+                    (row["length"], row["username"]))
+
+    def remove(self, doc_id: int) -> None:
+        with self.store.transaction(write=True) as cur:
+            self._remove(cur, doc_id)
+
+    def remove_artifact(self, artifact: Dict[str, Any]) -> None:
+        """ArtifactStore.on_delete listener."""
+        if artifact["kind"] in TEXT_KINDS:
+            self.remove(artifact["id"])
+
+    def remove_user(self, username: str) -> None:
+        username = username.lower()
+        with self.store.transaction(write=True) as cur:
+            cur.execute("DELETE FROM search_postings WHERE username = ?", (username,))
+            cur.execute("DELETE FROM search_docs WHERE username = ?", (username,))
+            cur.execute("DELETE FROM search_stats WHERE username = ?", (username,))
+
+    def index_artifact(self, artifact: Dict[str, Any], data: Any) -> None:
+        """ArtifactStore.on_write listener: index text artifacts as they are written."""
+        if artifact["kind"] not in TEXT_KINDS:
+            return
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        self.add(artifact["id"], artifact["username"], artifact["kind"], data)
+
+    # === WYSZUKIWANIE ===
+    def search(self, username: str, query: str, limit: int = 10,
+               kinds: Optional[Iterable[str]] = None) -> List[Tuple[int, float]]:
+        """Return `(doc_id, bm25 score)` pairs, best first."""
+        username = username.lower()
+        terms = list(dict.fromkeys(analyze(query)))
+        if not terms:
+            return []
+        stats = self.store.execute("SELECT docs, total_length FROM search_stats WHERE username = ?", (username,))
+        if not stats or not stats[0]["docs"]:
+            return []
+        n_docs = stats[0]["docs"]
+        avgdl = max(1.0, stats[0]["total_length"] / n_docs)
+        kinds = set(kinds) if kinds else None
+
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self.store.execute(
+                "SELECT p.doc_id, p.tf, d.length, d.kind FROM search_postings p "
+                "JOIN search_docs d ON d.doc_id = p.doc_id WHERE p.username = ? AND p.term = ?",
+                (username, term),
+            )
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for p in postings:
+                if kinds and p["kind"] not in kinds:
+                    continue
+                tf = p["tf"]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * p["length"] / avgdl)
+                scores[p["doc_id"]] = scores.get(p["doc_id"], 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+
+    # === PRZEBUDOWA ===
+    def reindex(self, artifacts) -> int:
+        """Rebuild the whole index from the artifacts table; returns the number of documents."""
+        with self.store.transaction(write=True) as cur:
+            for table in ("search_postings", "search_docs", "search_stats"):
+                cur.execute(f"DELETE FROM {table}")
+        rows = self.store.execute(
+            f"SELECT * FROM artifacts WHERE kind IN ({', '.join('?' for _ in TEXT_KINDS)}) ORDER BY id", TEXT_KINDS
+        )
+        indexed = 0
+        for artifact in rows:
+            try:
+                self.add(artifact["id"], artifact["username"], artifact["kind"], artifacts.read_text(artifact))
+                indexed += 1
+            except Exception as e:
+                print(f"Warning: could not index {artifact['path']}: {e}")
+        return indexed
+
+
+def main():
+    p = argparse.ArgumentParser(description="Full-text search index")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("reindex")
+    q = sub.add_parser("query")
+    q.add_argument("username")
+    q.add_argument("query")
+    q.add_argument("--limit", type=int, default=10)
+    args = p.parse_args()
+
+    from artifacts import ArtifactStore
+    base = os.path.dirname(os.path.abspath(__file__))
+    notes, summaries = os.path.join(base, "notes_data"), os.path.join(base, "summary_data")
+    artifacts = ArtifactStore({"audio": notes, "wav": notes, "transcript": notes,
+                               "summary": summaries, "analysis": summaries})
+    index = SearchIndex(artifacts.store)
+
+    if args.cmd == "reindex":
+        print(f"Zaindeksowano {index.reindex(artifacts)} dokumentów")
+        return
+    terms = set(analyze(args.query))
+    for doc_id, score in index.search(args.username, args.query, args.limit):
+        rows = artifacts.store.execute("SELECT * FROM artifacts WHERE id = ?", (doc_id,))
+        if rows:
+            print(f"{score:6.2f}  [{rows[0]['kind']}] {rows[0]['name']}")
+            print("        " + make_snippet(artifacts.read_text(rows[0]), terms))
+
+
+__all__ = ["SearchIndex", "analyze", "make_snippet", "TEXT_KINDS"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
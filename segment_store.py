@@ -0,0 +1,278 @@
+"""Append-only segment files for small text blobs.
+
+Every recording produces several sub-kilobyte text artifacts (transcript,
+summary, analysis); as one file each they cost an inode and a directory
+entry apiece. Blobs up to SEGMENT_MAX_RECORD bytes are instead appended to
+`segments/seg-000001.dat` as length-prefixed records:
+
+    >I  payload length     >B  codec (0 raw, 1 zlib, 2 zstd)
+    >I  crc32 of payload   32s sha256 of the original content
+    payload
+
+The offset index lives in the `segment_records` table (digest -> segment,
+offset), so a read is one indexed lookup plus one pread. Each record is
+compressed on its own (zstd via `zstandard` from requirements.txt; zlib
+only where it is missing, raw if that doesn't help) to keep random access.
+Every process that reads the segments needs `zstandard` once any record
+was written with it. Deleted records are dropped
+from the index and reclaimed by `compact`, which rewrites live records of
+mostly-dead segments into the active one. The digest in every header lets
+`rebuild-index` recover the index from the files alone.
+
+Usage:
+  python segment_store.py pack [--dry-run]   # convert existing text artifacts/blob files
+  python segment_store.py compact
+  python segment_store.py rebuild-index
+  python segment_store.py stats
+"""
+import os
+import sys
+import zlib
+import struct
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Set
+
+try:
+    import zstandard as _zstd
+except Exception:
+    _zstd = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from storage import Store, get_store
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SEGMENT_DIR = os.environ.get("SEGMENT_DIR", os.path.join(BASE_DIR, "segments"))
+SEGMENT_MAX_BYTES = int(os.environ.get("SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+SEGMENT_MAX_RECORD = int(os.environ.get("SEGMENT_MAX_RECORD", str(64 * 1024)))
+# segmenty z mniejszym udziałem żywych danych są przepisywane przez compact
+SEGMENT_COMPACT_LIVE_RATIO = float(os.environ.get("SEGMENT_COMPACT_LIVE_RATIO", "0.5"))
+
+HEADER = struct.Struct(">IBI32s")
+CODEC_RAW, CODEC_ZLIB, CODEC_ZSTD = 0, 1, 2
+
+SEGMENT_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS segment_records (
+        digest TEXT PRIMARY KEY,
+        segment INTEGER NOT NULL,
+        record_offset BIGINT NOT NULL,
+        stored_size INTEGER NOT NULL,
+        raw_size INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_segment_records_segment ON segment_records (segment)",
+]
+
+
+def _compress(data: bytes):
+    if _zstd is not None:
+        packed, codec = _zstd.ZstdCompressor(level=9).compress(data), CODEC_ZSTD
+    else:
+        packed, codec = zlib.compress(data, 9), CODEC_ZLIB
+    return (packed, codec) if len(packed) < len(data) else (data, CODEC_RAW)
+
+
+def _decompress(payload: bytes, codec: int) -> bytes:
+    if codec == CODEC_RAW:
+        return payload
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(payload)
+    if codec == CODEC_ZSTD:
+        if _zstd is None:
+            raise RuntimeError("rekord skompresowany zstd, a pakiet zstandard nie jest zainstalowany")
+        return _zstd.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Nieznany kodek segmentu: {codec}")
+
+
+class SegmentStore:
+    def __init__(self, root: str = SEGMENT_DIR, store: Optional[Store] = None):
+        self.root = os.path.abspath(root)
+        self.store = store or get_store()
+        self.store.ensure_schema(SEGMENT_SCHEMA)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.root, f"seg-{segment:06d}.dat")
+
+    def _segments(self):
+        return sorted(int(n[4:10]) for n in os.listdir(self.root) if n.startswith("seg-") and n.endswith(".dat"))
+
+    @contextmanager
+    def _locked(self):
+        """One appender at a time across threads and worker processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, ".lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _active_segment(self) -> int:
+        segments = self._segments()
+        if not segments:
+            return 1
+        last = segments[-1]
+        return last + 1 if os.path.getsize(self._path(last)) >= SEGMENT_MAX_BYTES else last
+
+    def _append_locked(self, digest: str, data: bytes) -> Dict[str, Any]:
+        payload, codec = _compress(data)
+        segment = self._active_segment()
+        with open(self._path(segment), "ab") as f:
+            offset = f.tell()
+            f.write(HEADER.pack(len(payload), codec, zlib.crc32(payload), bytes.fromhex(digest)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        return {"digest": digest, "segment": segment, "record_offset": offset,
+                "stored_size": HEADER.size + len(payload), "raw_size": len(data)}
+
+    def _index(self, rec: Dict[str, Any]) -> None:
+        self.store.execute(
+            "INSERT INTO segment_records (digest, segment, record_offset, stored_size, raw_size) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (digest) DO UPDATE SET segment = excluded.segment, record_offset = excluded.record_offset, "
+            "stored_size = excluded.stored_size, raw_size = excluded.raw_size",
+            (rec["digest"], rec["segment"], rec["record_offset"], rec["stored_size"], rec["raw_size"]),
+        )
+
+    # === API ===
+    def contains(self, digest: str) -> bool:
+        return bool(self.store.execute("SELECT 1 FROM segment_records WHERE digest = ?", (digest,)))
+
+    def append(self, digest: str, data: bytes) -> None:
+        """Add `data` (whose sha256 is `digest`) unless it is already packed."""
+        with self._locked():
+            if self.contains(digest):
+                return
+            self._index(self._append_locked(digest, data))
+
+    def _read_record(self, row: Dict[str, Any]) -> bytes:
+        with open(self._path(row["segment"]), "rb") as f:
+            f.seek(row["record_offset"])
+            length, codec, crc, raw_digest = HEADER.unpack(f.read(HEADER.size))
+            payload = f.read(length)
+        if raw_digest.hex() != row["digest"] or zlib.crc32(payload) != crc:
+            raise IOError(f"Uszkodzony rekord {row['digest']} w segmencie {row['segment']}")
+        return _decompress(payload, codec)
+
+    def get(self, digest: str) -> Optional[bytes]:
+        for _ in range(2):
+            rows = self.store.execute("SELECT * FROM segment_records WHERE digest = ?", (digest,))
+            if not rows:
+                return None
+            try:
+                return self._read_record(rows[0])
+            except FileNotFoundError:
+                # compact właśnie przeniósł rekord - drugi odczyt indeksu widzi nowe miejsce
+                continue
+        return None
+
+    def delete(self, digest: str) -> None:
+        """Forget a record; its bytes are reclaimed by the next `compact`."""
+        self.store.execute("DELETE FROM segment_records WHERE digest = ?", (digest,))
+
+    def compact(self, live_ratio: float = SEGMENT_COMPACT_LIVE_RATIO) -> Dict[str, Any]:
+        """Rewrite live records of mostly-dead closed segments; returns bytes reclaimed."""
+        report = {"segments_rewritten": 0, "records_moved": 0, "bytes_reclaimed": 0}
+        with self._locked():
+            active = self._active_segment()
+            for segment in self._segments():
+                if segment >= active:
+                    continue
+                size = os.path.getsize(self._path(segment))
+                rows = self.store.execute("SELECT * FROM segment_records WHERE segment = ?", (segment,))
+                live = sum(r["stored_size"] for r in rows)
+                if size and live / size >= live_ratio:
+                    continue
+                for row in rows:
+                    self._index(self._append_locked(row["digest"], self._read_record(row)))
+                    report["records_moved"] += 1
+                os.remove(self._path(segment))
+                report["segments_rewritten"] += 1
+                report["bytes_reclaimed"] += size - live
+                active = self._active_segment()
+        return report
+
+    def rebuild_index(self, live: Optional[Set[str]] = None) -> int:
+        """Recreate segment_records by scanning the segment files (newest copy of a digest wins).
+
+        Deleted records are still in the files until compaction; pass the digests that are
+        still wanted as `live` to leave the rest out.
+        """
+        found = 0
+        with self._locked():
+            self.store.execute("DELETE FROM segment_records")
+            for segment in self._segments():
+                with open(self._path(segment), "rb") as f:
+                    while True:
+                        offset = f.tell()
+                        header = f.read(HEADER.size)
+                        if len(header) < HEADER.size:
+                            break
+                        length, codec, crc, raw_digest = HEADER.unpack(header)
+                        payload = f.read(length)
+                        if len(payload) < length or zlib.crc32(payload) != crc:
+                            print(f"Warning: urwany rekord w segmencie {segment} @ {offset}, pomijam resztę")
+                            break
+                        if live is not None and raw_digest.hex() not in live:
+                            continue
+                        self._index({"digest": raw_digest.hex(), "segment": segment, "record_offset": offset,
+                                     "stored_size": HEADER.size + length,
+                                     "raw_size": len(_decompress(payload, codec))})
+                        found += 1
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self._segments()
+        rows = self.store.execute(
+            "SELECT COUNT(*) AS records, COALESCE(SUM(stored_size), 0) AS stored, "
+            "COALESCE(SUM(raw_size), 0) AS raw FROM segment_records"
+        )[0]
+        on_disk = sum(os.path.getsize(self._path(s)) for s in segments)
+        return {"segments": len(segments), "records": int(rows["records"]), "raw_bytes": int(rows["raw"]),
+                "live_bytes": int(rows["stored"]), "file_bytes": on_disk, "dead_bytes": on_disk - int(rows["stored"]),
+                "codec": "zstd" if _zstd is not None else "zlib"}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Segment files for small text artifacts")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    pk = sub.add_parser("pack")
+    pk.add_argument("--dry-run", action="store_true")
+    sub.add_parser("compact")
+    sub.add_parser("rebuild-index")
+    sub.add_parser("stats")
+    args = p.parse_args()
+
+    from artifacts import ArtifactStore
+    notes, summaries = os.path.join(BASE_DIR, "notes_data"), os.path.join(BASE_DIR, "summary_data")
+    artifacts = ArtifactStore({"audio": notes, "wav": notes, "transcript": notes,
+                               "summary": summaries, "analysis": summaries})
+    segments = artifacts.blobs.segments
+
+    if args.cmd == "pack":
+        report = artifacts.pack_text_artifacts(dry_run=args.dry_run)
+        print(f"Spakowano {report['packed']} artefaktów, usunięto {report['files_removed']} plików "
+              f"({report['bytes_freed'] / 1024:.1f} KiB)" + (" (dry-run)" if args.dry_run else ""))
+    elif args.cmd == "compact":
+        print(segments.compact())
+    elif args.cmd == "rebuild-index":
+        live = {r["digest"] for r in artifacts.store.execute("SELECT digest FROM blobs")}
+        print(f"Odtworzono {segments.rebuild_index(live)} rekordów")
+    else:
+        print(segments.stats())
+
+
+__all__ = ["SegmentStore", "SEGMENT_MAX_RECORD"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
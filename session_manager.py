@@ -1,7 +1,19 @@
 import os
 import json
 import datetime
-from typing import Any, Dict, Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional
+
+from storage import Store, get_store
+
+try:
+    import fcntl  # blokada pliku przy dopisywaniu/kompakcji (POSIX)
+except ImportError:
+    fcntl = None
+
+# === KONFIGURACJA ===
+# po przekroczeniu tego rozmiaru logu łatek checkpoint jest kompaktowany do snapshotu
+CHECKPOINT_COMPACT_BYTES = int(os.environ.get("CHECKPOINT_COMPACT_BYTES", str(64 * 1024)))
 
 try:
     import langgraph as _langgraph  # optional integration
@@ -14,19 +26,21 @@ except Exception:
 class SessionManager:
     """Manage sessions and checkpoints.
 
-    - Stores per-session checkpoint JSON files in a `checkpoints_dir`.
-    - Keeps `sessions_metadata.json` with overview of sessions.
+    - Stores per-session checkpoints in a `checkpoints_dir` as a snapshot
+      (`<id>.json`, replaced atomically) plus an append-only log of patches
+      (`<id>.log.jsonl`). `update_checkpoint` appends only the changed keys;
+      `get_checkpoint` replays the log over the snapshot, and once the log
+      grows past CHECKPOINT_COMPACT_BYTES it is folded into a new snapshot.
+    - Keeps the overview of sessions in the `sessions` table of the store
+      (indexed, transactional; see `storage.py`).
     - If `langgraph` is available, exposes the module on `self.langgraph` for further use.
     """
 
-    def __init__(self, checkpoints_dir: Optional[str] = None):
+    def __init__(self, checkpoints_dir: Optional[str] = None, store: Optional[Store] = None):
         base = checkpoints_dir or os.path.join(os.path.dirname(__file__), "checkpoints")
         self.checkpoints_dir = os.path.abspath(base)
         os.makedirs(self.checkpoints_dir, exist_ok=True)
-        self.metadata_path = os.path.join(self.checkpoints_dir, "sessions_metadata.json")
-        if not os.path.exists(self.metadata_path):
-            with open(self.metadata_path, "w", encoding="utf-8") as f:
-                json.dump({}, f, indent=2, ensure_ascii=False)
+        self.store = store or get_store()
 
         self.langgraph = _langgraph if _HAS_LANGGRAPH else None
 
@@ -34,84 +48,153 @@ class SessionManager:
         safe = session_id.replace("/", "_")
         return os.path.join(self.checkpoints_dir, f"{safe}.json")
 
-    def _load_metadata(self) -> Dict[str, Any]:
+    def _log_path(self, session_id: str) -> str:
+        return self._session_path(session_id)[:-len(".json")] + ".log.jsonl"
+
+    @contextmanager
+    def _locked(self, session_id: str, shared: bool = False):
+        """Per-session lock so appends from other workers don't race a compaction.
+
+        Writers take it exclusively; readers take it shared, so a compaction
+        cannot swap the snapshot and drop the log between their two reads.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self._session_path(session_id) + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_snapshot(self, session_id: str, checkpoint: Dict[str, Any]) -> None:
+        # zapis do pliku tymczasowego + os.replace: czytelnik widzi stary albo nowy snapshot, nigdy połowę
+        path = self._session_path(session_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _read_snapshot(self, session_id: str) -> Dict[str, Any]:
+        path = self._session_path(session_id)
+        if not os.path.exists(path):
+            return {}
         try:
-            with open(self.metadata_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f) or {}
         except Exception:
             return {}
 
-    def _save_metadata(self, meta: Dict[str, Any]):
-        with open(self.metadata_path, "w", encoding="utf-8") as f:
-            json.dump(meta, f, indent=2, ensure_ascii=False)
+    def _replay(self, session_id: str, checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+        path = self._log_path(session_id)
+        if not os.path.exists(path):
+            return checkpoint
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # urwana ostatnia linia (przerwany zapis) - pomijamy
+                    continue
+                checkpoint.update(entry.get("set") or {})
+                for key in entry.get("unset") or ():
+                    checkpoint.pop(key, None)
+        return checkpoint
 
     def create_session(self, session_id: str, meta: Optional[Dict[str, Any]] = None) -> bool:
         """Create a new session record.
 
         Returns True if the session was newly created, False if it already existed.
+        "Newly created" only means the store had no row - a fresh or migrated
+        database reports every session as new - so it must never trigger
+        deleting files.
         """
-        meta = meta or {}
-        metadata = self._load_metadata()
-        if session_id in metadata:
+        if not self.store.create_session(session_id, meta or {}):
             return False
-        now = datetime.datetime.now().isoformat()
-        metadata[session_id] = {"created": now, "last_updated": now, "info": meta}
-        self._save_metadata(metadata)
         # create empty checkpoint file
-        path = self._session_path(session_id)
-        if not os.path.exists(path):
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump({}, f, indent=2, ensure_ascii=False)
+        if not os.path.exists(self._session_path(session_id)):
+            self._write_snapshot(session_id, {})
         return True
 
+    def get_session_info(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get_session(session_id)
+
     def list_sessions(self):
-        return list(self._load_metadata().keys())
+        return self.store.list_sessions()
 
     def load_session(self, session_id: str) -> Dict[str, Any]:
-        path = self._session_path(session_id)
-        if not os.path.exists(path):
-            return {}
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {}
+        with self._locked(session_id, shared=True):
+            return self._load_unlocked(session_id)
+
+    def _load_unlocked(self, session_id: str) -> Dict[str, Any]:
+        # tylko pod _locked: snapshot i log muszą pochodzić z tego samego stanu
+        return self._replay(session_id, self._read_snapshot(session_id))
 
     def save_checkpoint(self, session_id: str, checkpoint: Dict[str, Any]) -> None:
-        # ensure session exists
-        self.create_session(session_id)
+        """Replace the whole checkpoint (new snapshot, patch log discarded)."""
         # attach timestamp
         checkpoint_copy = dict(checkpoint)
         checkpoint_copy["last_saved_at"] = datetime.datetime.now().isoformat()
-        path = self._session_path(session_id)
         try:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(checkpoint_copy, f, indent=2, ensure_ascii=False)
+            with self._locked(session_id):
+                self._write_snapshot(session_id, checkpoint_copy)
+                if os.path.exists(self._log_path(session_id)):
+                    os.remove(self._log_path(session_id))
         except Exception:
             # best-effort write
             pass
 
-        # update metadata
-        metadata = self._load_metadata()
-        if session_id not in metadata:
-            metadata[session_id] = {"created": datetime.datetime.now().isoformat(), "info": {}}
-        metadata[session_id]["last_updated"] = datetime.datetime.now().isoformat()
-        self._save_metadata(metadata)
+        # upsert: tworzy sesję, jeśli jej nie było, i odświeża last_updated
+        self.store.touch_session(session_id)
+
+    def update_checkpoint(self, session_id: str, changes: Dict[str, Any], unset: Iterable[str] = ()) -> None:
+        """Record only what changed: one appended log line, O(size of the patch)."""
+        entry = {"set": dict(changes, last_saved_at=datetime.datetime.now().isoformat())}
+        unset = list(unset)
+        if unset:
+            entry["unset"] = unset
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            with self._locked(session_id):
+                # jeden write() z O_APPEND - linia nie przeplata się z zapisami innych procesów
+                fd = os.open(self._log_path(session_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                    size = os.fstat(fd).st_size
+                finally:
+                    os.close(fd)
+                if size > CHECKPOINT_COMPACT_BYTES:
+                    self._compact_locked(session_id)
+        except Exception as e:
+            print(f"Warning: could not append checkpoint patch for {session_id}: {e}")
+
+        self.store.touch_session(session_id)
+
+    def _compact_locked(self, session_id: str) -> None:
+        self._write_snapshot(session_id, self._load_unlocked(session_id))
+        os.remove(self._log_path(session_id))
+
+    def compact_checkpoint(self, session_id: str) -> None:
+        """Fold the patch log into the snapshot."""
+        with self._locked(session_id):
+            if os.path.exists(self._log_path(session_id)):
+                self._compact_locked(session_id)
 
     def get_checkpoint(self, session_id: str) -> Dict[str, Any]:
         return self.load_session(session_id)
 
     def delete_session(self, session_id: str) -> None:
-        metadata = self._load_metadata()
-        if session_id in metadata:
-            metadata.pop(session_id, None)
-            self._save_metadata(metadata)
-        path = self._session_path(session_id)
-        try:
-            if os.path.exists(path):
-                os.remove(path)
-        except Exception:
-            pass
+        self.store.delete_session(session_id)
+        for path in (self._session_path(session_id), self._log_path(session_id),
+                     self._session_path(session_id) + ".lock"):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception:
+                pass
 
 
 __all__ = ["SessionManager"]
@@ -30,7 +30,108 @@ document.addEventListener("DOMContentLoaded", function() {
     let audioChunks = [];
     let isRegistering = false;
     let authToken = localStorage.getItem('authToken');
+    let refreshToken = localStorage.getItem('refreshToken');
+    let authTokenExpiresAt = parseInt(localStorage.getItem('authTokenExpiresAt') || '0', 10);
     let loggedInUsername = localStorage.getItem('loggedInUsername');
+    let refreshTimer = null;
+    let refreshInFlight = null;
+    
+    // Tokens: access token (short) + rotating refresh token (long)
+    function storeTokens(data) {
+        authToken = data.access_token;
+        localStorage.setItem('authToken', authToken);
+        if (data.refresh_token) {
+            refreshToken = data.refresh_token;
+            localStorage.setItem('refreshToken', refreshToken);
+        }
+        const expiresIn = data.expires_in || 3600;
+        authTokenExpiresAt = Date.now() + expiresIn * 1000;
+        localStorage.setItem('authTokenExpiresAt', String(authTokenExpiresAt));
+        scheduleRefresh();
+    }
+    
+    function clearTokens() {
+        authToken = null;
+        refreshToken = null;
+        authTokenExpiresAt = 0;
+        localStorage.removeItem('authToken');
+        localStorage.removeItem('refreshToken');
+        localStorage.removeItem('authTokenExpiresAt');
+        localStorage.removeItem('loggedInUsername');
+        if (refreshTimer) clearTimeout(refreshTimer);
+    }
+    
+    // Silent refresh one minute before the access token expires
+    function scheduleRefresh() {
+        if (refreshTimer) clearTimeout(refreshTimer);
+        if (!refreshToken) return;
+        const delay = Math.max(0, authTokenExpiresAt - Date.now() - 60000);
+        refreshTimer = setTimeout(() => { refreshAccessToken(); }, delay);
+    }
+    
+    // Another tab may have rotated the shared refresh token first: take its tokens
+    function adoptStoredTokens(sentToken) {
+        const stored = localStorage.getItem('refreshToken');
+        if (!stored || stored === sentToken) return false;
+        refreshToken = stored;
+        authToken = localStorage.getItem('authToken');
+        authTokenExpiresAt = parseInt(localStorage.getItem('authTokenExpiresAt') || '0', 10);
+        scheduleRefresh();
+        return true;
+    }
+    
+    function refreshAccessToken() {
+        if (!refreshToken) return Promise.resolve(false);
+        if (refreshInFlight) return refreshInFlight;
+        const sentToken = refreshToken;
+        refreshInFlight = fetch('/token/refresh', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: sentToken })
+        })
+        .then(res => {
+            if (!res.ok) {
+                const err = new Error('Refresh failed: ' + res.status);
+                err.status = res.status;
+                throw err;
+            }
+            return res.json();
+        })
+        .then(data => {
+            storeTokens(data);
+            return true;
+        })
+        .catch(async err => {
+            if (adoptStoredTokens(sentToken)) return true;
+            // 409 = rotated moments ago by another tab; its tokens may not be stored yet
+            if (err.status === 409) {
+                await new Promise(resolve => setTimeout(resolve, 500));
+                return adoptStoredTokens(sentToken);
+            }
+            console.warn('Token refresh failed:', err);
+            // 401 = refresh token revoked/expired -> need a password login
+            if (err.status === 401) {
+                clearTokens();
+                loggedInUsername = null;
+                updateAuthUI();
+            }
+            return false;
+        })
+        .finally(() => { refreshInFlight = null; });
+        return refreshInFlight;
+    }
+    
+    // fetch with Bearer token; on 401 refresh once and retry
+    async function authFetch(url, options = {}) {
+        const withAuth = () => Object.assign({}, options, {
+            headers: Object.assign({}, options.headers || {}, { 'Authorization': `Bearer ${authToken}` })
+        });
+        let res = await fetch(url, withAuth());
+        if (res.status === 401 && refreshToken && await refreshAccessToken()) {
+            res = await fetch(url, withAuth());
+        }
+        return res;
+    }
     
     // Initialize: check if already logged in
     function updateAuthUI() {
@@ -50,6 +151,14 @@ document.addEventListener("DOMContentLoaded", function() {
     updateAuthUI();
     console.log('Auth UI updated');
     
+    if (refreshToken) {
+        if (!authToken || authTokenExpiresAt - Date.now() < 60000) {
+            refreshAccessToken();
+        } else {
+            scheduleRefresh();
+        }
+    }
+    
     // Auth modal handlers
     loginRegisterBtn.addEventListener('click', () => {
         console.log('LOGIN BUTTON CLICKED');
@@ -129,9 +238,8 @@ document.addEventListener("DOMContentLoaded", function() {
         })
         .then(data => {
             console.log('Success! Token:', data.access_token ? 'received' : 'missing');
-            authToken = data.access_token;
+            storeTokens(data);
             loggedInUsername = username;
-            localStorage.setItem('authToken', authToken);
             localStorage.setItem('loggedInUsername', username);
             authModal.classList.remove('show');
             updateAuthUI();
@@ -145,10 +253,16 @@ document.addEventListener("DOMContentLoaded", function() {
     
     logoutBtn.addEventListener('click', () => {
         console.log('LOGOUT BUTTON CLICKED');
-        authToken = null;
+        if (refreshToken) {
+            fetch('/logout', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh_token: refreshToken }),
+                keepalive: true
+            }).catch(() => {});
+        }
+        clearTokens();
         loggedInUsername = null;
-        localStorage.removeItem('authToken');
-        localStorage.removeItem('loggedInUsername');
         // Uncheck all analysis checkboxes
         const checkboxes = document.querySelectorAll('input[type="checkbox"]');
         checkboxes.forEach(checkbox => checkbox.checked = false);
@@ -192,20 +306,16 @@ document.addEventListener("DOMContentLoaded", function() {
 
                 try {
                     statusDiv.textContent = "📤 Wysyłanie nagrania...";
-                    const res = await fetch('/upload_audio', {
+                    const res = await authFetch('/upload_audio', {
                         method: 'POST',
-                        body: formData,
-                        headers: {
-                            'Authorization': `Bearer ${authToken}`
-                        }
+                        body: formData
                     });
 
                     if (!res.ok) {
                         statusDiv.textContent = `❌ Błąd wysyłki: ${res.status}`;
                         if (res.status === 401) {
-                            authToken = null;
-                            localStorage.removeItem('authToken');
-                            localStorage.removeItem('loggedInUsername');
+                            clearTokens();
+                            loggedInUsername = null;
                             updateAuthUI();
                         }
                         return;
@@ -219,7 +329,7 @@ document.addEventListener("DOMContentLoaded", function() {
                     const pollInterval = setInterval(async () => {
                         attempts++;
                         try {
-                            const checkRes = await fetch('/check_summary');
+                            const checkRes = await authFetch('/check_summary');
                             const checkData = await checkRes.json();
                             if (checkData.has_summary) {
                                 clearInterval(pollInterval);
@@ -254,7 +364,7 @@ document.addEventListener("DOMContentLoaded", function() {
     analyzeBtn.addEventListener('click', async () => {
         analysisFrame.textContent = "📊 Analizuję wszystkie notatki...";
         try {
-            const res = await fetch('/list_analyses_content');
+            const res = await authFetch('/list_analyses_content');
             if (!res.ok) throw new Error(`Status ${res.status}`);
             const data = await res.json();
             const text = data.latest_analysis || "Brak analiz do wyświetlenia";
@@ -264,15 +374,33 @@ document.addEventListener("DOMContentLoaded", function() {
         }
     });
     
+    // Analizy są per-użytkownik: strony HTML pobieramy z tokenem i podmieniamy dokument
+    async function showAuthedPage(url) {
+        if (!authToken) {
+            statusDiv.textContent = "❌ Zaloguj się, aby zobaczyć analizy";
+            return;
+        }
+        try {
+            const res = await authFetch(url);
+            if (!res.ok) throw new Error(`Status ${res.status}`);
+            const html = await res.text();
+            document.open();
+            document.write(html);
+            document.close();
+        } catch (err) {
+            statusDiv.textContent = `❌ Błąd ładowania: ${err}`;
+        }
+    }
+    
     // Navigation buttons
     lastAnalysisBtn.addEventListener('click', () => {
         console.log('LAST ANALYSIS BUTTON CLICKED');
-        window.location.href = '/last_analysis';
+        showAuthedPage('/last_analysis');
     });
     
     listAnalysesBtn.addEventListener('click', () => {
         console.log('LIST ANALYSES BUTTON CLICKED');
-        window.location.href = '/list_analyses';
+        showAuthedPage('/list_analyses');
     });
     
     console.log('=== All event listeners attached ===');
@@ -131,6 +131,10 @@ document.addEventListener("DOMContentLoaded", function() {
             loggedInUsername = username;
             localStorage.setItem('authToken', authToken);
             localStorage.setItem('loggedInUsername', username);
+            if (data.refresh_token) {
+                localStorage.setItem('refreshToken', data.refresh_token);
+                localStorage.setItem('authTokenExpiresAt', String(Date.now() + (data.expires_in || 3600) * 1000));
+            }
             authModal.classList.remove('show');
             updateAuthUI();
             statusDiv.textContent = isRegistering ? 'Successfully registered and logged in!' : 'Successfully logged in!';
@@ -147,20 +151,12 @@ document.addEventListener("DOMContentLoaded", function() {
         authToken = null;
         loggedInUsername = null;
         localStorage.removeItem('authToken');
+        localStorage.removeItem('refreshToken');
+        localStorage.removeItem('authTokenExpiresAt');
         localStorage.removeItem('loggedInUsername');
         updateAuthUI();
         statusDiv.textContent = 'Logged out';
     });
     
-    // Navigation buttons
-    const lastAnalysisBtn = document.getElementById('lastAnalysisBtn');
-    const listAnalysesBtn = document.getElementById('listAnalysesBtn');
-    
-    lastAnalysisBtn.addEventListener('click', function() {
-        window.location.href = '/last_analysis';
-    });
-    
-    listAnalysesBtn.addEventListener('click', function() {
-        window.location.href = '/list_analyses';
-    });
+    // Przyciski nawigacji obsługuje app.js (strony analiz wymagają tokenu w nagłówku)
 });
@@ -0,0 +1,439 @@
+"""Indexed, transactional store for users, processed files and session metadata.
+
+Replaces the users.json / processed.json / sessions_metadata.json files that
+were fully re-read and rewritten on every request. Locally this is SQLite in
+WAL mode (NOTEPSYCHE_DB, default notepsyche.db next to the app); when
+DATABASE_URL points at Postgres (docker-compose `db` service) the same queries
+run there through psycopg.
+
+Processed files live in an append-only ledger (`processed_ledger`); request
+paths read it through the in-memory index in processed_index.py.
+
+SQL is written once with `?` placeholders and adapted per backend. Other
+modules add their own tables with `Store.ensure_schema`.
+
+Existing JSON files are imported with `python migrate_json.py`.
+"""
+import os
+import json
+import sqlite3
+import datetime
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SQLITE_PATH = os.path.join(BASE_DIR, "notepsyche.db")
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        hashed_password TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )""",
+    # tabela sprzed ledgera - czytana tylko przy jednorazowym imporcie do processed_ledger
+    """CREATE TABLE IF NOT EXISTS processed (
+        digest TEXT PRIMARY KEY,
+        orig TEXT,
+        wav TEXT,
+        transcript TEXT,
+        processed_at TEXT NOT NULL,
+        info TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_processed_at ON processed (processed_at)",
+    # liczniki wersji danych - pozwalają cache'om w procesach wykryć zmiany z innych workerów
+    """CREATE TABLE IF NOT EXISTS store_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )""",
+    # refresh tokeny: przechowujemy tylko sha256 tokenu; family_id łączy kolejne rotacje.
+    # username zapisany tak, jak przy logowaniu (sub w JWT = id sesji, rozróżnia wielkość liter)
+    """CREATE TABLE IF NOT EXISTS refresh_tokens (
+        token_hash TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        family_id TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        revoked_at TEXT,
+        replaced_by TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_refresh_username ON refresh_tokens (username)",
+    "CREATE INDEX IF NOT EXISTS idx_refresh_family ON refresh_tokens (family_id)",
+    """CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        created TEXT NOT NULL,
+        last_updated TEXT NOT NULL,
+        info TEXT
+    )""",
+]
+
+
+# ledger przetworzonych plików: tylko INSERT; seq rośnie monotonicznie, więc procesy
+# mogą doczytywać wyłącznie nowe wpisy (seq > ostatnio widziany). op = 'put' | 'clear'
+LEDGER_SCHEMA = {
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS processed_ledger (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            digest TEXT,
+            record TEXT
+        )""",
+    ],
+    "postgres": [
+        """CREATE TABLE IF NOT EXISTS processed_ledger (
+            seq BIGSERIAL PRIMARY KEY,
+            op TEXT NOT NULL,
+            digest TEXT,
+            record TEXT
+        )""",
+    ],
+}
+LEDGER_INDEXES = ["CREATE INDEX IF NOT EXISTS idx_ledger_digest ON processed_ledger (digest, seq)"]
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat()
+
+
+def _is_postgres(url: Optional[str]) -> bool:
+    return bool(url) and url.split(":", 1)[0] in ("postgres", "postgresql")
+
+
+class Store:
+    def __init__(self, url: Optional[str] = None):
+        url = url if url is not None else os.environ.get("DATABASE_URL")
+        self.kind = "postgres" if _is_postgres(url) else "sqlite"
+        if self.kind == "postgres":
+            self.url = url
+        elif url and url.startswith("sqlite:///"):
+            self.url = url[len("sqlite:///"):]
+        else:
+            self.url = os.environ.get("NOTEPSYCHE_DB", DEFAULT_SQLITE_PATH)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._applied_schema = set()
+        self.ensure_schema(SCHEMA)
+        self.ensure_schema(LEDGER_SCHEMA[self.kind] + LEDGER_INDEXES)
+        self._import_legacy_processed()
+
+    # === POŁĄCZENIA ===
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        if self.kind == "postgres":
+            import psycopg
+            conn = psycopg.connect(self.url)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.url)), exist_ok=True)
+            # isolation_level=None: transakcje otwieramy sami (BEGIN IMMEDIATE dla zapisów)
+            conn = sqlite3.connect(self.url, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+        self._local.conn = conn
+        return conn
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace("?", "%s") if self.kind == "postgres" else sql
+
+    @contextmanager
+    def transaction(self, write: bool = False):
+        """Yield a cursor inside a transaction; commit on success, roll back on error."""
+        conn = self._connect()
+        if self.kind == "sqlite":
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            cur = _Cursor(self, conn.cursor())
+        else:
+            cur = _Cursor(self, conn.cursor())
+        try:
+            yield cur
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+        with self.transaction(write=not sql.lstrip().upper().startswith("SELECT")) as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def ensure_schema(self, statements: Iterable[str]) -> None:
+        statements = [s for s in statements if s not in self._applied_schema]
+        if not statements:
+            return
+        with self._schema_lock:
+            with self.transaction(write=True) as cur:
+                for stmt in statements:
+                    cur.execute(stmt)
+            self._applied_schema.update(statements)
+
+    def ensure_column(self, table: str, column: str, decl: str) -> None:
+        """Add `column` to a table created by an older version of the schema."""
+        if self.kind == "postgres":
+            self.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {decl}")
+            return
+        with self.transaction(write=True) as cur:
+            cur.execute(f"PRAGMA table_info({table})")
+            if column not in {r["name"] for r in cur.fetchall()}:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    # === WERSJE ===
+    def bump_version(self, cur: "_Cursor", name: str) -> None:
+        """Increment a version counter inside the caller's write transaction."""
+        cur.execute(
+            "INSERT INTO store_versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET version = store_versions.version + 1",
+            (name,),
+        )
+
+    def get_version(self, name: str) -> int:
+        rows = self.execute("SELECT version FROM store_versions WHERE name = ?", (name,))
+        return int(rows[0]["version"]) if rows else 0
+
+    # === UŻYTKOWNICY ===
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        rows = self.execute("SELECT username, hashed_password, created_at FROM users WHERE username = ?", (username.lower(),))
+        return rows[0] if rows else None
+
+    def save_user(self, username: str, hashed_password: str) -> None:
+        with self.transaction(write=True) as cur:
+            cur.execute(
+                "INSERT INTO users (username, hashed_password, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET hashed_password = excluded.hashed_password",
+                (username.lower(), hashed_password, _now()),
+            )
+            self.bump_version(cur, "users")
+
+    def create_user(self, username: str, hashed_password: str) -> bool:
+        """Insert a user; returns False if the name is taken (atomic, no read-then-write race)."""
+        with self.transaction(write=True) as cur:
+            cur.execute(
+                "INSERT INTO users (username, hashed_password, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (username) DO NOTHING",
+                (username.lower(), hashed_password, _now()),
+            )
+            created = cur.rowcount == 1
+            if created:
+                self.bump_version(cur, "users")
+            return created
+
+    def delete_user(self, username: str) -> None:
+        with self.transaction(write=True) as cur:
+            cur.execute("DELETE FROM users WHERE username = ?", (username.lower(),))
+            self.bump_version(cur, "users")
+            cur.execute("DELETE FROM refresh_tokens WHERE LOWER(username) = ?", (username.lower(),))
+
+    # === REFRESH TOKENY ===
+    def add_refresh_token(self, token_hash: str, username: str, family_id: str, expires_at: str) -> None:
+        self.execute(
+            "INSERT INTO refresh_tokens (token_hash, username, family_id, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (token_hash, username, family_id, _now(), expires_at),
+        )
+
+    def get_refresh_token(self, token_hash: str) -> Optional[Dict[str, Any]]:
+        rows = self.execute("SELECT * FROM refresh_tokens WHERE token_hash = ?", (token_hash,))
+        return rows[0] if rows else None
+
+    def rotate_refresh_token(self, old_hash: str, new_hash: str, expires_at: str) -> Optional[Dict[str, Any]]:
+        """Atomically revoke `old_hash` and issue `new_hash` in the same family.
+
+        Returns the old token row on success, None if it was unknown, expired or
+        already used (the caller treats reuse as theft and revokes the family).
+        """
+        now = _now()
+        with self.transaction(write=True) as cur:
+            row = cur.execute("SELECT * FROM refresh_tokens WHERE token_hash = ?", (old_hash,)).fetchone()
+            if not row or row["revoked_at"] or row["expires_at"] <= now:
+                return None
+            cur.execute(
+                "UPDATE refresh_tokens SET revoked_at = ?, replaced_by = ? WHERE token_hash = ? AND revoked_at IS NULL",
+                (now, new_hash, old_hash),
+            )
+            if cur.rowcount != 1:
+                return None
+            cur.execute(
+                "INSERT INTO refresh_tokens (token_hash, username, family_id, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (new_hash, row["username"], row["family_id"], now, expires_at),
+            )
+            return row
+
+    def revoke_refresh_family(self, family_id: str) -> int:
+        with self.transaction(write=True) as cur:
+            cur.execute("UPDATE refresh_tokens SET revoked_at = ? WHERE family_id = ? AND revoked_at IS NULL", (_now(), family_id))
+            return cur.rowcount
+
+    def revoke_user_refresh_tokens(self, username: str) -> int:
+        with self.transaction(write=True) as cur:
+            cur.execute("UPDATE refresh_tokens SET revoked_at = ? WHERE LOWER(username) = ? AND revoked_at IS NULL", (_now(), username.lower()))
+            return cur.rowcount
+
+    def purge_refresh_tokens(self, older_than: str) -> int:
+        """Delete tokens that expired before `older_than` (ISO timestamp)."""
+        with self.transaction(write=True) as cur:
+            cur.execute("DELETE FROM refresh_tokens WHERE expires_at < ?", (older_than,))
+            return cur.rowcount
+
+    # === PRZETWORZONE PLIKI (ledger) ===
+    def _import_legacy_processed(self) -> None:
+        """Copy rows of the old `processed` table into an empty ledger (once)."""
+        with self.transaction(write=True) as cur:
+            cur.execute("SELECT seq FROM processed_ledger LIMIT 1")
+            if cur.fetchone():
+                return
+            cur.execute("SELECT * FROM processed ORDER BY processed_at")
+            rows = cur.fetchall()
+            if not rows:
+                return
+            cur.executemany(
+                "INSERT INTO processed_ledger (op, digest, record) VALUES ('put', ?, ?)",
+                [(r["digest"], json.dumps(_processed_record(r), ensure_ascii=False)) for r in rows],
+            )
+        print(f"Zaimportowano {len(rows)} wpisów processed do ledgera")
+
+    def get_processed(self, digest: str) -> Optional[Dict[str, Any]]:
+        rows = self.execute(
+            "SELECT op, record FROM processed_ledger WHERE digest = ? ORDER BY seq DESC LIMIT 1", (digest,)
+        )
+        return _ledger_record(rows[0]) if rows else None
+
+    def put_processed(self, digest: str, record: Dict[str, Any]) -> int:
+        """Append a record for `digest` to the ledger; returns its sequence number."""
+        record = dict(record)
+        record.setdefault("processed_at", _now())
+        rows = self.execute(
+            "INSERT INTO processed_ledger (op, digest, record) VALUES ('put', ?, ?) RETURNING seq",
+            (digest, json.dumps(record, ensure_ascii=False)),
+        )
+        return int(rows[0]["seq"])
+
+    def processed_since(self, seq: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Ledger entries with sequence number > `seq`, oldest first."""
+        sql = "SELECT seq, op, digest, record FROM processed_ledger WHERE seq > ? ORDER BY seq"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(r, record=_ledger_record(r)) for r in self.execute(sql, (seq,))]
+
+    def all_processed(self) -> Dict[str, Dict[str, Any]]:
+        """Replay the whole ledger; prefer `processed_index.get_processed_index()` in request paths."""
+        result: Dict[str, Dict[str, Any]] = {}
+        for entry in self.processed_since(0):
+            if entry["op"] == "clear":
+                result.clear()
+            else:
+                result[entry["digest"]] = entry["record"]
+        return result
+
+    def clear_processed(self) -> None:
+        # stare wpisy kasujemy, a znacznik 'clear' mówi indeksom w innych procesach, by się wyzerowały
+        with self.transaction(write=True) as cur:
+            cur.execute("DELETE FROM processed_ledger")
+            cur.execute("DELETE FROM processed")
+            cur.execute("INSERT INTO processed_ledger (op) VALUES ('clear')")
+
+    # === SESJE ===
+    def create_session(self, session_id: str, info: Optional[Dict[str, Any]] = None) -> bool:
+        """Insert a session row; returns True only for the call that created it."""
+        now = _now()
+        with self.transaction(write=True) as cur:
+            cur.execute(
+                "INSERT INTO sessions (session_id, created, last_updated, info) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (session_id) DO NOTHING",
+                (session_id, now, now, json.dumps(info or {}, ensure_ascii=False)),
+            )
+            return cur.rowcount == 1
+
+    def touch_session(self, session_id: str) -> None:
+        now = _now()
+        self.execute(
+            "INSERT INTO sessions (session_id, created, last_updated, info) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET last_updated = excluded.last_updated",
+            (session_id, now, now, "{}"),
+        )
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        rows = self.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+        return _session_record(rows[0]) if rows else None
+
+    def list_sessions(self) -> List[str]:
+        return [r["session_id"] for r in self.execute("SELECT session_id FROM sessions ORDER BY created")]
+
+    def delete_session(self, session_id: str) -> None:
+        self.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+class _Cursor:
+    """Thin cursor wrapper: adapts placeholders and returns rows as dicts."""
+
+    def __init__(self, store: Store, cur):
+        self._store = store
+        self._cur = cur
+
+    def execute(self, sql: str, params: Iterable[Any] = ()):
+        self._cur.execute(self._store._sql(sql), tuple(params))
+        return self
+
+    def executemany(self, sql: str, seq):
+        self._cur.executemany(self._store._sql(sql), [tuple(p) for p in seq])
+        return self
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        if self._cur.description is None:
+            return []
+        cols = [d[0] for d in self._cur.description]
+        return [dict(zip(cols, row)) for row in self._cur.fetchall()]
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        if self._cur.description is None:
+            return None
+        row = self._cur.fetchone()
+        return dict(zip([d[0] for d in self._cur.description], row)) if row else None
+
+
+def _processed_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    record = {k: row.get(k) for k in ("orig", "wav", "transcript", "processed_at")}
+    try:
+        record.update(json.loads(row.get("info") or "{}"))
+    except ValueError:
+        pass
+    return record
+
+
+def _ledger_record(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if row.get("op") != "put":
+        return None
+    try:
+        return json.loads(row.get("record") or "{}")
+    except ValueError:
+        return {}
+
+
+def _session_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        info = json.loads(row.get("info") or "{}")
+    except ValueError:
+        info = {}
+    return {"created": row["created"], "last_updated": row["last_updated"], "info": info}
+
+
+_store: Optional[Store] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Store:
+    """Process-wide store, created lazily so DATABASE_URL from .env is already loaded."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = Store()
+    return _store
+
+
+__all__ = ["Store", "get_store", "SCHEMA"]
@@ -1,104 +1,250 @@
 import os
+import sys
 import datetime
 import time
 import random
-from groq import Groq
-import vosk
-import wave
-import json
-from pydub import AudioSegment
+import hashlib
+import argparse
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Union
+from audio_policy import decode_for_asr
+from prompts import get_template
+from storage import get_store
+from tokens import count_tokens
+from backends import BackendError, get_completion_backend, get_transcriber
+from llm_client import CircuitOpenError, Deadline, DeadlineExceeded, chat_completion, classify_error, groq_breaker
 
 # === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 NOTES_FOLDER = "notes_data"
 SUMMARY_FOLDER = "summary_data"
 os.makedirs(SUMMARY_FOLDER, exist_ok=True)
 
-MODEL_PATH = "/home/przemek/note_app/vosk-model-small-pl-0.22"
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"Nie znaleziono modelu Vosk w {MODEL_PATH}")
-vosk_model = vosk.Model(MODEL_PATH)
-print("Model Vosk załadowany poprawnie!")
-
+MODEL_PATH = os.environ.get("VOSK_MODEL_PATH", os.path.join(BASE_DIR, "vosk-model-small-pl-0.22"))
 MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
 # Opcjonalny fallback model (mniejszy) jeśli masz go w środowisku
 FALLBACK_MODEL = os.environ.get("GROQ_FALLBACK_MODEL")
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise SystemExit("Brak GROQ_API_KEY w środowisku. Ustaw: export GROQ_API_KEY=...")
-client = Groq(api_key=GROQ_API_KEY)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    llm_backend = get_completion_backend()
+except BackendError as e:
+    raise SystemExit(f"{e}. Ustaw: export GROQ_API_KEY=... / VOSK_MODEL_PATH=... albo ASR_BACKEND/LLM_BACKEND=fake")
+# budżet czasu całego przebiegu (wszystkie chunki + finalne podsumowanie)
+BATCH_DEADLINE_S = float(os.environ.get("BATCH_DEADLINE_S", "1800"))
+# procesy do dekodowania i transkrypcji audio; 0 = w bieżącym procesie
+NOTES_WORKERS = int(os.environ.get("NOTES_WORKERS", str(min(4, os.cpu_count() or 1))))
+NOTE_AUDIO_EXTS = tuple(e.strip() for e in os.environ.get("NOTE_AUDIO_EXTS", ".m4a").split(",") if e.strip())
+# ~15000 znaków dawnego chunk_text
+CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", "3500"))
+
+# tryb przyrostowy: foldery wejściowe (bez duplikatów - notatki liczone po hashu treści)
+SUMMARY_INPUT_FOLDERS = [f.strip() for f in os.environ.get(
+    "SUMMARY_INPUT_FOLDERS", f"{NOTES_FOLDER},{os.environ.get('DRIVE_NOTES_DIR', 'drive_notes')}").split(",") if f.strip()]
+# ile nowych wejść scala jeden przebieg przyrostowy (reszta w kolejnych); 0 = bez limitu
+SUMMARY_MAX_INPUTS_PER_RUN = int(os.environ.get("SUMMARY_MAX_INPUTS_PER_RUN", "50"))
+# konto, którego transkrypcje z aplikacji (indeks artefaktów) też wchodzą do podsumowania
+NOTES_OWNER = os.environ.get("NOTES_OWNER", os.environ.get("SESSION_ID", "default"))
+
+SUMMARY_MANIFEST_SCHEMA = {
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS summary_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            summary_file TEXT NOT NULL,
+            inputs INTEGER NOT NULL,
+            summary TEXT NOT NULL
+        )""",
+    ],
+    "postgres": [
+        """CREATE TABLE IF NOT EXISTS summary_runs (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            summary_file TEXT NOT NULL,
+            inputs INTEGER NOT NULL,
+            summary TEXT NOT NULL
+        )""",
+    ],
+}
+SUMMARY_INPUTS_SCHEMA = [
+    # wejście (po sha256 treści) pokryte przez przebieg run_id
+    """CREATE TABLE IF NOT EXISTS summary_inputs (
+        digest TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        run_id BIGINT NOT NULL,
+        covered_at TEXT NOT NULL
+    )""",
+]
+
+TRANSCRIPT_CACHE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS transcript_cache (
+        digest TEXT PRIMARY KEY,
+        text TEXT NOT NULL,
+        transcribed_at TEXT NOT NULL
+    )""",
+]
 
 # === UTILITY ===
-def convert_m4a_to_wav(m4a_path):
-    wav_path = m4a_path.rsplit(".", 1)[0] + ".wav"
-    audio = AudioSegment.from_file(m4a_path, format="m4a")
-    audio.export(wav_path, format="wav")
-    return wav_path
+# model ASR ładowany leniwie, osobno w każdym procesie (workery puli - przez initializer)
+_transcriber = None
+
+
+def _load_transcriber():
+    global _transcriber
+    if _transcriber is None:
+        _transcriber = get_transcriber(MODEL_PATH)
+        print(f"Backend ASR załadowany poprawnie: {_transcriber.name} (pid {os.getpid()})")
+    return _transcriber
+
+
+def _init_worker():
+    # worker nie używa modelu odziedziczonego po rodzicu - ładuje własny
+    global _transcriber
+    _transcriber = None
+    _load_transcriber()
+
 
 def transcribe_audio(audio_path):
-    wf = wave.open(audio_path, "rb")
-    rec = vosk.KaldiRecognizer(vosk_model, wf.getframerate())
-    result_text = ""
-    while True:
-        data = wf.readframes(4000)
-        if len(data) == 0:
-            break
-        if rec.AcceptWaveform(data):
-            res = json.loads(rec.Result())
-            result_text += " " + res.get("text", "")
-    res = json.loads(rec.FinalResult())
-    result_text += " " + res.get("text", "")
-    wf.close()
-    return result_text.strip()
+    # dekodowanie w pamięci - obok oryginału nie zostaje pełnowymiarowy WAV
+    return _load_transcriber().transcribe(decode_for_asr(audio_path))
 
-def read_all_notes(folder):
-    all_notes = ""
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class TranscriptCache:
+    """Transcripts of note audio by sha256, so unchanged recordings are never transcribed twice."""
+
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        self.store.ensure_schema(TRANSCRIPT_CACHE_SCHEMA)
+
+    def get(self, digest: str) -> Optional[str]:
+        rows = self.store.execute("SELECT text FROM transcript_cache WHERE digest = ?", (digest,))
+        return rows[0]["text"] if rows else None
+
+    def put(self, digest: str, text: str) -> None:
+        self.store.execute(
+            "INSERT INTO transcript_cache (digest, text, transcribed_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (digest) DO UPDATE SET text = excluded.text, transcribed_at = excluded.transcribed_at",
+            (digest, text, datetime.datetime.now().isoformat()),
+        )
+
+def iter_notes(folder: str, workers: int = NOTES_WORKERS, cache: Optional[TranscriptCache] = None,
+               skip: Optional[Set[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Leniwie zwraca notatki z folderu (w kolejności nazw) jako {"name", "kind", "text", "digest"}.
+    Pliki są hashowane i audio bez transkrypcji w cache trafia do puli procesów w ograniczonym
+    oknie (2 x workers notatek naprzód), więc transkrypcja kolejnych nagrań trwa, gdy
+    wcześniejsze notatki są już przetwarzane dalej, a duży folder nie trafia do kolejki naraz.
+    Pliki, których sha256 jest w `skip`, są pomijane (nawet nie transkrybowane).
+    """
     if not os.path.isdir(folder):
-        return all_notes
+        return
+    cache = cache or TranscriptCache()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) if workers > 0 else None
+    names = iter(sorted(os.listdir(folder)))
 
-    for fname in sorted(os.listdir(folder)):
-        fpath = os.path.join(folder, fname)
-        if not os.path.isfile(fpath):
-            continue
+    def next_entry():
+        for fname in names:
+            fpath = os.path.join(folder, fname)
+            if not os.path.isfile(fpath):
+                continue
+            if fname.lower().endswith(".txt"):
+                digest = file_digest(fpath)
+                if not skip or digest not in skip:
+                    return fname, "txt", fpath, digest, None
+            elif fname.lower().endswith(NOTE_AUDIO_EXTS):
+                digest = file_digest(fpath)
+                if skip and digest in skip:
+                    continue
+                cached = cache.get(digest)
+                pending = None
+                if cached is None and pool is not None:
+                    pending = pool.submit(transcribe_audio, fpath)
+                return fname, "audio", fpath, digest, cached if cached is not None else pending
+        return None
+
+    window: deque = deque()
 
-        if fname.lower().endswith(".txt"):
-            with open(fpath, "r", encoding="utf-8") as fh:
-                txt = fh.read().strip()
+    def fill():
+        while len(window) < max(1, workers) * 2:
+            entry = next_entry()
+            if entry is None:
+                return
+            window.append(entry)
+
+    try:
+        fill()
+        while window:
+            fname, kind, fpath, digest, result = window.popleft()
+            fill()
+            if kind == "txt":
+                with open(fpath, "r", encoding="utf-8") as fh:
+                    txt = fh.read().strip()
                 if txt:
-                    all_notes += f"\n---\n{fname} (txt):\n{txt}\n"
-        elif fname.lower().endswith(".m4a"):
+                    yield {"name": fname, "kind": kind, "text": txt, "digest": digest}
+                continue
             try:
-                wav_path = convert_m4a_to_wav(fpath)
-                txt = transcribe_audio(wav_path)
-                all_notes += f"\n---\n{fname} (audio):\n{txt}\n"
+                if isinstance(result, str):
+                    txt = result
+                else:
+                    txt = result.result() if result is not None else transcribe_audio(fpath)
+                    cache.put(digest, txt)
             except Exception as e:
                 print(f"Błąd przy przetwarzaniu {fname}: {e}")
-    return all_notes
+                continue
+            yield {"name": fname, "kind": kind, "text": txt, "digest": digest}
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
 
-def extract_choice_text(response):
-    try:
-        choice = response.choices[0]
-    except Exception:
-        return str(response)
-    msg = getattr(choice, "message", None)
-    if msg is None:
-        try:
-            msg = choice.get("message") if isinstance(choice, dict) else None
-        except Exception:
-            msg = None
-    if isinstance(msg, dict):
-        if "content" in msg:
-            content = msg["content"]
-            if isinstance(content, dict):
-                return content.get("text") or (content.get("parts") and " ".join(content.get("parts"))) or str(content)
-            return content
-    else:
-        text = getattr(msg, "content", None) or getattr(msg, "text", None)
-        if text is not None:
-            return text
-    text = getattr(choice, "text", None) or getattr(choice, "message_content", None)
-    if text:
-        return text
-    return str(response)
+def iter_transcripts(username: str, skip: Optional[Set[str]] = None, artifacts=None,
+                     page: int = 200) -> Iterator[Dict[str, Any]]:
+    """
+    Transkrypcje użytkownika z indeksu artefaktów (nagrania z aplikacji i importu),
+    od najstarszej, w tym samym formacie co iter_notes. Czytane porcjami; treść
+    tylko tych, których sha256 nie ma w `skip`.
+    """
+    if artifacts is None:
+        from analyze_notes import open_artifacts
+        artifacts = open_artifacts()
+    last_id = 0
+    while True:
+        rows = artifacts.store.execute(
+            "SELECT * FROM artifacts WHERE username = ? AND kind = 'transcript' AND size > 0 AND id > ? "
+            "ORDER BY id LIMIT ?", (username.lower(), last_id, page))
+        if not rows:
+            return
+        for row in rows:
+            if skip and row["digest"] in skip:
+                continue
+            try:
+                txt = artifacts.read_text(row)
+            except Exception as e:
+                print(f"Błąd przy odczycie transkrypcji {row['name']}: {e}")
+                continue
+            digest = row["digest"] or hashlib.sha256(txt.encode("utf-8")).hexdigest()
+            if txt.strip() and not (skip and digest in skip):
+                yield {"name": row["name"], "kind": "transcript", "text": txt.strip(), "digest": digest}
+        last_id = rows[-1]["id"]
+
+def format_note(note: Dict[str, Any]) -> str:
+    return f"\n---\n{note['name']} ({note['kind']}):\n{note['text']}\n"
+
+def read_all_notes(folder):
+    """Cały korpus jako jeden tekst (zgodność wsteczna; strumieniowo: iter_notes + chunk_notes)."""
+    return "".join(format_note(n) for n in iter_notes(folder))
 
 # === NOWE: dzielenie na kawałki + hierarchiczne podsumowanie ===
 def chunk_text(text, max_chars=15000):
@@ -120,74 +266,239 @@ def chunk_text(text, max_chars=15000):
         start = end
     return [c for c in chunks if c]
 
-def summarize_chunk(text_chunk, model=MODEL, max_tokens=800):
+def chunk_notes(notes: Iterable[Dict[str, Any]], max_tokens: int = CHUNK_TOKENS) -> Iterator[str]:
+    """
+    Skleja strumień notatek w kawałki do max_tokens tokenów, bez budowania całego korpusu.
+    Notatka większa niż limit jest dzielona przez chunk_text.
+    """
+    buf, size = [], 0
+    for note in notes:
+        block = format_note(note)
+        tokens = count_tokens(block)
+        if buf and size + tokens > max_tokens:
+            yield "".join(buf).strip()
+            buf, size = [], 0
+        if tokens > max_tokens:
+            # ~4 znaki na token, jak w count_tokens bez tiktoken
+            yield from chunk_text(block, max_chars=max_tokens * 4)
+            continue
+        buf.append(block)
+        size += tokens
+    if buf:
+        yield "".join(buf).strip()
+
+def summarize_chunk(text_chunk, model=MODEL, max_tokens=None, template_id="chunk_summary", deadline=None):
     """
     Wywołanie pojedynczego podsumowania z retry i backoffem.
+    Przerwy między próbami nie wychodzą poza `deadline`; przy otwartym breakerze
+    czekamy tylko do próby half-open zamiast pełnego backoffu.
     Zwraca tekst podsumowania lub rzuca wyjątek po przekroczeniu prób.
     """
-    prompt = (
-        "Przeczytaj poniższe notatki i stwórz krótkie (2-4 akapity) podsumowanie oraz 5 kluczowych obserwacji:\n\n"
-        f"{text_chunk}\n\n"
-        "Wynik podaj w czytelnym, wypunktowanym formacie."
-    )
+    template = get_template(template_id)
+    messages = template.render(text=text_chunk)
+    max_tokens = max_tokens or template.max_tokens
+    deadline = deadline or Deadline(BATCH_DEADLINE_S)
 
     max_attempts = 5
     base_sleep = 5  # sekundy
     for attempt in range(1, max_attempts+1):
         try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2,
-                max_tokens=max_tokens,
-            )
-            return extract_choice_text(resp)
+            return chat_completion(llm_backend, model, messages, template.temperature, max_tokens, deadline=deadline)
+        except DeadlineExceeded:
+            raise
+        except CircuitOpenError as e:
+            sleep_time = groq_breaker.snapshot()["retry_in_s"] + random.uniform(0, 1)
+            print(f"[WARN] {e}. Próba {attempt}/{max_attempts}. Czekam {int(sleep_time)}s.")
         except Exception as e:
-            err_str = str(e).lower()
-            is_rate_limit = "rate limit" in err_str or "429" in err_str or "tokens" in err_str and "limit" in err_str
             # dłuższe czekanie przy 429
-            if is_rate_limit:
+            if classify_error(e) == "rate_limit":
                 sleep_time = 60 * attempt + random.uniform(0, 10)  # rosnąco: 60s, 120s, 180s...
                 print(f"[WARN] Wykryto limit (429). Próba {attempt}/{max_attempts}. Czekam {int(sleep_time)}s przed retry.")
             else:
                 # wykładniczy backoff z jitter
                 sleep_time = base_sleep * (2 ** (attempt - 1)) + random.uniform(0, 3)
                 print(f"[WARN] Błąd wywołania Groq (próba {attempt}/{max_attempts}): {e}. Czekam {int(sleep_time)}s.")
-            time.sleep(sleep_time)
 
-            # Jeżeli mamy fallback model i to nie była ostatnia próba, spróbuj zmniejszyć model
-            if FALLBACK_MODEL and attempt >= 3:
-                print(f"[INFO] Próba użycia fallback modelu: {FALLBACK_MODEL}")
-                model = FALLBACK_MODEL
+        if attempt == max_attempts:
+            break
+        if sleep_time >= deadline.remaining():
+            raise DeadlineExceeded("Deadline przebiegu upłynie przed kolejną próbą - przerywam.")
+        time.sleep(sleep_time)
+
+        # Jeżeli mamy fallback model i to nie była ostatnia próba, spróbuj zmniejszyć model
+        if FALLBACK_MODEL and attempt >= 3:
+            print(f"[INFO] Próba użycia fallback modelu: {FALLBACK_MODEL}")
+            model = FALLBACK_MODEL
 
     raise RuntimeError("Nie udało się wygenerować podsumowania po kilku próbach.")
 
-def summarize_hierarchical(full_text, chunk_chars=15000, max_tokens_chunk=800, final_max_tokens=900):
+def summarize_hierarchical(full_text: Union[str, Iterable[str]], chunk_chars=15000, max_tokens_chunk=800,
+                           final_max_tokens=900, deadline: Optional[Deadline] = None):
     """
     Dla długich notatek: dzieli, podsumowuje każdy kawałek, łączy krótkie podsumowania i generuje finalne podsumowanie.
+    `full_text` to tekst albo strumień gotowych kawałków (chunk_notes) - wtedy kolejne
+    kawałki powstają w trakcie podsumowywania poprzednich. `deadline` to budżet całego
+    przebiegu, jeśli po tym wywołaniu są jeszcze kolejne kroki (domyślnie nowy).
     """
-    chunks = chunk_text(full_text, max_chars=chunk_chars)
-    print(f"[INFO] Podzielono na {len(chunks)} chunk(ów).")
-    if len(chunks) == 1:
-        return summarize_chunk(chunks[0], max_tokens=max_tokens_chunk)
+    deadline = deadline or Deadline(BATCH_DEADLINE_S)
+    chunks = iter(chunk_text(full_text, max_chars=chunk_chars) if isinstance(full_text, str) else full_text)
+    head = list(itertools.islice(chunks, 2))
+    if not head:
+        raise ValueError("Brak tekstu do podsumowania")
+    if len(head) == 1:
+        print("[INFO] Jeden chunk.")
+        return summarize_chunk(head[0], max_tokens=max_tokens_chunk, deadline=deadline)
 
     # 1) Podsumuj każdy chunk osobno
     chunk_summaries = []
-    for i, c in enumerate(chunks, start=1):
-        print(f"[INFO] Podsumowuję chunk {i}/{len(chunks)} (ok. {len(c)} znaków)...")
-        s = summarize_chunk(c, max_tokens=max_tokens_chunk)
+    for i, c in enumerate(itertools.chain(head, chunks), start=1):
+        print(f"[INFO] Podsumowuję chunk {i} (ok. {len(c)} znaków)...")
+        s = summarize_chunk(c, max_tokens=max_tokens_chunk, deadline=deadline)
         chunk_summaries.append(f"Chunk {i} podsumowanie:\n{s}")
 
     # 2) Połącz krótkie podsumowania i zrób finalne podsumowanie
     combined = "\n\n".join(chunk_summaries)
-    final_prompt_preamble = (
-        "Masz poniżej zebrane krótkie podsumowania części notatek. Stwórz z nich jedno spójne, krótkie podsumowanie i 5 najważniejszych obserwacji/akcji.\n\n"
-    )
-    final_text = final_prompt_preamble + combined
     print("[INFO] Tworzę finalne podsumowanie z podsumowań częściowych...")
-    final_summary = summarize_chunk(final_text, max_tokens=final_max_tokens)
+    final_summary = summarize_chunk(combined, max_tokens=final_max_tokens, template_id="chunk_merge", deadline=deadline)
     return final_summary
 
+# === TRYB PRZYROSTOWY ===
+class SummaryManifest:
+    """Which inputs (by content hash) are already covered by a summary, and the latest summary state."""
+
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        self.store.ensure_schema(SUMMARY_MANIFEST_SCHEMA[self.store.kind] + SUMMARY_INPUTS_SCHEMA)
+
+    def covered(self) -> Set[str]:
+        return {r["digest"] for r in self.store.execute("SELECT digest FROM summary_inputs")}
+
+    def last_run(self) -> Optional[Dict[str, Any]]:
+        rows = self.store.execute("SELECT * FROM summary_runs ORDER BY id DESC LIMIT 1")
+        return rows[0] if rows else None
+
+    def record_run(self, summary_file: str, summary: str, notes: List[Dict[str, Any]]) -> int:
+        """Store the new summary state and mark its inputs covered - in one transaction."""
+        now = datetime.datetime.now().isoformat()
+        with self.store.transaction(write=True) as cur:
+            cur.execute("INSERT INTO summary_runs (created_at, summary_file, inputs, summary) VALUES (?, ?, ?, ?) "
+                        "RETURNING id", (now, summary_file, len(notes), summary))
+            run_id = int(cur.fetchone()["id"])
+            cur.executemany(
+                "INSERT INTO summary_inputs (digest, name, kind, run_id, covered_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (digest) DO NOTHING",
+                [(n["digest"], n["name"], n["kind"], run_id, now) for n in notes],
+            )
+        return run_id
+
+
+@contextmanager
+def _single_run(path: str):
+    """Only one incremental run at a time; a run started meanwhile exits immediately."""
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_summary(result: str) -> str:
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    summary_file = os.path.join(SUMMARY_FOLDER, f"summary_{timestamp}.txt")
+    n = 1
+    # przebiegi co kilka minut mogą trafić w tę samą sekundę - nie nadpisujemy stanu
+    while os.path.exists(summary_file):
+        n += 1
+        summary_file = os.path.join(SUMMARY_FOLDER, f"summary_{timestamp}_{n}.txt")
+    tmp = summary_file + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(result)
+    os.replace(tmp, summary_file)
+    return summary_file
+
+
+def run_incremental(folders: Optional[List[str]] = None, fetch: bool = True,
+                    manifest: Optional[SummaryManifest] = None, username: Optional[str] = NOTES_OWNER,
+                    artifacts=None, max_inputs: int = SUMMARY_MAX_INPUTS_PER_RUN) -> Optional[str]:
+    """
+    Podsumowuje tylko nowe wejścia i scala wynik z dotychczasowym podsumowaniem.
+    Wejścia to pliki z `folders` oraz transkrypcje użytkownika `username` z indeksu
+    artefaktów (None = tylko foldery); jeden deadline obejmuje chunki i scalanie.
+    Przebieg bierze najwyżej `max_inputs` nowych wejść (0 = wszystkie) i od razu
+    zapisuje ich stan; resztę scalają kolejne przebiegi, więc zaległość nie musi
+    zmieścić się w jednym BATCH_DEADLINE_S ani w limicie zadania harmonogramu.
+    Niczego nie usuwa; wejścia są oznaczane jako pokryte dopiero po zapisaniu nowego
+    stanu, więc błąd w trakcie oznacza tylko powtórkę przy następnym przebiegu.
+    Zwraca ścieżkę nowego podsumowania albo None, gdy nie było nic nowego.
+    """
+    with _single_run(os.path.join(SUMMARY_FOLDER, ".incremental.lock")) as acquired:
+        if not acquired:
+            print("[INFO] Poprzedni przebieg jeszcze trwa - pomijam.")
+            return None
+        if fetch:
+            try:
+                from gdrive_fetch import fetch_notes_from_drive
+                fetch_notes_from_drive()
+            except Exception as e:
+                print(f"[WARN] Synchronizacja z Drive nie powiodła się, używam lokalnych plików: {e}")
+
+        manifest = manifest or SummaryManifest()
+        covered = manifest.covered()
+        taken: List[Dict[str, Any]] = []
+        state = {"more": False}
+
+        def sources():
+            for folder in folders or SUMMARY_INPUT_FOLDERS:
+                yield from iter_notes(folder, skip=covered)
+            if username:
+                yield from iter_transcripts(username, skip=covered, artifacts=artifacts)
+
+        def new_notes():
+            for note in sources():
+                # ten sam plik w dwóch folderach / nagranie z aplikacji, którego tekst jest w folderze - raz
+                if note["digest"] in covered:
+                    continue
+                if max_inputs and len(taken) >= max_inputs:
+                    # zamknięcie generatorów anuluje transkrypcje czekające w oknie iter_notes
+                    state["more"] = True
+                    return
+                covered.add(note["digest"])
+                taken.append(note)
+                yield note
+
+        deadline = Deadline(BATCH_DEADLINE_S)
+        chunks = chunk_notes(new_notes())
+        first = next(chunks, None)
+        if first is None:
+            print("Brak nowych notatek.")
+            return None
+
+        partial = summarize_hierarchical(itertools.chain([first], chunks), max_tokens_chunk=800, final_max_tokens=900,
+                                         deadline=deadline)
+        previous = manifest.last_run()
+        if previous:
+            result = summarize_chunk(f"Dotychczasowe podsumowanie:\n{previous['summary']}\n\n"
+                                     f"Podsumowanie nowych notatek:\n{partial}",
+                                     template_id="summary_update", deadline=deadline)
+        else:
+            result = partial
+
+        summary_file = _write_summary(result)
+        run_id = manifest.record_run(summary_file, result, taken)
+        print(f"✅ Przebieg {run_id}: {len(taken)} nowych wejść, podsumowanie w {summary_file}")
+        if state["more"]:
+            print(f"[INFO] Limit {max_inputs} wejść na przebieg - pozostałe scali kolejny przebieg.")
+        return summary_file
+
+
 def cleanup_notes(folder):
     for fname in os.listdir(folder):
         fpath = os.path.join(folder, fname)
@@ -197,21 +508,40 @@ def cleanup_notes(folder):
 
 # === MAIN ===
 def main():
+    p = argparse.ArgumentParser(description="Podsumowanie notatek z Google Drive")
+    p.add_argument("--incremental", action="store_true",
+                   help="tylko nowe notatki, scalane z poprzednim podsumowaniem; nic nie jest usuwane")
+    p.add_argument("--no-fetch", action="store_true", help="bez synchronizacji z Drive")
+    p.add_argument("--user", default=NOTES_OWNER,
+                   help="czyje transkrypcje z aplikacji dołączyć w trybie --incremental (domyślnie NOTES_OWNER)")
+    p.add_argument("--max-inputs", type=int, default=SUMMARY_MAX_INPUTS_PER_RUN,
+                   help="limit nowych wejść na przebieg --incremental (0 = bez limitu)")
+    args = p.parse_args()
+    if args.incremental:
+        try:
+            run_incremental(fetch=not args.no_fetch, username=args.user or None, max_inputs=args.max_inputs)
+        except Exception as e:
+            # wejścia nie zostały oznaczone - następny przebieg je powtórzy
+            print(f"[ERROR] Przebieg przyrostowy nie powiódł się: {e}")
+            return 1
+        return
+
     # 1️⃣ Pobierz notatki z Google Drive
     print("Pobieram pliki z Google Drive...")
     from gdrive_fetch import fetch_notes_from_drive
     fetch_notes_from_drive()  # <- zamiast gdrive_fetch.main()
 
-    # 2️⃣ Wczytaj notatki + audio i transkrypcje
-    notes = read_all_notes(NOTES_FOLDER)
-    if not notes:
+    # 2️⃣ Wczytaj notatki + audio i transkrypcje (strumieniowo, audio w puli procesów)
+    chunks = chunk_notes(iter_notes(NOTES_FOLDER))
+    first = next(chunks, None)
+    if first is None:
         print("Brak notatek do przetworzenia.")
         return
 
     # 3️⃣ Wysyłamy do Groq (hierarchiczne)
     print("Wysyłam dane do modelu:", MODEL)
     try:
-        result = summarize_hierarchical(notes, chunk_chars=15000, max_tokens_chunk=800, final_max_tokens=900)
+        result = summarize_hierarchical(itertools.chain([first], chunks), max_tokens_chunk=800, final_max_tokens=900)
     except Exception as e:
         print(f"[ERROR] Nie udało się wygenerować podsumowania: {e}")
         return
@@ -230,4 +560,4 @@ def main():
     cleanup_notes(NOTES_FOLDER)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,27 @@
+import os
+from typing import Optional
+
+# tiktoken nie zna tokenizera Llamy, ale cl100k_base daje wystarczająco dobre
+# przybliżenie do budżetowania promptów. Bez tiktoken liczymy ~4 znaki/token.
+TOKEN_ENCODING = os.environ.get("TOKEN_ENCODING", "cl100k_base")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Estimate the number of prompt tokens in `text`."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        try:
+            return len(_encoding.encode(text))
+        except Exception:
+            pass
+    return max(1, (len(text) + 3) // 4)
+
+
+__all__ = ["count_tokens"]
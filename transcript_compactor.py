@@ -0,0 +1,151 @@
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tokens import count_tokens
+
+# === KONFIGURACJA ===
+# COMPACTION_ENABLED=0 wyłącza kompakcję (prompt dostaje surową transkrypcję)
+COMPACTION_ENABLED = os.environ.get("COMPACTION_ENABLED", "1") != "0"
+# plik z leksykonem wypełniaczy: jedna fraza na linię, '#' = komentarz,
+# '~fraza' = wypełniacz zależny od pozycji (patrz DEFAULT_FILLERS)
+COMPACTION_FILLERS_PATH = os.environ.get("COMPACTION_FILLERS_PATH")
+# najdłuższy powtórzony n-gram, który zwijamy ("to to to" -> "to"); 0 = wyłączone
+COMPACTION_MAX_NGRAM = int(os.environ.get("COMPACTION_MAX_NGRAM", "3"))
+# ile razy z rzędu n-gram musi wystąpić, żeby go zwinąć; podwojenie ("bardzo bardzo") to zwykle emfaza
+COMPACTION_MIN_REPEATS = int(os.environ.get("COMPACTION_MIN_REPEATS", "3"))
+
+# czyste wahania usuwamy wszędzie; "no" i "znaczy" ("~") tylko na początku transkrypcji
+# albo tuż przy wahaniu ("yyy no", "znaczy eee") - w środku zdania niosą treść
+# ("no dobrze", "to znaczy, że"). "jakby", "aha", "yhm" (= potwierdzenie) zostają.
+DEFAULT_FILLERS = ("yyy", "yy", "eee", "ee", "mmm", "mm", "~no", "~znaczy")
+
+# przeciągnięte samogłoski/mruczenie rozpoznane przez Vosk jako osobne "słowa"
+_HESITATION_RE = re.compile(r"^(y{2,}|e{2,}|m{2,})$")
+_WORD_RE = re.compile(r"\S+")
+
+# leksykon z pliku: ścieżka -> (mtime, frazy); czytany ponownie tylko po zmianie pliku
+_fillers_cache: Dict[str, Tuple[float, List[str]]] = {}
+_fillers_lock = threading.Lock()
+
+
+def load_fillers(path: Optional[str] = None) -> List[str]:
+    """Return the filler lexicon from `path` (or COMPACTION_FILLERS_PATH), falling back to the defaults.
+
+    The file is cached and only re-read when its mtime changes.
+    """
+    path = path or COMPACTION_FILLERS_PATH
+    if not path:
+        return list(DEFAULT_FILLERS)
+    try:
+        mtime = os.path.getmtime(path)
+        with _fillers_lock:
+            cached = _fillers_cache.get(path)
+        if cached and cached[0] == mtime:
+            return list(cached[1])
+        with open(path, "r", encoding="utf-8") as f:
+            fillers = [line.strip().lower() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        fillers = fillers or list(DEFAULT_FILLERS)
+        with _fillers_lock:
+            _fillers_cache[path] = (mtime, fillers)
+        return list(fillers)
+    except Exception as e:
+        print(f"Warning: could not read filler lexicon {path}: {e}")
+        return list(DEFAULT_FILLERS)
+
+
+def _filler_phrases(fillers: Iterable[str]) -> List[Tuple[Tuple[str, ...], bool]]:
+    """Return `(phrase, positional)` pairs; positional ones are marked with '~' in the lexicon."""
+    phrases = {(tuple(f.lstrip("~").split()), f.startswith("~")) for f in fillers if f.lstrip("~").strip()}
+    # najdłuższe frazy najpierw, żeby "no wiesz" wygrało z "no"
+    return sorted(phrases, key=lambda p: len(p[0]), reverse=True)
+
+
+def _strip_fillers(words: List[str], phrases: List[Tuple[Tuple[str, ...], bool]]) -> Tuple[List[str], int]:
+    out = []
+    removed = 0
+    i = 0
+    lowered = [w.lower() for w in words]
+    while i < len(words):
+        if _HESITATION_RE.match(lowered[i]):
+            removed += 1
+            i += 1
+            continue
+        for phrase, positional in phrases:
+            n = len(phrase)
+            if tuple(lowered[i:i + n]) != phrase:
+                continue
+            if positional and not (i == 0 or _HESITATION_RE.match(lowered[i - 1])
+                                   or (i + n < len(words) and _HESITATION_RE.match(lowered[i + n]))):
+                continue
+            removed += n
+            i += n
+            break
+        else:
+            out.append(words[i])
+            i += 1
+    return out, removed
+
+
+def _collapse_repeats(words: List[str], max_ngram: int, min_repeats: int) -> Tuple[List[str], int]:
+    """Keep one copy of an n-gram repeated at least `min_repeats` times in a row (stutter, "to to to")."""
+    out: List[str] = []
+    lowered = [w.lower() for w in words]
+    collapsed = 0
+    i = 0
+    while i < len(words):
+        for n in range(min(max_ngram, (len(words) - i) // max(min_repeats, 1)), 0, -1):
+            gram = lowered[i:i + n]
+            k = 1
+            while lowered[i + k * n:i + (k + 1) * n] == gram:
+                k += 1
+            if k >= min_repeats:
+                out.extend(words[i:i + n])
+                collapsed += n * (k - 1)
+                i += n * k
+                break
+        else:
+            out.append(words[i])
+            i += 1
+    return out, collapsed
+
+
+def compact_transcript(text: str, fillers: Optional[Iterable[str]] = None, max_ngram: Optional[int] = None,
+                       min_repeats: Optional[int] = None) -> Tuple[str, Dict[str, int]]:
+    """Deterministically compact a Vosk transcript before it goes into a prompt.
+
+    Removes hesitation tokens and the lexicon's fillers ("no"/"znaczy" only at
+    the start or next to a hesitation), collapses n-grams of up to
+    COMPACTION_MAX_NGRAM words repeated COMPACTION_MIN_REPEATS or more times
+    in a row to one copy and normalizes whitespace. A plain doubling is kept,
+    since it is usually emphasis. The raw transcript on disk is never touched;
+    callers only use the returned text for prompting.
+
+    Returns `(compact_text, stats)` where `stats` reports the token savings.
+    """
+    text = text or ""
+    original_tokens = count_tokens(text)
+    words = _WORD_RE.findall(text)
+
+    phrases = _filler_phrases(fillers if fillers is not None else load_fillers())
+    words, removed_fillers = _strip_fillers(words, phrases)
+    max_ngram = COMPACTION_MAX_NGRAM if max_ngram is None else max_ngram
+    min_repeats = COMPACTION_MIN_REPEATS if min_repeats is None else min_repeats
+    collapsed_repeats = 0
+    if max_ngram > 0:
+        words, collapsed_repeats = _collapse_repeats(words, max_ngram, max(2, min_repeats))
+
+    compact = " ".join(words)
+    compact_tokens = count_tokens(compact)
+    stats = {
+        "original_tokens": original_tokens,
+        "compact_tokens": compact_tokens,
+        "saved_tokens": original_tokens - compact_tokens,
+        "removed_fillers": removed_fillers,
+        "collapsed_repeats": collapsed_repeats,
+    }
+    return compact, stats
+
+
+__all__ = ["compact_transcript", "load_fillers", "DEFAULT_FILLERS", "COMPACTION_ENABLED"]
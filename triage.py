@@ -0,0 +1,291 @@
+"""Local, CPU-only triage of transcripts before they reach the large model.
+
+Each transcript gets a signal score from a keyword lexicon (emotional content,
+risk) combined with an optional TF-IDF + logistic regression model trained with
+NumPy on our stored notes. The score routes the note to one of three tiers:
+
+- "template": (almost) nothing was said - canned reply, no LLM call
+- "small":    low-signal note - small, fast model
+- "large":    substantive or risky note - full model
+
+Usage:
+  python triage.py train [--labels labels.jsonl]
+  python triage.py score path/to/transcript.txt
+"""
+import os
+import re
+import json
+import math
+import argparse
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except Exception:  # bez numpy działa sam leksykon
+    np = None
+
+# === KONFIGURACJA ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRIAGE_ENABLED = os.environ.get("TRIAGE_ENABLED", "1") != "0"
+TRIAGE_MODEL_PATH = os.environ.get("TRIAGE_MODEL_PATH", os.path.join(BASE_DIR, "triage_model.json"))
+TRIAGE_LOW = float(os.environ.get("TRIAGE_LOW", "0.35"))
+TRIAGE_MIN_WORDS = int(os.environ.get("TRIAGE_MIN_WORDS", "4"))
+LARGE_MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
+SMALL_MODEL = os.environ.get("GROQ_SMALL_MODEL", "llama-3.1-8b-instant")
+
+TIERS = ("template", "small", "large")
+
+# rdzenie słów -> waga; dopasowanie po prefiksie, więc "lęk" łapie "lęku", "lękowy"
+EMOTION_LEXICON = {
+    "smut": 1.0, "płak": 1.0, "lęk": 1.0, "boj": 0.8, "strach": 0.8, "stres": 0.8,
+    "złość": 0.8, "zły": 0.6, "zła": 0.6, "wściek": 0.8, "wstyd": 0.8, "wina": 0.6, "winn": 0.6,
+    "samotn": 1.0, "tęskn": 0.6, "zmęcz": 0.5, "bezsen": 0.8, "nie śpi": 0.8, "panik": 1.0,
+    "kłót": 0.6, "rozstan": 0.8, "nadziej": 0.4, "szczęśl": 0.4, "cieszę": 0.4,
+    "żal": 0.6, "bezradn": 1.0, "beznadziej": 1.0, "nie chcę": 0.5, "nie radzę": 1.0,
+}
+# słowa ryzyka zawsze kierują do dużego modelu
+RISK_LEXICON = (
+    "samobój", "zabić się", "zabije się", "nie chcę żyć", "skończyć ze sobą", "okalecz", "ciąć się",
+    "hazard", "uzależn", "alkohol", "pijany", "narkot", "przemoc", "bije mnie", "depres",
+)
+
+TEMPLATE_RESPONSE = (
+    "Dziękuję za nagranie. Tym razem nie udało się usłyszeć wiele treści - "
+    "jeśli masz ochotę, opowiedz trochę więcej o tym, co myślisz i czujesz, "
+    "a chętnie przyjrzę się temu razem z Tobą."
+)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_stats_lock = threading.Lock()
+_tier_counts: Counter = Counter()
+_model_cache: Dict[str, object] = {}
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def lexicon_score(text: str) -> Tuple[float, bool]:
+    """Return `(emotion score in [0, 1], risk flag)` for `text`."""
+    lowered = " ".join(tokenize(text))
+    risk = any(term in lowered for term in RISK_LEXICON)
+    words = lowered.split()
+    hits = 0.0
+    for stem, weight in EMOTION_LEXICON.items():
+        if " " in stem:
+            hits += weight * lowered.count(stem)
+        else:
+            hits += weight * sum(1 for w in words if w.startswith(stem))
+    # nasycenie: kilka trafień wystarcza na wysoki wynik
+    return 1.0 - math.exp(-hits / 1.5), risk
+
+
+# === TF-IDF + regresja logistyczna (NumPy) ===
+class TfidfLogistic:
+    def __init__(self, vocab: Dict[str, int], idf, weights, bias: float):
+        self.vocab = vocab
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+
+    def _features(self, texts: List[str]):
+        X = np.zeros((len(texts), len(self.vocab)), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for tok, cnt in Counter(tokenize(text)).items():
+                col = self.vocab.get(tok)
+                if col is not None:
+                    X[row, col] = 1.0 + math.log(cnt)
+        X *= self.idf
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return X / norms
+
+    def predict_proba(self, text: str) -> float:
+        z = float(self._features([text])[0] @ self.weights + self.bias)
+        return 1.0 / (1.0 + math.exp(-z))
+
+    @classmethod
+    def train(cls, texts: List[str], labels: List[int], min_df: int = 2, epochs: int = 300,
+              lr: float = 0.5, l2: float = 1e-3) -> "TfidfLogistic":
+        df = Counter()
+        for t in texts:
+            df.update(set(tokenize(t)))
+        terms = sorted(t for t, c in df.items() if c >= min_df) or sorted(df)
+        vocab = {t: i for i, t in enumerate(terms)}
+        n = len(texts)
+        idf = np.array([math.log((1 + n) / (1 + df[t])) + 1.0 for t in terms], dtype=np.float32)
+        model = cls(vocab, idf, np.zeros(len(terms), dtype=np.float32), 0.0)
+        X = model._features(texts)
+        y = np.asarray(labels, dtype=np.float32)
+        w = model.weights
+        b = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+            grad = p - y
+            w -= lr * (X.T @ grad / n + l2 * w)
+            b -= lr * float(grad.mean())
+        model.weights, model.bias = w, b
+        return model
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "vocab": self.vocab,
+                "idf": self.idf.tolist(),
+                "weights": self.weights.tolist(),
+                "bias": self.bias,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "TfidfLogistic":
+        with open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        return cls(d["vocab"], np.asarray(d["idf"], dtype=np.float32),
+                   np.asarray(d["weights"], dtype=np.float32), float(d["bias"]))
+
+
+def _load_model(path: str = TRIAGE_MODEL_PATH) -> Optional[TfidfLogistic]:
+    if np is None or not os.path.exists(path):
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+        cached = _model_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        model = TfidfLogistic.load(path)
+        _model_cache[path] = (mtime, model)
+        return model
+    except Exception as e:
+        print(f"Warning: could not load triage model {path}: {e}")
+        return None
+
+
+def triage(text: str) -> Dict:
+    """Score a transcript and pick a tier and model for it.
+
+    The decision is recorded in the per-process tier counters (see `tier_stats`).
+    """
+    words = tokenize(text)
+    lex, risk = lexicon_score(text)
+    model = _load_model()
+    prob = model.predict_proba(text) if model is not None else None
+    score = lex if prob is None else 0.5 * lex + 0.5 * prob
+
+    if not TRIAGE_ENABLED or risk:
+        tier = "large"
+    elif len(words) < TRIAGE_MIN_WORDS:
+        tier = "template"
+    elif score < TRIAGE_LOW:
+        tier = "small"
+    else:
+        tier = "large"
+
+    with _stats_lock:
+        _tier_counts[tier] += 1
+    return {
+        "tier": tier,
+        "model": {"template": None, "small": SMALL_MODEL, "large": LARGE_MODEL}[tier],
+        "score": round(score, 4),
+        "lexicon": round(lex, 4),
+        "model_proba": None if prob is None else round(prob, 4),
+        "risk": risk,
+    }
+
+
+def tier_stats() -> Dict:
+    with _stats_lock:
+        counts = {t: _tier_counts.get(t, 0) for t in TIERS}
+    total = sum(counts.values())
+    return {
+        "counts": counts,
+        "total": total,
+        "share": {t: (c / total if total else 0.0) for t, c in counts.items()},
+        "model_loaded": _load_model() is not None,
+    }
+
+
+# === TRENING ===
+def _collect_training_texts(folders: List[str]) -> List[str]:
+    texts = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for root, _, files in os.walk(folder):
+            for fname in sorted(files):
+                if not fname.endswith(".txt"):
+                    continue
+                try:
+                    with open(os.path.join(root, fname), "r", encoding="utf-8") as f:
+                        txt = f.read().strip()
+                except Exception:
+                    continue
+                if txt:
+                    texts.append(txt)
+    return texts
+
+
+def _load_labels(path: str) -> Tuple[List[str], List[int]]:
+    texts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            text = rec.get("text")
+            if text is None and rec.get("file"):
+                with open(rec["file"], "r", encoding="utf-8") as tf:
+                    text = tf.read()
+            texts.append(text or "")
+            labels.append(int(rec["label"]))
+    return texts, labels
+
+
+def train_from_store(folders: List[str], labels_path: Optional[str] = None, out_path: str = TRIAGE_MODEL_PATH) -> Optional[TfidfLogistic]:
+    """Train on stored notes. Without a labels file the lexicon provides weak labels."""
+    if np is None:
+        print("Brak numpy - trening modelu triage niemożliwy")
+        return None
+    if labels_path:
+        texts, labels = _load_labels(labels_path)
+    else:
+        texts = _collect_training_texts(folders)
+        labels = []
+        for t in texts:
+            lex, risk = lexicon_score(t)
+            labels.append(1 if risk or lex >= TRIAGE_LOW else 0)
+    if len(set(labels)) < 2:
+        print(f"Za mało zróżnicowanych przykładów do treningu ({len(texts)} tekstów)")
+        return None
+    model = TfidfLogistic.train(texts, labels)
+    model.save(out_path)
+    print(f"✅ Model triage zapisany w {out_path} ({len(texts)} tekstów, {len(model.vocab)} termów)")
+    return model
+
+
+def main():
+    p = argparse.ArgumentParser(description="Local transcript triage")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    t = sub.add_parser("train")
+    t.add_argument("--labels", default=None, help="JSONL with {text|file, label}")
+    t.add_argument("--out", default=TRIAGE_MODEL_PATH)
+    t.add_argument("folders", nargs="*", default=[os.path.join(BASE_DIR, "notes_data"),
+                                                   os.path.join(BASE_DIR, "summary_data"),
+                                                   os.path.join(BASE_DIR, "data")])
+    s = sub.add_parser("score")
+    s.add_argument("path")
+    args = p.parse_args()
+
+    if args.cmd == "train":
+        train_from_store(args.folders, args.labels, args.out)
+    else:
+        with open(args.path, "r", encoding="utf-8") as f:
+            print(json.dumps(triage(f.read()), ensure_ascii=False, indent=2))
+
+
+__all__ = ["triage", "tier_stats", "lexicon_score", "TfidfLogistic", "TEMPLATE_RESPONSE", "TIERS"]
+
+if __name__ == "__main__":
+    main()